@@ -0,0 +1,244 @@
+import argparse
+import asyncio
+import json
+import logging
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+from batch_indicators import stack_frames, compute_indicators
+from signal_model import vote_matrix
+
+# Бэктест smart_trade_signal на истории: голоса индикаторов, фильтр тренда,
+# стоп-лосс и тейк-профит считаются массивами сразу для всех свечей и монет
+# (batch_indicators + signal_model.vote_matrix), выходы по SL/TP — по окнам
+# следующих свечей без цикла по времени. Вход — по закрытию свечи с сигналом.
+
+# Окно свечей, на котором get_forecast считает поддержку (минимум low)
+FORECAST_WINDOW = 300
+# Сколько первых свечей пропустить, пока EMA200 не разогрелась
+WARMUP = 200
+# Сделка закрывается по close, если за столько свечей не сработали SL/TP
+MAX_HOLD = 96
+# Комиссия за сторону сделки (тейкер Binance)
+DEFAULT_FEE = 0.0004
+# Пачка входов при расчёте выходов — ограничивает память (входы × MAX_HOLD)
+EXIT_CHUNK = 20000
+# Параметры SL/TP — как в smart_trade_signal
+ATR_STOP, FALLBACK_STOP, MIN_STOP, TAKE_PROFIT_RATIO = 1.5, 0.015, 0.005, 2.0
+
+
+def trend_matrix(close: np.ndarray, indicators: Dict[str, np.ndarray]) -> np.ndarray:
+    """
+    Тренд на каждой свече: True — бычий. В get_forecast тренд берётся из сводки
+    скользящих TradingView (BUY > SELL); на истории её нет, поэтому голосуют
+    EMA50/100/200: цена выше большинства из них — бычий тренд.
+    """
+    above = sum((close > indicators[k]).astype(int) for k in ("EMA50", "EMA100", "EMA200"))
+    below = sum((close < indicators[k]).astype(int) for k in ("EMA50", "EMA100", "EMA200"))
+    return above > below
+
+
+def signal_matrix(votes: np.ndarray, bullish: np.ndarray) -> np.ndarray:
+    """
+    Итоговый сигнал smart_trade_signal на каждой свече: 1 — BUY, -1 — SELL, 0 — HOLD.
+    :param votes: Голоса монета × время × признак (vote_matrix)
+    :param bullish: Тренд монета × время (trend_matrix)
+    """
+    buy = (votes > 0).sum(axis=-1)
+    sell = (votes < 0).sum(axis=-1)
+    # Голос против тренда отменяет сигнал целиком
+    blocked = np.where(bullish, sell > 0, buy > 0)
+    signal = np.where(buy >= 2, 1, np.where(sell >= 2, -1, 0))
+    return np.where(blocked, 0, signal).astype(np.int8)
+
+
+def stop_distance(arrays: Dict[str, np.ndarray], indicators: Dict[str, np.ndarray], window: int = FORECAST_WINDOW) -> np.ndarray:
+    """
+    Расстояние до стоп-лосса на каждой свече по правилам smart_trade_signal
+    (тейк-профит — вдвое дальше): min(1.5 × ATR, цена − поддержка), но не меньше 0.5% цены.
+    """
+    close = arrays["close"]
+    support = pd.DataFrame(arrays["low"].T).rolling(window, min_periods=1).min().to_numpy().T
+    atr = indicators["ATR"]
+    by_atr = np.where(np.isnan(atr) | (atr == 0), close * FALLBACK_STOP, atr * ATR_STOP)
+    stop = np.minimum(by_atr, np.abs(close - support))
+    return np.maximum(stop, close * MIN_STOP)
+
+
+def simulate_exits(high: np.ndarray, low: np.ndarray, close: np.ndarray, entries: np.ndarray,
+                   sides: np.ndarray, stops: np.ndarray, max_hold: int = MAX_HOLD) -> Dict[str, np.ndarray]:
+    """
+    Выходы сделок одной монеты. Сделка открыта по close[entry] и закрывается на
+    первой из следующих max_hold свечей, где цена дошла до SL или TP (если в одной
+    свече оба — считается SL), иначе по close через max_hold свечей.
+    :param entries: Индексы свечей входа (entry + max_hold < len(close))
+    :param sides: 1 — лонг, -1 — шорт
+    :param stops: Расстояние до стоп-лосса в цене
+    :return: {"exit": индекс свечи выхода, "price": цена выхода, "reason": 1 — TP, -1 — SL, 0 — по времени}
+    """
+    highs = sliding_window_view(high[1:], max_hold)
+    lows = sliding_window_view(low[1:], max_hold)
+    exit_index = np.empty(len(entries), dtype=np.int64)
+    exit_price = np.empty(len(entries))
+    reason = np.empty(len(entries), dtype=np.int8)
+    for start in range(0, len(entries), EXIT_CHUNK):
+        part = slice(start, start + EXIT_CHUNK)
+        e, side, stop = entries[part], sides[part], stops[part]
+        entry = close[e]
+        sl = entry - side * stop
+        tp = entry + side * stop * TAKE_PROFIT_RATIO
+        h, l = highs[e], lows[e]
+        long = (side > 0)[:, None]
+        hit_sl = np.where(long, l <= sl[:, None], h >= sl[:, None])
+        hit_tp = np.where(long, h >= tp[:, None], l <= tp[:, None])
+        first_sl = np.where(hit_sl.any(axis=1), hit_sl.argmax(axis=1), max_hold)
+        first_tp = np.where(hit_tp.any(axis=1), hit_tp.argmax(axis=1), max_hold)
+        by_sl = (first_sl < max_hold) & (first_sl <= first_tp)
+        by_tp = ~by_sl & (first_tp < max_hold)
+        step = np.where(by_sl, first_sl, np.where(by_tp, first_tp, max_hold - 1))
+        exit_index[part] = e + 1 + step
+        exit_price[part] = np.where(by_sl, sl, np.where(by_tp, tp, close[e + max_hold]))
+        reason[part] = np.where(by_tp, 1, np.where(by_sl, -1, 0))
+    return {"exit": exit_index, "price": exit_price, "reason": reason}
+
+
+def _sequential(entries: np.ndarray, exits: np.ndarray) -> np.ndarray:
+    """
+    Номера сделок, если одновременно открыта одна позиция: следующий вход — не
+    раньше свечи выхода предыдущей. Цикл по сделкам, не по свечам.
+    """
+    taken = []
+    i = 0
+    while i < len(entries):
+        taken.append(i)
+        i = int(np.searchsorted(entries, exits[i], side="left"))
+        if i <= taken[-1]:
+            i = taken[-1] + 1
+    return np.asarray(taken, dtype=np.int64)
+
+
+def trade_stats(returns: np.ndarray, sides: np.ndarray, reasons: np.ndarray) -> dict:
+    """
+    Итоги серии сделок: доля прибыльных, PnL (сложный процент) и максимальная просадка, в %.
+    """
+    if len(returns) == 0:
+        return {"trades": 0, "long": 0, "short": 0, "hit_rate": None, "pnl_pct": 0.0, "max_drawdown_pct": 0.0,
+                "avg_trade_pct": None, "profit_factor": None, "take_profit": 0, "stop_loss": 0, "timeout": 0}
+    equity = np.concatenate([[1.0], np.cumprod(1 + returns)])
+    drawdown = 1 - equity / np.maximum.accumulate(equity)
+    gains = returns[returns > 0].sum()
+    losses = -returns[returns < 0].sum()
+    return {
+        "trades": int(len(returns)),
+        "long": int((sides > 0).sum()),
+        "short": int((sides < 0).sum()),
+        "hit_rate": round(float((returns > 0).mean()), 4),
+        "pnl_pct": round(float(equity[-1] - 1) * 100, 2),
+        "max_drawdown_pct": round(float(drawdown.max()) * 100, 2),
+        "avg_trade_pct": round(float(returns.mean()) * 100, 3),
+        "profit_factor": round(float(gains / losses), 3) if losses > 0 else None,
+        "take_profit": int((reasons == 1).sum()),
+        "stop_loss": int((reasons == -1).sum()),
+        "timeout": int((reasons == 0).sum())
+    }
+
+
+def backtest(frames: Dict[str, pd.DataFrame], fee: float = DEFAULT_FEE, leverage: float = 1.0,
+             max_hold: int = MAX_HOLD, warmup: int = WARMUP, overlap: bool = False) -> Dict[str, dict]:
+    """
+    Бэктест сигналов smart_trade_signal по свечам нескольких монет одного таймфрейма.
+    :param frames: {монета: свечи}
+    :param fee: Комиссия за сторону сделки (доля)
+    :param leverage: Плечо, на которое умножается доходность сделки
+    :param overlap: True — каждая свеча с сигналом открывает сделку (оценка сигнала);
+                    False — одна позиция за раз (оценка стратегии)
+    :return: {монета: итоги trade_stats + число свечей и период}
+    """
+    names, index, arrays = stack_frames(frames)
+    if not names:
+        return {}
+    indicators = compute_indicators(arrays)
+    close, high, low = arrays["close"], arrays["high"], arrays["low"]
+    signals = signal_matrix(vote_matrix(arrays, indicators), trend_matrix(close, indicators))
+    stops = stop_distance(arrays, indicators)
+    seen = np.cumsum(~np.isnan(close), axis=1)
+    result = {}
+    for i, symbol in enumerate(names):
+        valid = ~np.isnan(close[i])
+        last = int(np.flatnonzero(valid)[-1]) if valid.any() else -1
+        candidates = np.flatnonzero((signals[i] != 0) & (seen[i] > warmup) & valid)
+        # На выход нужно max_hold свечей вперёд
+        candidates = candidates[candidates + max_hold <= last]
+        sides = signals[i, candidates].astype(float)
+        exits = simulate_exits(high[i], low[i], close[i], candidates, sides, stops[i, candidates], max_hold)
+        if not overlap and len(candidates):
+            taken = _sequential(candidates, exits["exit"])
+            candidates, sides = candidates[taken], sides[taken]
+            exits = {k: v[taken] for k, v in exits.items()}
+        entry = close[i, candidates]
+        returns = leverage * (sides * (exits["price"] - entry) / entry - 2 * fee)
+        stats = trade_stats(returns, sides, exits["reason"])
+        stats["candles"] = int(valid.sum())
+        if valid.any():
+            stats["from"] = str(index[np.flatnonzero(valid)[0]])
+            stats["to"] = str(index[last])
+        result[symbol] = stats
+    return result
+
+
+async def _load(symbols: List[str], interval: str, days: int) -> Dict[str, pd.DataFrame]:
+    """
+    История из архива свечей: недостающее догружается с Binance, повторный прогон
+    запрашивает только свечи, закрывшиеся с прошлого раза.
+    """
+    from binance_client import close_binance_client
+    from kline_archive import backfill_archive, get_archive
+    start_ms = int(time.time() * 1000) - days * 86_400_000
+    try:
+        await asyncio.gather(*(backfill_archive(s, interval, start_ms) for s in symbols))
+    finally:
+        await close_binance_client()
+    return {s: get_archive(s, interval).frame(start=start_ms) for s in symbols}
+
+
+def _print_table(interval: str, report: Dict[str, dict]) -> None:
+    print(f"\n{interval}: {'монета':<10}{'свечей':>8}{'сделок':>8}{'hit':>7}{'PnL %':>9}{'DD %':>8}{'PF':>7}{'TP/SL/T':>14}")
+    for symbol, s in report.items():
+        hit = f"{s['hit_rate'] * 100:.1f}" if s["hit_rate"] is not None else "—"
+        pf = f"{s['profit_factor']:.2f}" if s["profit_factor"] is not None else "—"
+        exits = f"{s['take_profit']}/{s['stop_loss']}/{s['timeout']}"
+        print(f"{'':<{len(interval) + 2}}{symbol:<10}{s['candles']:>8}{s['trades']:>8}{hit:>7}{s['pnl_pct']:>9.2f}{s['max_drawdown_pct']:>8.2f}{pf:>7}{exits:>14}")
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    from utils import symbols as default_symbols
+    parser = argparse.ArgumentParser(description="Бэктест smart_trade_signal на исторических свечах Binance")
+    parser.add_argument("--intervals", nargs="*", default=["15m", "1h", "4h"])
+    parser.add_argument("--days", type=int, default=365, help="глубина истории в днях")
+    parser.add_argument("--symbols", nargs="*", default=default_symbols)
+    parser.add_argument("--fee", type=float, default=DEFAULT_FEE, help="комиссия за сторону сделки (доля)")
+    parser.add_argument("--leverage", type=float, default=1.0)
+    parser.add_argument("--max-hold", type=int, default=MAX_HOLD, help="свечей до закрытия сделки по времени")
+    parser.add_argument("--overlap", action="store_true", help="открывать сделку на каждой свече с сигналом")
+    parser.add_argument("--output", help="сохранить итоги в JSON")
+    args = parser.parse_args(argv)
+    report = {}
+    for interval in args.intervals:
+        frames = asyncio.run(_load(args.symbols, interval, args.days))
+        started = time.perf_counter()
+        report[interval] = backtest(frames, fee=args.fee, leverage=args.leverage, max_hold=args.max_hold, overlap=args.overlap)
+        candles = sum(len(df) for df in frames.values())
+        logging.info(f"[BACKTEST] {interval}: {len(frames)} монет, {candles} свечей за {time.perf_counter() - started:.2f} с")
+        _print_table(interval, report[interval])
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s | %(levelname)s | %(message)s')
+    main()
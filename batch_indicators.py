@@ -0,0 +1,221 @@
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from indicator_engine import (
+    EMA_PERIODS, ATR_LENGTH, SUPERTREND_LENGTH, SUPERTREND_MULTIPLIER,
+    PSAR_AF0, PSAR_MAX_AF
+)
+
+# Индикаторы считаются для всех монет сразу по матрицам (монета × время).
+# EMA и RMA считает pandas ewm по всем строкам сразу; рекурсии SuperTrend и
+# PSAR идут по времени, каждая операция векторизована по монетам;
+# строки с более короткой историей дополняются NaN слева. Модуль нужен для
+# расчётов по истории (backtest, калибровка signal_model); запросы
+# пользователей берут индикаторы из потокового indicator_engine.
+
+RSI_LENGTH = 14
+MACD_FAST, MACD_SLOW, MACD_SIGNAL = 12, 26, 9
+OHLCV_COLUMNS = ("open", "high", "low", "close", "volume")
+
+
+def stack_frames(frames: Dict[str, pd.DataFrame], columns=OHLCV_COLUMNS) -> Tuple[List[str], pd.DatetimeIndex, Dict[str, np.ndarray]]:
+    """
+    Выравнивает свечи нескольких монет по общей временной оси.
+    :return: (список монет, индекс времени, {колонка: матрица монета × время})
+    """
+    names = [s for s, df in frames.items() if df is not None and not df.empty]
+    if not names:
+        return [], pd.DatetimeIndex([]), {c: np.empty((0, 0)) for c in columns}
+    index = frames[names[0]].index
+    for s in names[1:]:
+        if not frames[s].index.equals(index):
+            index = index.union(frames[s].index)
+    arrays = {}
+    for c in columns:
+        arrays[c] = np.vstack([
+            frames[s][c].reindex(index).to_numpy(dtype=float) for s in names
+        ])
+    return names, index, arrays
+
+
+def _leading_gaps_only(x: np.ndarray) -> bool:
+    """
+    True, если пропуски (NaN) в строках есть только в начале — до первой свечи ряда.
+    """
+    valid = ~np.isnan(x)
+    return not (np.maximum.accumulate(valid, axis=1) & ~valid).any()
+
+
+def ema(x: np.ndarray, span: int) -> np.ndarray:
+    """
+    EMA по строкам матрицы, как pandas ewm(span, adjust=False): старт с первого значения.
+    """
+    if _leading_gaps_only(x):
+        # Без пропусков внутри ряда — то же самое считает pandas без цикла в Python
+        return pd.DataFrame(x.T).ewm(span=span, adjust=False).mean().to_numpy().T
+    # Пропуск внутри ряда держит предыдущее значение (pandas затухал бы через пропуск)
+    alpha = 2.0 / (span + 1)
+    out = np.empty_like(x, dtype=float)
+    y = np.full(x.shape[0], np.nan)
+    for t in range(x.shape[1]):
+        xt = x[:, t]
+        y = np.where(np.isnan(y), xt, np.where(np.isnan(xt), y, (1 - alpha) * y + alpha * xt))
+        out[:, t] = y
+    return out
+
+
+def rma(x: np.ndarray, length: int) -> np.ndarray:
+    """
+    RMA (сглаживание Уайлдера) как в pandas_ta: ewm(alpha=1/length, adjust=True, min_periods=length).
+    Пропуски затухают вместе с весами, в min_periods считаются только свечи.
+    """
+    return pd.DataFrame(x.T).ewm(alpha=1.0 / length, adjust=True, min_periods=length).mean().to_numpy().T
+
+
+def _shift(x: np.ndarray) -> np.ndarray:
+    prev = np.full(x.shape, np.nan)
+    prev[:, 1:] = x[:, :-1]
+    return prev
+
+
+def true_range(high: np.ndarray, low: np.ndarray, close: np.ndarray) -> np.ndarray:
+    prev_close = _shift(close)
+    tr = np.fmax(np.abs(high - low), np.fmax(np.abs(high - prev_close), np.abs(prev_close - low)))
+    # У первой свечи ряда нет предыдущего close
+    tr[np.isnan(prev_close)] = np.nan
+    return tr
+
+
+def atr(high: np.ndarray, low: np.ndarray, close: np.ndarray, length: int = ATR_LENGTH) -> np.ndarray:
+    return rma(true_range(high, low, close), length)
+
+
+def rsi(close: np.ndarray, length: int = RSI_LENGTH) -> np.ndarray:
+    """
+    RSI как в pandas_ta: RMA приростов и падений цены закрытия.
+    """
+    diff = close - _shift(close)
+    gains = np.where(np.isnan(diff), np.nan, np.clip(diff, 0, None))
+    losses = np.where(np.isnan(diff), np.nan, np.clip(-diff, 0, None))
+    avg_gain = rma(gains, length)
+    avg_loss = rma(losses, length)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return 100 * avg_gain / (avg_gain + avg_loss)
+
+
+def macd(close: np.ndarray, fast: int = MACD_FAST, slow: int = MACD_SLOW, signal: int = MACD_SIGNAL) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    MACD на EMA ewm(adjust=False) — так же, как на графике chart_renderer.
+    :return: (macd, signal, histogram)
+    """
+    line = ema(close, fast) - ema(close, slow)
+    sig = ema(line, signal)
+    return line, sig, line - sig
+
+
+def supertrend(high: np.ndarray, low: np.ndarray, close: np.ndarray, length: int = SUPERTREND_LENGTH, multiplier: float = SUPERTREND_MULTIPLIER) -> np.ndarray:
+    """
+    Направление SuperTrend (1 / -1) по правилам pandas_ta supertrend.
+    """
+    n, m = close.shape
+    st_atr = atr(high, low, close, length)
+    hl2 = (high + low) / 2
+    out = np.full((n, m), np.nan)
+    direction = np.ones(n)
+    prev_upper = np.full(n, np.nan)
+    prev_lower = np.full(n, np.nan)
+    seen = np.zeros(n, dtype=int)
+    for t in range(m):
+        c = close[:, t]
+        valid = ~np.isnan(c)
+        upper = hl2[:, t] + multiplier * st_atr[:, t]
+        lower = hl2[:, t] - multiplier * st_atr[:, t]
+        up_break = c > prev_upper
+        down_break = c < prev_lower
+        keep = ~up_break & ~down_break
+        new_dir = np.where(up_break, 1.0, np.where(down_break, -1.0, direction))
+        lower = np.where(keep & (new_dir > 0) & (lower < prev_lower), prev_lower, lower)
+        upper = np.where(keep & (new_dir < 0) & (upper > prev_upper), prev_upper, upper)
+        new_dir = np.where(seen == 0, 1.0, new_dir)
+        direction = np.where(valid, new_dir, direction)
+        prev_upper = np.where(valid, upper, prev_upper)
+        prev_lower = np.where(valid, lower, prev_lower)
+        out[:, t] = np.where(valid, direction, np.nan)
+        seen += valid
+    return out
+
+
+def psar(high: np.ndarray, low: np.ndarray, close: np.ndarray, af0: float = PSAR_AF0, max_af: float = PSAR_MAX_AF) -> np.ndarray:
+    """
+    Направление Parabolic SAR (1 — SAR под ценой, -1 — над ценой) по правилам pandas_ta psar.
+    """
+    n, m = close.shape
+    out = np.full((n, m), np.nan)
+    falling = np.zeros(n, dtype=bool)
+    sar = np.full(n, np.nan)
+    ep = np.full(n, np.nan)
+    af = np.full(n, af0)
+    prev_high = np.full(n, np.nan)
+    prev_low = np.full(n, np.nan)
+    prev2_high = np.full(n, np.nan)
+    prev2_low = np.full(n, np.nan)
+    seen = np.zeros(n, dtype=int)
+    for t in range(m):
+        h, l, c = high[:, t], low[:, t], close[:, t]
+        valid = ~np.isnan(c)
+        first = valid & (seen == 0)
+        stepping = valid & (seen >= 1)
+        # Направление задаётся первыми двумя свечами
+        init = valid & (seen == 1)
+        up = h - prev_high
+        dn = prev_low - l
+        init_falling = (dn > up) & (dn > 0)
+        falling = np.where(init, init_falling, falling)
+        ep = np.where(init, np.where(init_falling, prev_low, prev_high), ep)
+        af = np.where(init, af0, af)
+        p2_high = np.where(seen == 1, prev_high, prev2_high)
+        p2_low = np.where(seen == 1, prev_low, prev2_low)
+        new_sar = sar + af * (ep - sar)
+        reverse = np.where(falling, h > new_sar, l < new_sar)
+        extend = np.where(falling, l < ep, h > ep)
+        new_ep = np.where(extend, np.where(falling, l, h), ep)
+        new_af = np.where(extend, np.minimum(af + af0, max_af), af)
+        new_sar = np.where(
+            falling,
+            np.maximum(np.maximum(prev_high, p2_high), new_sar),
+            np.minimum(np.minimum(prev_low, p2_low), new_sar)
+        )
+        new_sar = np.where(reverse, new_ep, new_sar)
+        new_af = np.where(reverse, af0, new_af)
+        new_falling = np.where(reverse, ~falling, falling)
+        new_ep = np.where(reverse, np.where(new_falling, l, h), new_ep)
+        sar = np.where(stepping, new_sar, np.where(first, c, sar))
+        ep = np.where(stepping, new_ep, ep)
+        af = np.where(stepping, new_af, af)
+        falling = np.where(stepping, new_falling, falling)
+        out[:, t] = np.where(stepping, np.where(falling, -1.0, 1.0), np.nan)
+        prev2_high = np.where(valid, prev_high, prev2_high)
+        prev2_low = np.where(valid, prev_low, prev2_low)
+        prev_high = np.where(valid, h, prev_high)
+        prev_low = np.where(valid, l, prev_low)
+        seen += valid
+    return out
+
+
+def compute_indicators(arrays: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """
+    Все индикаторы для всех монет за один проход по матрицам.
+    :param arrays: {"high", "low", "close", ...} — матрицы монета × время
+    :return: {имя индикатора: матрица монета × время}
+    """
+    high, low, close = arrays["high"], arrays["low"], arrays["close"]
+    result = {f"EMA{p}": ema(close, p) for p in EMA_PERIODS}
+    result["MACD"], result["MACD_signal"], result["MACD_hist"] = macd(close)
+    result["RSI"] = rsi(close)
+    result["ATR"] = atr(high, low, close)
+    result["SuperTrend"] = supertrend(high, low, close)
+    result["PSAR"] = psar(high, low, close)
+    return result
+
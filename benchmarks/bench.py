@@ -0,0 +1,279 @@
+"""
+Офлайн-бенчмарки горячих функций бота на записанных фикстурах (без сети и LLM).
+
+    python benchmarks/bench.py --output bench.json
+    python benchmarks/bench.py --output new.json --baseline bench.json   # прогон + сравнение
+    python benchmarks/bench.py --compare bench.json new.json            # только сравнение
+
+Каждый случай — функция × длина ряда (100, 300, 1000, 10000 свечей); все
+случаи, включая get_forecast, считают по всему переданному кадру. Время
+одного вызова меряется как в timeit: серия из number вызовов повторяется
+repeat раз. В JSON пишутся min/median/mean/stdev одного вызова в секундах.
+Сравнение — по медиане; при замедлении больше --threshold код выхода 1.
+"""
+import argparse
+import gzip
+import json
+import logging
+import math
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from typing import Callable, Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+# Клиент LLM создаётся при импорте services, но в бенчмарках не вызывается
+os.environ.setdefault("TOGETHER_API_KEY", "offline-benchmark")
+# Без потока свечей и пула процессов: всё считается в текущем процессе
+os.environ.setdefault("KLINE_STREAM_ENABLED", "0")
+os.environ.setdefault("CHART_WORKERS", "0")
+
+import matplotlib
+matplotlib.use("Agg")
+import numpy as np
+import pandas as pd
+from tradingview_ta import Analysis
+
+import services
+from chart_renderer import render_chart
+from charting import _klines_to_store
+from indicator_engine import indicator_engine
+from record_fixtures import klines_path, tradingview_path, DEFAULT_SYMBOL, DEFAULT_INTERVAL
+
+SCHEMA_VERSION = 1
+SIZES = (100, 300, 1000, 10000)
+# Минимальная длительность одной серии вызовов и число серий
+MIN_SERIES_TIME = 0.05
+REPEAT = 5
+# Замедление медианы, которое считается регрессией
+DEFAULT_THRESHOLD = 0.2
+
+
+def load_klines(symbol: str = DEFAULT_SYMBOL, interval: str = DEFAULT_INTERVAL) -> list:
+    with gzip.open(klines_path(symbol, interval), "rt") as f:
+        return json.load(f)
+
+
+def load_analysis(symbol: str = DEFAULT_SYMBOL, interval: str = DEFAULT_INTERVAL) -> Analysis:
+    with open(tradingview_path(symbol, interval), encoding="utf-8") as f:
+        payload = json.load(f)
+    analysis = Analysis()
+    analysis.symbol = payload["symbol"]
+    analysis.interval = payload["interval"]
+    analysis.summary = payload["summary"]
+    analysis.oscillators = payload["oscillators"]
+    analysis.moving_averages = payload["moving_averages"]
+    analysis.indicators = payload["indicators"]
+    return analysis
+
+
+def extend_klines(rows: list, size: int) -> list:
+    """
+    Ряд нужной длины из записанных свечей: если записей меньше, они повторяются
+    подряд со сдвигом времени и масштабом цены, чтобы ряд оставался непрерывным.
+    """
+    if size <= len(rows):
+        return rows[-size:]
+    step = rows[1][0] - rows[0][0]
+    ratio = float(rows[-1][4]) / float(rows[0][1])
+    out = []
+    copies = math.ceil(size / len(rows))
+    for k in range(copies):
+        shift = k * len(rows) * step
+        scale = ratio ** k
+        for row in rows:
+            prices = [f"{float(v) * scale:.8f}" for v in row[1:5]]
+            out.append([row[0] + shift, *prices, row[5], row[6] + shift, *row[7:]])
+    return out[-size:]
+
+
+class Case:
+    def __init__(self, name: str, setup: Callable[[int], Callable[[], object]]):
+        self.name = name
+        self.setup = setup
+
+
+def _frame(rows: list, size: int) -> pd.DataFrame:
+    return _klines_to_store(rows, DEFAULT_INTERVAL, size).frame(size)
+
+
+def build_cases(klines: list, analysis: Analysis) -> List[Case]:
+    services.get_symbol_analysis = lambda symbol, interval: analysis
+
+    def ohlcv_parse(size):
+        rows = extend_klines(klines, size)
+        return lambda: _klines_to_store(rows, DEFAULT_INTERVAL, size).frame(size)
+
+    def forecast(size):
+        df = _frame(extend_klines(klines, size), size)
+
+        def run():
+            # Холодный расчёт по всем size свечам: без накопленного состояния потоковых индикаторов
+            indicator_engine.reset()
+            return services.get_forecast(DEFAULT_SYMBOL, DEFAULT_INTERVAL, df=df)
+        return run
+
+    def indicators_for(size):
+        df = _frame(extend_klines(klines, size), size)
+        indicator_engine.reset()
+        indicators = services.get_forecast(DEFAULT_SYMBOL, DEFAULT_INTERVAL, df=df)["indicators"]
+        support, resistance = services.get_support_resistance(df)
+        return df, indicators, support, resistance
+
+    def ema(size):
+        df = _frame(extend_klines(klines, size), size)
+        return lambda: services.get_ema(df, 50)
+
+    def smart(size):
+        df, indicators, support, resistance = indicators_for(size)
+        price = float(df["close"].iloc[-1])
+        return lambda: services.smart_trade_signal(indicators, price=price, support=support, resistance=resistance)
+
+    def majority(size):
+        _, indicators, _, _ = indicators_for(size)
+        return lambda: services.majority_vote_signal(indicators)
+
+    def levels(size):
+        df = _frame(extend_klines(klines, size), size)
+        return lambda: services.get_support_resistance(df)
+
+    def chart(size):
+        df = _frame(extend_klines(klines, size), size)
+        levels = list(services.get_support_resistance(df))
+        return lambda: render_chart(df, levels=levels, symbol=DEFAULT_SYMBOL)
+
+    return [
+        Case("get_ohlcv_parse", ohlcv_parse),
+        Case("get_forecast", forecast),
+        Case("get_ema", ema),
+        Case("smart_trade_signal", smart),
+        Case("majority_vote_signal", majority),
+        Case("get_support_resistance", levels),
+        Case("render_chart", chart),
+    ]
+
+
+def measure(func: Callable[[], object], repeat: int = REPEAT, min_time: float = MIN_SERIES_TIME) -> dict:
+    """
+    Время одного вызова: подбирает number так, чтобы серия шла не меньше min_time, и повторяет серию repeat раз.
+    """
+    started = time.perf_counter()
+    func()
+    single = time.perf_counter() - started
+    number = max(1, int(min_time / single)) if single > 0 else 1000
+    # Медленные случаи (секунды на вызов) — меньше повторов
+    if single * number * repeat > 30:
+        repeat = max(1, min(repeat, int(30 / single)))
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            func()
+        samples.append((time.perf_counter() - started) / number)
+    return {
+        "number": number,
+        "repeat": repeat,
+        "min_s": min(samples),
+        "median_s": statistics.median(samples),
+        "mean_s": statistics.fmean(samples),
+        "stdev_s": statistics.stdev(samples) if len(samples) > 1 else 0.0
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT, stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return None
+
+
+def run(cases: List[Case], sizes: List[int]) -> dict:
+    results: Dict[str, dict] = {}
+    for case in cases:
+        for size in sizes:
+            result = measure(case.setup(size))
+            results[f"{case.name}/{size}"] = {"case": case.name, "size": size, **result}
+            print(f"{case.name:<24}{size:>7}  median {result['median_s'] * 1000:10.3f} мс  (x{result['number']}×{result['repeat']})")
+    return {
+        "schema": SCHEMA_VERSION,
+        "meta": {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "fixtures": os.path.basename(klines_path(DEFAULT_SYMBOL, DEFAULT_INTERVAL))
+        },
+        "results": results
+    }
+
+
+def compare(baseline: dict, current: dict, threshold: float = DEFAULT_THRESHOLD) -> bool:
+    """
+    Печатает сравнение медиан и возвращает True, если регрессий нет.
+    """
+    ok = True
+    print(f"\n{'случай':<32}{'было, мс':>12}{'стало, мс':>12}{'×':>8}")
+    for key, new in current["results"].items():
+        old = baseline["results"].get(key)
+        if old is None:
+            print(f"{key:<32}{'—':>12}{new['median_s'] * 1000:>12.3f}{'новый':>8}")
+            continue
+        ratio = new["median_s"] / old["median_s"] if old["median_s"] else float("inf")
+        mark = ""
+        if ratio > 1 + threshold:
+            mark = "  РЕГРЕССИЯ"
+            ok = False
+        elif ratio < 1 - threshold:
+            mark = "  быстрее"
+        print(f"{key:<32}{old['median_s'] * 1000:>12.3f}{new['median_s'] * 1000:>12.3f}{ratio:>8.2f}{mark}")
+    return ok
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Офлайн-бенчмарки на фикстурах benchmarks/fixtures")
+    parser.add_argument("--output", help="куда записать результаты (JSON)")
+    parser.add_argument("--baseline", help="сравнить прогон с прошлыми результатами")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="сравнить два файла результатов без прогона")
+    parser.add_argument("--cases", nargs="*", help="только эти случаи")
+    parser.add_argument("--sizes", nargs="*", type=int, default=list(SIZES))
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="допустимое замедление медианы (0.2 = 20%%)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    # Замеры не должны тонуть в INFO-логах анализа
+    logging.getLogger().setLevel(logging.WARNING)
+
+    if args.compare:
+        with open(args.compare[0], encoding="utf-8") as f:
+            old = json.load(f)
+        with open(args.compare[1], encoding="utf-8") as f:
+            new = json.load(f)
+        sys.exit(0 if compare(old, new, args.threshold) else 1)
+
+    cases = build_cases(load_klines(), load_analysis())
+    if args.cases:
+        unknown = set(args.cases) - {c.name for c in cases}
+        if unknown:
+            parser.error(f"неизвестные случаи: {', '.join(sorted(unknown))}")
+        cases = [c for c in cases if c.name in args.cases]
+    report = run(cases, args.sizes)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Результаты: {args.output}")
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if not compare(baseline, report, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
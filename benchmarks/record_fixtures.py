@@ -0,0 +1,143 @@
+"""
+Запись фикстур для бенчмарков: свечи Binance /api/v3/klines (как есть, JSON)
+и анализ TradingView (summary, oscillators, moving_averages, indicators).
+
+    python benchmarks/record_fixtures.py                  # с Binance и TradingView
+    python benchmarks/record_fixtures.py --synthetic      # без сети: детерминированное случайное блуждание
+
+Синтетические фикстуры имеют тот же формат, что и записанные, — бенчмарки
+работают с любыми. Для сравнения прогонов используйте одни и те же фикстуры.
+"""
+import argparse
+import gzip
+import json
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+DEFAULT_SYMBOL = "BTCUSDT"
+DEFAULT_INTERVAL = "15m"
+# Одна страница Binance; длинные ряды бенчмарк собирает из неё (bench.extend_klines)
+DEFAULT_CANDLES = 1000
+
+
+def klines_path(symbol: str, interval: str) -> str:
+    return os.path.join(FIXTURES_DIR, f"klines_{symbol}_{interval}.json.gz")
+
+
+def tradingview_path(symbol: str, interval: str) -> str:
+    return os.path.join(FIXTURES_DIR, f"tradingview_{symbol}_{interval}.json")
+
+
+def record_klines(symbol: str, interval: str, candles: int) -> list:
+    """
+    Последние candles свечей с Binance, страницами по 1000 (от новых к старым).
+    """
+    import requests
+    from binance_client import BINANCE_API_URL, KLINES_PATH
+    rows: list = []
+    end_time = None
+    while len(rows) < candles:
+        params = {"symbol": symbol, "interval": interval, "limit": min(1000, candles - len(rows))}
+        if end_time is not None:
+            params["endTime"] = end_time
+        response = requests.get(f"{BINANCE_API_URL}{KLINES_PATH}", params=params, timeout=10)
+        response.raise_for_status()
+        page = response.json()
+        if not page:
+            break
+        rows = page + rows
+        end_time = page[0][0] - 1
+        time.sleep(0.2)
+    return rows[-candles:]
+
+
+def record_tradingview(symbol: str, interval: str) -> dict:
+    from tradingview_ta import TA_Handler
+    analysis = TA_Handler(symbol=symbol, screener="crypto", exchange="BINANCE", interval=interval).get_analysis()
+    return {
+        "symbol": symbol,
+        "interval": interval,
+        "summary": analysis.summary,
+        "oscillators": analysis.oscillators,
+        "moving_averages": analysis.moving_averages,
+        "indicators": analysis.indicators
+    }
+
+
+def synthetic_klines(interval: str, candles: int, seed: int = 42, price: float = 100000.0) -> list:
+    """
+    Случайное блуждание в формате ответа Binance (строки с 8 знаками, 12 полей).
+    """
+    from utils import interval_to_seconds
+    rng = random.Random(seed)
+    step_ms = interval_to_seconds(interval) * 1000
+    # Фиксированное время: фикстура не зависит от момента записи
+    start = 1_700_000_000_000 // step_ms * step_ms
+    rows = []
+    for i in range(candles):
+        open_time = start + i * step_ms
+        open_ = price
+        close = price * (1 + rng.gauss(0, 0.004))
+        high = max(open_, close) * (1 + abs(rng.gauss(0, 0.0015)))
+        low = min(open_, close) * (1 - abs(rng.gauss(0, 0.0015)))
+        # Шаг цены и объёма как у BTCUSDT на Binance: 0.01 и 0.00001
+        open_, high, low, close = (round(x, 2) for x in (open_, high, low, close))
+        volume = round(rng.lognormvariate(4, 0.6), 5)
+        trades = rng.randint(500, 5000)
+        rows.append([
+            open_time, f"{open_:.8f}", f"{high:.8f}", f"{low:.8f}", f"{close:.8f}", f"{volume:.8f}",
+            open_time + step_ms - 1, f"{volume * close:.8f}", trades,
+            f"{volume / 2:.8f}", f"{volume * close / 2:.8f}", "0"
+        ])
+        price = close
+    return rows
+
+
+def synthetic_tradingview(symbol: str, interval: str, klines: list) -> dict:
+    close = float(klines[-1][4])
+    return {
+        "symbol": symbol,
+        "interval": interval,
+        "summary": {"RECOMMENDATION": "BUY", "BUY": 12, "SELL": 6, "NEUTRAL": 8},
+        "oscillators": {"RECOMMENDATION": "NEUTRAL", "BUY": 2, "SELL": 1, "NEUTRAL": 8},
+        "moving_averages": {"RECOMMENDATION": "BUY", "BUY": 10, "SELL": 5, "NEUTRAL": 0},
+        "indicators": {
+            "RSI": 54.31, "RSI[1]": 52.77, "MACD.macd": 41.52, "MACD.signal": 30.18,
+            "Stoch.RSI.K": 63.4, "Stoch.K": 58.2, "Stoch.D": 55.9, "ADX": 21.7, "CCI20": 48.3,
+            "EMA20": close * 0.998, "EMA50": close * 0.993, "EMA100": close * 0.985, "EMA200": close * 0.97,
+            "SMA20": close * 0.997, "SMA50": close * 0.992, "close": close, "volume": float(klines[-1][5])
+        }
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Запись фикстур для benchmarks/bench.py")
+    parser.add_argument("--symbol", default=DEFAULT_SYMBOL)
+    parser.add_argument("--interval", default=DEFAULT_INTERVAL)
+    parser.add_argument("--candles", type=int, default=DEFAULT_CANDLES)
+    parser.add_argument("--synthetic", action="store_true", help="без сети, детерминированные данные")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    sys.path.insert(0, ROOT)
+    os.makedirs(FIXTURES_DIR, exist_ok=True)
+    if args.synthetic:
+        klines = synthetic_klines(args.interval, args.candles, args.seed)
+        tradingview = synthetic_tradingview(args.symbol, args.interval, klines)
+    else:
+        klines = record_klines(args.symbol, args.interval, args.candles)
+        tradingview = record_tradingview(args.symbol, args.interval)
+    # mtime=0 — одинаковые данные дают побайтно одинаковый файл
+    with open(klines_path(args.symbol, args.interval), "wb") as raw:
+        with gzip.GzipFile(fileobj=raw, mode="wb", mtime=0) as f:
+            f.write(json.dumps(klines, separators=(",", ":")).encode())
+    with open(tradingview_path(args.symbol, args.interval), "w", encoding="utf-8") as f:
+        json.dump(tradingview, f, ensure_ascii=False, indent=2)
+    print(f"{len(klines)} свечей и анализ TradingView записаны в {FIXTURES_DIR}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+import asyncio
+import logging
+import os
+from typing import Optional
+
+import aiohttp
+
+BINANCE_API_URL = os.getenv("BINANCE_API_URL", "https://api.binance.com")
+KLINES_PATH = "/api/v3/klines"
+# Максимум свечей в одном ответе /api/v3/klines
+REST_PAGE_LIMIT = 1000
+# Таймаут одного запроса к Binance, сек
+BINANCE_TIMEOUT = float(os.getenv("BINANCE_TIMEOUT", "10"))
+# Сколько запросов к Binance может выполняться одновременно
+BINANCE_MAX_CONCURRENCY = int(os.getenv("BINANCE_MAX_CONCURRENCY", "8"))
+# Размер пула keep-alive соединений
+BINANCE_POOL_SIZE = int(os.getenv("BINANCE_POOL_SIZE", "16"))
+
+
+class BinanceKlineClient:
+    """
+    Асинхронный клиент свечей Binance на постоянной aiohttp-сессии:
+    keep-alive пул соединений, таймаут на запрос и ограничение параллельности.
+    Сессия создаётся лениво внутри работающего event loop.
+    """
+
+    def __init__(
+        self,
+        base_url: str = BINANCE_API_URL,
+        timeout: float = BINANCE_TIMEOUT,
+        max_concurrency: int = BINANCE_MAX_CONCURRENCY,
+        pool_size: int = BINANCE_POOL_SIZE
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.pool_size = pool_size
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size,
+                keepalive_timeout=60,
+                ttl_dns_cache=300
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._session
+
+    async def get_klines(
+        self,
+        symbol: str,
+        interval: str,
+        limit: int = 100,
+        start_time: Optional[int] = None,
+        end_time: Optional[int] = None
+    ) -> list:
+        """
+        Возвращает сырые свечи Binance (список списков) для symbol/interval.
+        :param start_time: Начало диапазона, unix-миллисекунды
+        :param end_time: Конец диапазона, unix-миллисекунды
+        """
+        session = self._get_session()
+        params = {
+            "symbol": symbol.upper(),
+            "interval": interval,
+            "limit": limit
+        }
+        if start_time is not None:
+            params["startTime"] = int(start_time)
+        if end_time is not None:
+            params["endTime"] = int(end_time)
+        async with self._semaphore:
+            async with session.get(self.base_url + KLINES_PATH, params=params) as response:
+                response.raise_for_status()
+                return await response.json()
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+
+binance_client = BinanceKlineClient()
+
+
+async def close_binance_client() -> None:
+    """
+    Закрывает общую сессию Binance (вызывается при остановке бота).
+    """
+    await binance_client.close()
+    logging.info("[BINANCE] HTTP-сессия закрыта")
@@ -1,8 +1,24 @@
 from aiogram import Bot, Dispatcher
 import os
+from metrics import span
 
 token = os.getenv("BOT_TOKEN")
 if not token:
     raise ValueError("Переменная окружения BOT_TOKEN не установлена!")
-bot = Bot(token=token)
+
+
+class MeteredBot(Bot):
+    """
+    Bot с замером каждого запроса к Bot API (sendMessage, sendPhoto, editMessageText...).
+    Долгий опрос getUpdates не замеряется.
+    """
+
+    async def request(self, method, data=None, files=None, **kwargs):
+        if method == "getUpdates":
+            return await super().request(method, data, files, **kwargs)
+        async with span(f"telegram_{method}"):
+            return await super().request(method, data, files, **kwargs)
+
+
+bot = MeteredBot(token=token)
 dp = Dispatcher(bot)
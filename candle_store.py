@@ -0,0 +1,157 @@
+import threading
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from utils import interval_to_seconds
+
+COLUMNS = ("open", "high", "low", "close", "volume")
+DEFAULT_CAPACITY = 1000
+
+
+class CandleStore:
+    """
+    Компактное хранилище свечей одного ряда (symbol, interval): open_time в int64
+    и колонки OHLCV в float64 (float32 не держит цену BTC с точностью до цента).
+
+    Данные лежат в заранее выделенных массивах двойной ёмкости; окно последних
+    свечей всегда непрерывно, поэтому view() отдаёт срезы без копирования.
+    Когда массив заполняется, хвост переносится в новые массивы — ранее
+    выданные срезы остаются валидными. DataFrame строится только на границе
+    с pandas/mplfinance (frame()) и запоминается до следующего изменения.
+    Обновление текущей свечи пишет в последнюю строку на месте: для
+    неизменяемого снимка берите frame().
+    """
+
+    def __init__(self, interval: str, capacity: int = DEFAULT_CAPACITY):
+        self.interval_ms = interval_to_seconds(interval) * 1000
+        self.capacity = capacity
+        self._times = np.empty(2 * capacity, dtype=np.int64)
+        self._values = np.empty((len(COLUMNS), 2 * capacity), dtype=np.float64)
+        self._start = 0
+        self._end = 0
+        self._version = 0
+        self._frames: Dict[int, Tuple[int, pd.DataFrame]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._end - self._start
+
+    @property
+    def last_open_time(self) -> Optional[int]:
+        with self._lock:
+            return int(self._times[self._end - 1]) if self._end > self._start else None
+
+    def _reserve(self, extra: int) -> None:
+        """
+        Гарантирует место под extra строк в конце; при нехватке переносит хвост в новые массивы.
+        """
+        if self._end + extra <= self._times.shape[0]:
+            return
+        keep = min(self._end - self._start, max(self.capacity - extra, 0))
+        size = 2 * max(self.capacity, extra)
+        times = np.empty(size, dtype=np.int64)
+        values = np.empty((len(COLUMNS), size), dtype=np.float64)
+        times[:keep] = self._times[self._end - keep:self._end]
+        values[:, :keep] = self._values[:, self._end - keep:self._end]
+        self._times, self._values = times, values
+        self._start, self._end = 0, keep
+
+    def _trim(self) -> None:
+        if self._end - self._start > self.capacity:
+            self._start = self._end - self.capacity
+
+    def upsert(self, open_time: int, open_: float, high: float, low: float, close: float, volume: float) -> bool:
+        """
+        Добавляет новую свечу или обновляет текущую.
+        :return: False, если между хранилищем и свечой есть пропуск (нужна дозагрузка)
+        """
+        with self._lock:
+            if self._end > self._start:
+                last_open = self._times[self._end - 1]
+                if open_time == last_open:
+                    self._values[:, self._end - 1] = (open_, high, low, close, volume)
+                    self._version += 1
+                    return True
+                if open_time < last_open:
+                    return True
+                if open_time > last_open + self.interval_ms:
+                    return False
+            self._reserve(1)
+            self._times[self._end] = open_time
+            self._values[:, self._end] = (open_, high, low, close, volume)
+            self._end += 1
+            self._trim()
+            self._version += 1
+            return True
+
+    def extend(self, open_times: np.ndarray, values: np.ndarray) -> None:
+        """
+        Вливает пачку свечей (например, из REST): перекрывающиеся заменяются,
+        при разрыве с уже хранимыми данные заменяются целиком.
+        :param values: Матрица 5 × n (open, high, low, close, volume)
+        """
+        n = len(open_times)
+        if n == 0:
+            return
+        if n > self.capacity:
+            open_times, values = open_times[-self.capacity:], values[:, -self.capacity:]
+            n = self.capacity
+        with self._lock:
+            if self._end > self._start:
+                if open_times[0] > self._times[self._end - 1] + self.interval_ms:
+                    self._start = self._end
+                else:
+                    # Отбрасываем хвост, который перекрывается новыми свечами
+                    cut = int(np.searchsorted(self._times[self._start:self._end], open_times[0]))
+                    self._end = self._start + cut
+            self._reserve(n)
+            self._times[self._end:self._end + n] = open_times
+            self._values[:, self._end:self._end + n] = values
+            self._end += n
+            self._trim()
+            self._version += 1
+
+    def view(self, limit: Optional[int] = None) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+        """
+        Последние limit свечей как срезы без копирования: (open_time, {колонка: массив}).
+        """
+        with self._lock:
+            start = self._start if limit is None else max(self._start, self._end - limit)
+            times = self._times[start:self._end]
+            columns = {c: self._values[i, start:self._end] for i, c in enumerate(COLUMNS)}
+        return times, columns
+
+    def frame(self, limit: Optional[int] = None) -> pd.DataFrame:
+        """
+        Последние limit свечей как DataFrame с индексом datetime (для pandas и mplfinance).
+        Кадр собирается один раз на версию, но каждый вызов получает свою копию:
+        новые колонки или fillna(inplace=True) у одного вызывающего не портят кадр остальным.
+        """
+        key = -1 if limit is None else limit
+        with self._lock:
+            cached = self._frames.get(key)
+            if cached is not None and cached[0] == self._version:
+                return cached[1].copy()
+            version = self._version
+        times, columns = self.view(limit)
+        index = pd.DatetimeIndex(times.astype("datetime64[ms]"), name="timestamp")
+        df = pd.DataFrame({c: columns[c].copy() for c in COLUMNS}, index=index)
+        with self._lock:
+            if version == self._version:
+                self._frames = {k: v for k, v in self._frames.items() if v[0] == version}
+                self._frames[key] = (version, df)
+        return df.copy()
+
+
+def klines_to_arrays(data: list) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Сырой ответ Binance /api/v3/klines -> (open_time int64, матрица OHLCV 5 × n float64).
+    """
+    rows = np.asarray(data, dtype=object)
+    if rows.size == 0:
+        return np.empty(0, dtype=np.int64), np.empty((len(COLUMNS), 0), dtype=np.float64)
+    open_times = rows[:, 0].astype(np.int64)
+    values = rows[:, 1:6].astype(np.float64).T
+    return open_times, values
@@ -0,0 +1,128 @@
+import hashlib
+import io
+import logging
+import os
+from collections import OrderedDict
+from typing import List, Optional, Tuple, Union
+
+from aiogram import types
+from aiogram.types import InputFile
+from aiogram.utils.exceptions import BadRequest
+
+from bot_init import bot
+
+# Отправка графиков в Telegram. После первой загрузки картинки Telegram
+# возвращает file_id — повторно тот же снимок графика (те же байты из кэша
+# charting) отправляется по id, без загрузки файла.
+FILE_ID_CACHE_SIZE = int(os.getenv("FILE_ID_CACHE_SIZE", "512"))
+_file_ids: "OrderedDict[str, str]" = OrderedDict()
+_file_id_stats = {"hits": 0, "uploads": 0}
+
+# (PNG, символ, таймфрейм, подпись)
+Chart = Tuple[bytes, str, str, str]
+
+
+def chart_file(png: bytes, symbol: str, tf: str) -> InputFile:
+    """PNG графика из памяти для send_photo/sendMediaGroup — без временных файлов."""
+    return InputFile(io.BytesIO(png), filename=f"{symbol}_{tf}.png")
+
+
+def _digest(png: bytes) -> str:
+    return hashlib.sha1(png).hexdigest()
+
+
+def _media(png: bytes, symbol: str, tf: str) -> Union[str, InputFile]:
+    digest = _digest(png)
+    file_id = _file_ids.get(digest)
+    if file_id is not None:
+        _file_ids.move_to_end(digest)
+        return file_id
+    return chart_file(png, symbol, tf)
+
+
+def _count(media: Union[str, InputFile]) -> None:
+    # Считаем то, что Telegram действительно принял: отправку по file_id или загрузку файла
+    _file_id_stats["hits" if isinstance(media, str) else "uploads"] += 1
+
+
+def _remember(png: bytes, message: types.Message) -> None:
+    if not message.photo:
+        return
+    digest = _digest(png)
+    _file_ids[digest] = message.photo[-1].file_id
+    _file_ids.move_to_end(digest)
+    while len(_file_ids) > FILE_ID_CACHE_SIZE:
+        _file_ids.popitem(last=False)
+
+
+def _forget(charts: List[Chart]) -> None:
+    for png, *_ in charts:
+        _file_ids.pop(_digest(png), None)
+
+
+def get_file_id_stats() -> dict:
+    """
+    Сколько графиков отправлено по file_id и сколько загружено заново.
+    """
+    hits = _file_id_stats["hits"]
+    uploads = _file_id_stats["uploads"]
+    total = hits + uploads
+    return {
+        "hits": hits,
+        "uploads": uploads,
+        "entries": len(_file_ids),
+        "hit_rate": round(hits / total, 3) if total else 0.0
+    }
+
+
+async def send_chart(chat_id: int, png: bytes, symbol: str, tf: str, caption: str, parse_mode: Optional[str] = None) -> types.Message:
+    """
+    Отправляет один график: по file_id, если этот снимок уже загружался, иначе загрузкой из памяти.
+    """
+    media = _media(png, symbol, tf)
+    try:
+        message = await bot.send_photo(chat_id, media, caption=caption, parse_mode=parse_mode)
+    except BadRequest as e:
+        # file_id мог устареть — загружаем заново
+        logging.warning(f"[TELEGRAM] Не удалось отправить график по file_id: {e}")
+        _forget([(png, symbol, tf, caption)])
+        media = chart_file(png, symbol, tf)
+        message = await bot.send_photo(chat_id, media, caption=caption, parse_mode=parse_mode)
+    _count(media)
+    _remember(png, message)
+    return message
+
+
+async def send_chart_group(chat_id: int, charts: List[Chart], parse_mode: Optional[str] = None) -> List[types.Message]:
+    """
+    Отправляет несколько графиков одним sendMediaGroup (альбомом); пустые PNG пропускаются.
+    """
+    charts = [c for c in charts if c[0]]
+    if not charts:
+        return []
+    if len(charts) == 1:
+        return [await send_chart(chat_id, *charts[0], parse_mode=parse_mode)]
+
+    photos = []
+
+    def build_group(use_file_ids: bool) -> types.MediaGroup:
+        media = types.MediaGroup()
+        photos.clear()
+        for png, symbol, tf, caption in charts:
+            photo = _media(png, symbol, tf) if use_file_ids else chart_file(png, symbol, tf)
+            photos.append(photo)
+            media.attach_photo(photo, caption=caption, parse_mode=parse_mode)
+        return media
+
+    try:
+        messages = await bot.send_media_group(chat_id, build_group(True))
+    except BadRequest as e:
+        logging.warning(f"[TELEGRAM] Не удалось отправить альбом по file_id: {e}")
+        _forget(charts)
+        messages = await bot.send_media_group(chat_id, build_group(False))
+    for photo in photos:
+        _count(photo)
+    for (png, *_), message in zip(charts, messages):
+        _remember(png, message)
+    logging.info(f"[TELEGRAM][FILE_ID] {get_file_id_stats()}")
+    return messages
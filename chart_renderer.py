@@ -0,0 +1,253 @@
+import asyncio
+import io
+import logging
+import functools
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional
+
+import matplotlib.pyplot as plt
+import mplfinance as mpf
+import pandas as pd
+
+# Отрисовка графиков в отдельных процессах: mpf.plot занимает CPU на сотни
+# миллисекунд и не должен держать event loop. 0 — рисовать в потоке.
+CHART_WORKERS = int(os.getenv("CHART_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# Увеличивайте при любом изменении внешнего вида графика — сбрасывает кэш картинок
+STYLE_VERSION = 1
+
+_style = None
+_executor: Optional[ProcessPoolExecutor] = None
+# pyplot хранит текущую фигуру глобально и не потокобезопасен: в текущем
+# процессе (CHART_WORKERS=0, запасной путь после падения пула) графики
+# рисуются по одному
+_pyplot_lock = threading.Lock()
+
+
+def _get_style():
+    """
+    Тёмная тема nightclouds с зелёными и красными свечами; строится один раз на процесс.
+    """
+    global _style
+    if _style is None:
+        mc = mpf.make_marketcolors(
+            up='lime', down='red',
+            edge='inherit', wick='inherit', volume='inherit'
+        )
+        _style = mpf.make_mpf_style(base_mpf_style='nightclouds', marketcolors=mc, rc={
+            'axes.labelsize': 14,
+            'axes.titlesize': 18,
+            'xtick.labelsize': 12,
+            'ytick.labelsize': 12,
+            'figure.facecolor': '#181c25',
+            'axes.facecolor': '#181c25',
+            'savefig.facecolor': '#181c25',
+            'axes.edgecolor': '#888',
+            'grid.color': '#333',
+            'text.color': 'white',
+        })
+    return _style
+
+
+def _init_worker() -> None:
+    _get_style()
+
+
+def _warmup() -> int:
+    return os.getpid()
+
+
+def _addplots(df: pd.DataFrame, levels: Optional[List[float]] = None, ax=None, ax_macd=None) -> list:
+    """
+    EMA(7/50/100), уровни и MACD. Без ax — панели mpf.plot (MACD в panel=1),
+    с ax/ax_macd — внешние оси (режим нескольких таймфреймов на одной картинке).
+    """
+    price = {"ax": ax} if ax is not None else {}
+    lower = {"ax": ax_macd} if ax_macd is not None else {"panel": 1}
+    addplots = []
+    # EMA
+    if not df.empty:
+        ema_colors = {7: "orange", 50: "cyan", 100: "purple"}
+        for period in [7, 50, 100]:
+            ema = df["close"].ewm(span=period, adjust=False).mean()
+            addplots.append(mpf.make_addplot(ema, color=ema_colors[period], width=2.2, linestyle='-', **price))
+    # Уровни
+    if levels is not None:
+        for level in levels:
+            addplots.append(mpf.make_addplot([level]*len(df), color='#00BFFF', width=2.0, linestyle='--', **price))
+    # MACD (в отдельном окне)
+    if not df.empty:
+        exp12 = df["close"].ewm(span=12, adjust=False).mean()
+        exp26 = df["close"].ewm(span=26, adjust=False).mean()
+        macd = exp12 - exp26
+        signal = macd.ewm(span=9, adjust=False).mean()
+        addplots.append(mpf.make_addplot(macd, color='lime', width=2, ylabel='MACD', **lower))
+        addplots.append(mpf.make_addplot(signal, color='red', width=2, **lower))
+    return addplots
+
+
+def render_chart(
+    df: pd.DataFrame,
+    levels: Optional[List[float]] = None,
+    symbol: str = "BTCUSDT"
+) -> bytes:
+    """
+    Рисует свечной график с EMA, уровнями и MACD и возвращает PNG байтами (BytesIO, без файлов).
+    Выполняется как в воркере пула, так и в текущем процессе.
+    """
+    buffer = io.BytesIO()
+    with _pyplot_lock:
+        mpf.plot(
+            df,
+            type='candle',
+            style=_get_style(),
+            title=f"{symbol} — График",
+            volume=True,
+            addplot=_addplots(df, levels),
+            savefig=dict(fname=buffer, format='png'),
+            panel_ratios=(3,1) if not df.empty else None,
+            figscale=1.3,
+            tight_layout=True,
+            xrotation=15,
+            ylabel='Цена',
+            ylabel_lower='Объём',
+            returnfig=False
+        )
+    return buffer.getvalue()
+
+
+def render_multi_chart(
+    frames: Dict[str, pd.DataFrame],
+    levels: Optional[Dict[str, List[float]]] = None,
+    symbol: str = "BTCUSDT"
+) -> bytes:
+    """
+    Несколько таймфреймов на одной картинке: по колонке на таймфрейм, свечи
+    с EMA и уровнями сверху, MACD снизу. Одна фигура и одно кодирование PNG.
+    :param frames: {таймфрейм: свечи} в порядке колонок
+    :param levels: {таймфрейм: [поддержка, сопротивление]}
+    """
+    levels = levels or {}
+    with _pyplot_lock:
+        fig = mpf.figure(style=_get_style(), figsize=(8 * len(frames), 9))
+        grid = fig.add_gridspec(2, len(frames), height_ratios=(3, 1), hspace=0.08, wspace=0.12)
+        try:
+            for col, (tf, df) in enumerate(frames.items()):
+                ax = fig.add_subplot(grid[0, col])
+                ax_macd = fig.add_subplot(grid[1, col], sharex=ax)
+                ax.set_title(f"{symbol} {tf}")
+                if df.empty:
+                    ax_macd.set_visible(False)
+                    continue
+                mpf.plot(
+                    df,
+                    type='candle',
+                    ax=ax,
+                    addplot=_addplots(df, levels.get(tf), ax=ax, ax_macd=ax_macd),
+                    xrotation=15,
+                    ylabel='Цена' if col == 0 else ''
+                )
+                ax.tick_params(labelbottom=False)
+                plt.setp(ax_macd.get_xticklabels(), rotation=30, ha='right')
+            fig.suptitle(f"{symbol} — {' / '.join(frames)}")
+            buffer = io.BytesIO()
+            fig.savefig(buffer, format='png', bbox_inches='tight')
+            return buffer.getvalue()
+        finally:
+            plt.close(fig)
+
+
+def _get_executor() -> Optional[ProcessPoolExecutor]:
+    global _executor
+    if _executor is None and CHART_WORKERS > 0:
+        # forkserver: воркеры форкаются от отдельного однопоточного процесса,
+        # а не от бота, где уже работают пулы потоков, поток свечей и DNS
+        # aiohttp — fork такого процесса может унаследовать захваченные
+        # блокировки. Сервер один раз импортирует этот модуль с matplotlib и
+        # mplfinance, воркеры получают их готовыми; main.py (бот, пулы, aiohttp)
+        # в сервер не загружается. Без forkserver (Windows) — spawn.
+        if "forkserver" in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context("forkserver")
+            context.set_forkserver_preload([__name__, "matplotlib", "mplfinance"])
+        else:
+            context = multiprocessing.get_context("spawn")
+        _executor = ProcessPoolExecutor(
+            max_workers=CHART_WORKERS,
+            mp_context=context,
+            initializer=_init_worker
+        )
+    return _executor
+
+
+def _reset_executor() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+async def render_chart_async(
+    df: pd.DataFrame,
+    levels: Optional[List[float]] = None,
+    symbol: str = "BTCUSDT"
+) -> bytes:
+    """
+    Асинхронная отрисовка в пуле процессов; несколько графиков рисуются параллельно на разных ядрах.
+    """
+    loop = asyncio.get_running_loop()
+    executor = _get_executor()
+    if executor is None:
+        return await loop.run_in_executor(None, render_chart, df, levels, symbol)
+    try:
+        return await loop.run_in_executor(executor, render_chart, df, levels, symbol)
+    except BrokenProcessPool:
+        logging.warning("[CHART] Пул отрисовки упал — пересоздаю, график рисуется в потоке")
+        _reset_executor()
+        return await loop.run_in_executor(None, render_chart, df, levels, symbol)
+
+
+async def render_multi_chart_async(
+    frames: Dict[str, pd.DataFrame],
+    levels: Optional[Dict[str, List[float]]] = None,
+    symbol: str = "BTCUSDT"
+) -> bytes:
+    """
+    Асинхронный render_multi_chart в пуле процессов.
+    """
+    loop = asyncio.get_running_loop()
+    executor = _get_executor()
+    if executor is None:
+        return await loop.run_in_executor(None, render_multi_chart, frames, levels, symbol)
+    try:
+        return await loop.run_in_executor(executor, render_multi_chart, frames, levels, symbol)
+    except BrokenProcessPool:
+        logging.warning("[CHART] Пул отрисовки упал — пересоздаю, график рисуется в потоке")
+        _reset_executor()
+        return await loop.run_in_executor(None, render_multi_chart, frames, levels, symbol)
+
+
+async def start_chart_renderer() -> None:
+    """
+    Поднимает воркеры заранее, чтобы первый график не ждал запуска процессов.
+    """
+    _get_style()
+    executor = _get_executor()
+    if executor is None:
+        logging.info("[CHART] Пул отрисовки отключён (CHART_WORKERS=0)")
+        return
+    loop = asyncio.get_running_loop()
+    pids = await asyncio.gather(*(loop.run_in_executor(executor, _warmup) for _ in range(CHART_WORKERS)))
+    logging.info(f"[CHART] Пул отрисовки готов: {len(set(pids))} процессов")
+
+
+async def stop_chart_renderer() -> None:
+    global _executor
+    if _executor is not None:
+        executor, _executor = _executor, None
+        # Ожидание воркеров блокирует — не на event loop
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, functools.partial(executor.shutdown, wait=True, cancel_futures=True))
@@ -1,140 +1,355 @@
-import mplfinance as mpf
 import pandas as pd
 import os
 import requests
-from typing import List, Optional
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
 import logging
+from utils import interval_to_seconds
+from candle_store import CandleStore, klines_to_arrays
+from binance_client import binance_client, BINANCE_API_URL, BINANCE_TIMEOUT, KLINES_PATH, REST_PAGE_LIMIT
+from kline_stream import get_stream_frame
+from kline_archive import KLINE_ARCHIVE_ENABLED, read_recent
+from chart_renderer import render_chart_async, render_multi_chart_async, STYLE_VERSION
+from single_flight import SingleFlight
+from metrics import span, timed
 
+# --- Общий кэш свечей ---
+# Ключ: (symbol, interval, limit) -> (CandleStore, момент истечения в unix-секундах).
+# Свечи хранятся в компактных массивах, DataFrame собирается один раз на версию
+# хранилища, вызывающий код получает его копию. Запись живёт до закрытия последней (текущей) свечи, запрос с меньшим
+# limit обслуживается срезом более длинного окна того же символа и таймфрейма.
+_ohlcv_cache: Dict[Tuple[str, str, int], Tuple[CandleStore, float]] = {}
+_ohlcv_cache_lock = threading.Lock()
+_ohlcv_cache_stats = {"hits": 0, "misses": 0}
+# Если Binance сразу после закрытия ещё отдаёт старую свечу — перезапросим через несколько секунд
+OHLCV_MIN_TTL = 5
+# Одновременные запросы одного ряда на одной свече идут в Binance одним запросом
+_ohlcv_flights = SingleFlight("ohlcv")
+
+def _candle_close_ts(store: CandleStore, timeframe: str) -> float:
+    """
+    Момент закрытия последней свечи в хранилище (unix-секунды).
+    """
+    last_open = store.last_open_time / 1000
+    close_ts = last_open + interval_to_seconds(timeframe)
+    return max(close_ts, time.time() + OHLCV_MIN_TTL)
+
+def _get_cached_ohlcv(symbol: str, timeframe: str, limit: int) -> Optional[pd.DataFrame]:
+    now = time.time()
+    with _ohlcv_cache_lock:
+        best = None
+        for (sym, tf, cached_limit), (store, expires_at) in list(_ohlcv_cache.items()):
+            if sym != symbol or tf != timeframe:
+                continue
+            if expires_at <= now:
+                del _ohlcv_cache[(sym, tf, cached_limit)]
+                continue
+            if cached_limit >= limit and (best is None or cached_limit < best[0]):
+                best = (cached_limit, store)
+        if best is None:
+            _ohlcv_cache_stats["misses"] += 1
+            return None
+        _ohlcv_cache_stats["hits"] += 1
+    return best[1].frame(limit)
+
+def _store_cached_ohlcv(symbol: str, timeframe: str, limit: int, store: CandleStore) -> None:
+    expires_at = _candle_close_ts(store, timeframe)
+    with _ohlcv_cache_lock:
+        # Более короткие окна того же ряда больше не нужны — их покрывает новое
+        for key in [k for k in _ohlcv_cache if k[0] == symbol and k[1] == timeframe and k[2] <= limit]:
+            del _ohlcv_cache[key]
+        _ohlcv_cache[(symbol, timeframe, limit)] = (store, expires_at)
+
+def get_ohlcv_cache_stats() -> dict:
+    """
+    Счётчики попаданий/промахов общего кэша свечей.
+    """
+    with _ohlcv_cache_lock:
+        hits = _ohlcv_cache_stats["hits"]
+        misses = _ohlcv_cache_stats["misses"]
+        entries = len(_ohlcv_cache)
+    total = hits + misses
+    return {
+        "hits": hits,
+        "misses": misses,
+        "entries": entries,
+        "hit_rate": round(hits / total, 3) if total else 0.0
+    }
+
+def clear_ohlcv_cache() -> None:
+    with _ohlcv_cache_lock:
+        _ohlcv_cache.clear()
+
+def _empty_ohlcv() -> pd.DataFrame:
+    return pd.DataFrame({"open":[], "high":[], "low":[], "close":[], "volume":[]})
+
+def _klines_to_store(data: list, timeframe: str, limit: int) -> CandleStore:
+    """
+    Разбирает сырой ответ Binance /api/v3/klines сразу в массивы хранилища,
+    без промежуточного DataFrame из 12 строковых колонок.
+    """
+    store = CandleStore(timeframe, capacity=max(limit, len(data)))
+    store.extend(*klines_to_arrays(data))
+    return store
+
+# Синхронный путь (для кода вне event loop): одна сессия с keep-alive и таймаутом
+_http = requests.Session()
+
+@timed("get_ohlcv")
 def get_ohlcv(symbol: str, timeframe: str = "15m", limit: int = 100) -> pd.DataFrame:
     """
-    Загружает исторические данные OHLCV с Binance API.
+    Загружает исторические данные OHLCV: из буфера kline-потока, если он готов,
+    иначе с Binance API. Результат REST кэшируется до закрытия текущей свечи таймфрейма.
+    Блокирующая версия — внутри обработчиков используйте get_ohlcv_async.
     :param symbol: Символ в формате "BTCUSDT"
     :param timeframe: Таймфрейм (например, "15m", "1h", "4h")
     :param limit: Количество свечей
     :return: DataFrame с индексом datetime
     """
-    url = "https://api.binance.com/api/v3/klines"
+    symbol = symbol.upper()
+    streamed = get_stream_frame(symbol, timeframe, limit)
+    if streamed is not None:
+        return streamed
+    cached = _get_cached_ohlcv(symbol, timeframe, limit)
+    if cached is not None:
+        logging.debug(f"[BINANCE][CACHE] Попадание: {symbol} {timeframe} limit={limit}")
+        return cached
+    url = BINANCE_API_URL + KLINES_PATH
     params = {
-        "symbol": symbol.upper(),
+        "symbol": symbol,
         "interval": timeframe,
         "limit": limit
     }
     logging.info(f"[BINANCE] Запрос OHLCV: {symbol} {timeframe} limit={limit}")
     try:
-        response = requests.get(url, params=params)
+        response = _http.get(url, params=params, timeout=BINANCE_TIMEOUT)
         response.raise_for_status()
         data = response.json()
         if not data or not isinstance(data, list):
             logging.error("Пустой ответ от Binance или неверный формат данных")
-            return pd.DataFrame({"open":[], "high":[], "low":[], "close":[], "volume":[]})
-        df = pd.DataFrame(data)
-        df.columns = [
-            "open_time", "open", "high", "low", "close", "volume",
-            "close_time", "quote_asset_volume", "number_of_trades",
-            "taker_buy_base_asset_volume", "taker_buy_quote_asset_volume", "ignore"
-        ]
-        df["open"] = df["open"].astype(float)
-        df["high"] = df["high"].astype(float)
-        df["low"] = df["low"].astype(float)
-        df["close"] = df["close"].astype(float)
-        df["volume"] = df["volume"].astype(float)
-        df["timestamp"] = pd.to_datetime(df["open_time"], unit="ms")
-        df.set_index("timestamp", inplace=True)
-        cols = ["open", "high", "low", "close", "volume"]
-        if df.empty:
-            return pd.DataFrame({col: [] for col in cols})
-        df = df.loc[:, cols]
-        logging.info(f"[BINANCE] Получено {len(df)} свечей для {symbol} {timeframe}")
-        return df
+            return _empty_ohlcv()
+        store = _klines_to_store(data, timeframe, limit)
+        logging.info(f"[BINANCE] Получено {len(store)} свечей для {symbol} {timeframe}")
+        _store_cached_ohlcv(symbol, timeframe, limit, store)
+        return store.frame(limit)
     except Exception as e:
         logging.exception(f"[BINANCE] Не удалось получить OHLCV для {symbol} {timeframe}: {e}")
-        return pd.DataFrame({"open":[], "high":[], "low":[], "close":[], "volume":[]})
+        return _empty_ohlcv()
 
-def render_dual_chart(
-    df_short: pd.DataFrame,
-    df_long: pd.DataFrame,
-    levels: Optional[List[float]] = None,
-    arrows: Optional[List[dict]] = None,
-    symbol: str = "BTCUSDT"
-) -> str:
-    path = f"chart_{symbol}.png"
-    # Тёмная тема с зелёными и красными свечами
-    mc = mpf.make_marketcolors(
-        up='lime', down='red',
-        edge='inherit', wick='inherit', volume='inherit'
+@timed("get_ohlcv")
+async def get_ohlcv_async(symbol: str, timeframe: str = "15m", limit: int = 100) -> pd.DataFrame:
+    """
+    Асинхронный вариант get_ohlcv: не блокирует event loop, использует общий
+    пул соединений binance_client и тот же кэш свечей.
+    Несколько таймфреймов можно запрашивать параллельно через asyncio.gather.
+    Окна длиннее одного запроса к Binance (limit > 1000) собираются из архива свечей.
+    """
+    symbol = symbol.upper()
+    streamed = get_stream_frame(symbol, timeframe, limit)
+    if streamed is not None:
+        return streamed
+    cached = _get_cached_ohlcv(symbol, timeframe, limit)
+    if cached is not None:
+        logging.debug(f"[BINANCE][CACHE] Попадание: {symbol} {timeframe} limit={limit}")
+        return cached
+    candle = int(time.time() // interval_to_seconds(timeframe))
+    fetch = _fetch_ohlcv_async
+    if limit > REST_PAGE_LIMIT and KLINE_ARCHIVE_ENABLED:
+        fetch = _fetch_archived_ohlcv
+    df = await _ohlcv_flights.do(
+        (symbol, timeframe, limit, candle),
+        lambda: fetch(symbol, timeframe, limit)
     )
-    s = mpf.make_mpf_style(base_mpf_style='nightclouds', marketcolors=mc, rc={
-        'axes.labelsize': 14,
-        'axes.titlesize': 18,
-        'xtick.labelsize': 12,
-        'ytick.labelsize': 12,
-        'figure.facecolor': '#181c25',
-        'axes.facecolor': '#181c25',
-        'savefig.facecolor': '#181c25',
-        'axes.edgecolor': '#888',
-        'grid.color': '#333',
-        'text.color': 'white',
-    })
-    addplots = []
-    # EMA
-    if not df_short.empty:
-        ema_colors = {7: "orange", 50: "cyan", 100: "purple"}
-        for period in [7, 50, 100]:
-            ema = df_short["close"].ewm(span=period, adjust=False).mean()
-            addplots.append(mpf.make_addplot(ema, color=ema_colors[period], width=2.2, linestyle='-'))
-    # Уровни
-    if levels is not None:
-        for level in levels:
-            addplots.append(mpf.make_addplot([level]*len(df_short), color='#00BFFF', width=2.0, linestyle='--'))
-    # MACD (в отдельном окне)
-    if not df_short.empty:
-        exp12 = df_short["close"].ewm(span=12, adjust=False).mean()
-        exp26 = df_short["close"].ewm(span=26, adjust=False).mean()
-        macd = exp12 - exp26
-        signal = macd.ewm(span=9, adjust=False).mean()
-        addplots.append(mpf.make_addplot(macd, panel=1, color='lime', width=2, ylabel='MACD'))
-        addplots.append(mpf.make_addplot(signal, panel=1, color='red', width=2))
-    mpf.plot(
-        df_short,
-        type='candle',
-        style=s,
-        title=f"{symbol} — График",
-        volume=True,
-        addplot=addplots,
-        savefig=path,
-        panel_ratios=(3,1) if not df_short.empty else None,
-        figscale=1.3,
-        tight_layout=True,
-        xrotation=15,
-        ylabel='Цена',
-        ylabel_lower='Объём',
-        returnfig=False
+    # Результат общий для всех ожидавших запросов — каждому своя копия, как из кэша
+    return df.copy()
+
+async def _fetch_ohlcv_async(symbol: str, timeframe: str, limit: int) -> pd.DataFrame:
+    logging.info(f"[BINANCE] Запрос OHLCV (async): {symbol} {timeframe} limit={limit}")
+    try:
+        data = await binance_client.get_klines(symbol, timeframe, limit=limit)
+        if not data or not isinstance(data, list):
+            logging.error("Пустой ответ от Binance или неверный формат данных")
+            return _empty_ohlcv()
+        store = _klines_to_store(data, timeframe, limit)
+        logging.info(f"[BINANCE] Получено {len(store)} свечей для {symbol} {timeframe}")
+        _store_cached_ohlcv(symbol, timeframe, limit, store)
+        return store.frame(limit)
+    except Exception as e:
+        logging.exception(f"[BINANCE] Не удалось получить OHLCV для {symbol} {timeframe}: {e}")
+        return _empty_ohlcv()
+
+async def _fetch_archived_ohlcv(symbol: str, timeframe: str, limit: int) -> pd.DataFrame:
+    logging.info(f"[ARCHIVE] Запрос OHLCV из архива: {symbol} {timeframe} limit={limit}")
+    try:
+        df = await read_recent(symbol, timeframe, limit)
+        if df.empty:
+            return _empty_ohlcv()
+        store = CandleStore(timeframe, capacity=limit)
+        store.extend(df.index.values.astype("datetime64[ms]").astype("int64"), df.to_numpy(dtype=float).T)
+        _store_cached_ohlcv(symbol, timeframe, limit, store)
+        return store.frame(limit)
+    except Exception as e:
+        logging.exception(f"[ARCHIVE] Не удалось собрать OHLCV для {symbol} {timeframe}: {e}")
+        return _empty_ohlcv()
+
+# Сколько последних свечей показывать на графике
+CHART_CANDLES = 100
+# Графики полного прогноза: "multi" — 15m/1h/4h одной картинкой, "album" — три картинки альбомом
+FULL_CHART_MODE = os.getenv("FULL_CHART_MODE", "multi")
+
+# --- Кэш готовых графиков ---
+# Ключ: (symbol, interval, последняя свеча, уровни, STYLE_VERSION) -> PNG, где
+# последняя свеча — open_time и её текущие close/high/low/volume. Из потока
+# свечей незакрытая свеча меняется с каждым тиком, и график должен совпадать
+# с прогнозом по тому же кадру; между тиками (и для свечей из REST-кэша)
+# популярный график рисуется один раз. Общий объём ограничен
+# CHART_CACHE_BYTES, при переполнении вытесняются давно не запрошенные.
+CHART_CACHE_BYTES = int(os.getenv("CHART_CACHE_BYTES", str(32 * 1024 * 1024)))
+_chart_cache: "OrderedDict[tuple, bytes]" = OrderedDict()
+_chart_cache_lock = threading.Lock()
+_chart_cache_stats = {"hits": 0, "misses": 0, "bytes": 0}
+# Один и тот же снимок графика, запрошенный одновременно, рисуется один раз
+_chart_flights = SingleFlight("chart")
+
+def _chart_cache_key(symbol: str, interval: str, df: pd.DataFrame, levels: Optional[List[float]]) -> Optional[tuple]:
+    if df.empty:
+        return None
+    last = df.iloc[-1]
+    last_candle = (
+        int(df.index[-1].timestamp() * 1000),
+        float(last["close"]), float(last["high"]), float(last["low"]), float(last["volume"])
     )
-    return path
+    levels_key = tuple(round(float(level), 8) for level in levels) if levels else ()
+    return (symbol.upper(), interval, last_candle, levels_key, STYLE_VERSION)
+
+def _multi_chart_cache_key(symbol: str, frames: Dict[str, pd.DataFrame], levels: Dict[str, List[float]]) -> Optional[tuple]:
+    keys = [_chart_cache_key(symbol, tf, df, levels.get(tf)) for tf, df in frames.items()]
+    if any(key is None for key in keys):
+        return None
+    # (symbol, "15m/1h/4h", последние свечи, уровни, STYLE_VERSION)
+    return (symbol.upper(), "/".join(frames), tuple(k[2] for k in keys), tuple(k[3] for k in keys), STYLE_VERSION)
+
+def _get_cached_chart(key: tuple) -> Optional[bytes]:
+    with _chart_cache_lock:
+        png = _chart_cache.get(key)
+        if png is None:
+            _chart_cache_stats["misses"] += 1
+            return None
+        _chart_cache.move_to_end(key)
+        _chart_cache_stats["hits"] += 1
+        return png
+
+def _store_cached_chart(key: tuple, png: bytes) -> None:
+    if len(png) > CHART_CACHE_BYTES:
+        return
+    with _chart_cache_lock:
+        old = _chart_cache.pop(key, None)
+        if old is not None:
+            _chart_cache_stats["bytes"] -= len(old)
+        _chart_cache[key] = png
+        _chart_cache_stats["bytes"] += len(png)
+        while _chart_cache_stats["bytes"] > CHART_CACHE_BYTES:
+            _, evicted = _chart_cache.popitem(last=False)
+            _chart_cache_stats["bytes"] -= len(evicted)
+
+def get_chart_cache_stats() -> dict:
+    """
+    Счётчики кэша готовых графиков.
+    """
+    with _chart_cache_lock:
+        hits = _chart_cache_stats["hits"]
+        misses = _chart_cache_stats["misses"]
+        entries = len(_chart_cache)
+        size = _chart_cache_stats["bytes"]
+    total = hits + misses
+    return {
+        "hits": hits,
+        "misses": misses,
+        "entries": entries,
+        "bytes": size,
+        "hit_rate": round(hits / total, 3) if total else 0.0
+    }
 
+def clear_chart_cache() -> None:
+    with _chart_cache_lock:
+        _chart_cache.clear()
+        _chart_cache_stats["bytes"] = 0
 
-def generate_chart(
+async def _render(stage: str, symbol: str, timeframe: Optional[str], render) -> bytes:
+    """
+    Замер самой отрисовки: попадания в кэш, загрузка свечей и ожидание чужой
+    отрисовки того же графика в этап не входят (попадания — в get_chart_cache_stats).
+    """
+    async with span(stage, symbol, timeframe):
+        return await render
+
+async def _render_cached(key: tuple, render) -> bytes:
+    png = await render
+    logging.info(f"[CHART] График {key[0]} {key[1]}: {len(png)} байт")
+    if png:
+        _store_cached_chart(key, png)
+    return png
+
+async def generate_chart_async(
     symbol: str,
     interval_binance: str = "15m",
-    output_path: str = "chart.png",
     levels: Optional[List[float]] = None,
-    arrows: Optional[List[dict]] = None
-) -> str:
+    df: Optional[pd.DataFrame] = None
+) -> bytes:
+    """
+    График последних CHART_CANDLES свечей: рисует в пуле процессов chart_renderer
+    и возвращает PNG байтами — без временных файлов. Готовые графики берутся из кэша. При ошибке — b"".
+    """
+    try:
+        logging.info(f"[CHART] generate_chart_async: symbol={symbol}, interval={interval_binance}, levels={levels}")
+        if df is None:
+            df = await get_ohlcv_async(symbol, interval_binance, limit=CHART_CANDLES)
+        df_short = df.iloc[-CHART_CANDLES:]
+        key = _chart_cache_key(symbol, interval_binance, df_short, levels)
+        if key is not None:
+            cached = _get_cached_chart(key)
+            if cached is not None:
+                logging.debug(f"[CHART][CACHE] Попадание: {symbol} {interval_binance}")
+                return cached
+            return await _chart_flights.do(key, lambda: _render_cached(key, _render(
+                "render_chart", symbol, interval_binance, render_chart_async(df_short, levels=levels, symbol=symbol)
+            )))
+        png = await _render("render_chart", symbol, interval_binance, render_chart_async(df_short, levels=levels, symbol=symbol))
+        logging.info(f"[CHART] График {symbol} {interval_binance}: {len(png)} байт")
+        return png
+    except Exception as e:
+        logging.exception(f"[CHART][ERROR] Ошибка генерации графика: {e}")
+        return b""
+
+async def generate_multi_chart_async(
+    symbol: str,
+    frames: Dict[str, pd.DataFrame],
+    levels: Optional[Dict[str, List[float]]] = None
+) -> bytes:
+    """
+    Один график на несколько таймфреймов (свечи, EMA, MACD, уровни) по уже
+    загруженным свечам — без повторных запросов. При ошибке — b"".
+    :param frames: {таймфрейм: свечи}, на график попадают последние CHART_CANDLES
+    :param levels: {таймфрейм: [поддержка, сопротивление]}
+    """
+    levels = levels or {}
     try:
-        logging.info(f"[CHART] generate_chart: symbol={symbol}, interval={interval_binance}, output_path={output_path}, levels={levels}")
-        df_short = get_ohlcv(symbol, interval_binance)
-        # Для dual chart используем 1h как long, если не совпадает
-        df_long = get_ohlcv(symbol, "1h") if interval_binance != "1h" else df_short
-        path = render_dual_chart(df_short, df_long, levels=levels, arrows=arrows, symbol=symbol)
-        if path and path != output_path:
-            os.rename(path, output_path)
-            logging.info(f"[CHART] Переименован {path} -> {output_path}")
-        if path:
-            logging.info(f"[CHART] Итоговый путь графика: {output_path}")
-            return output_path
-        else:
-            logging.error(f"[CHART] График не был создан для {symbol} {interval_binance}")
-            return ""
+        logging.info(f"[CHART] generate_multi_chart_async: symbol={symbol}, intervals={list(frames)}, levels={levels}")
+        frames = {tf: df.iloc[-CHART_CANDLES:] for tf, df in frames.items()}
+        key = _multi_chart_cache_key(symbol, frames, levels)
+        if key is not None:
+            cached = _get_cached_chart(key)
+            if cached is not None:
+                logging.debug(f"[CHART][CACHE] Попадание: {symbol} {'/'.join(frames)}")
+                return cached
+            return await _chart_flights.do(key, lambda: _render_cached(key, _render(
+                "render_multi_chart", symbol, None, render_multi_chart_async(frames, levels=levels, symbol=symbol)
+            )))
+        png = await _render("render_multi_chart", symbol, None, render_multi_chart_async(frames, levels=levels, symbol=symbol))
+        logging.info(f"[CHART] График {symbol} {'/'.join(frames)}: {len(png)} байт")
+        return png
     except Exception as e:
         logging.exception(f"[CHART][ERROR] Ошибка генерации графика: {e}")
-        return ""
+        return b""
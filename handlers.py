@@ -1,14 +1,46 @@
 from aiogram import types
-from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InputFile, InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardRemove
-from services import get_forecast, generate_signal, safe_generate_explanation, get_support_resistance
+from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardRemove
+from services import generate_signal, safe_generate_explanation
 from utils import user_state, symbols
 from bot_init import bot, dp
+import asyncio
 import logging
 import os
-from charting import get_ohlcv, generate_chart
-from llm_explainer import generate_direction_and_probability, generate_full_forecast
+from charting import get_ohlcv_cache_stats, get_chart_cache_stats, FULL_CHART_MODE
+from chart_delivery import send_chart, send_chart_group
+from pipeline import AnalysisPipeline, load_pipelines, forecast_pipelines, chart_pipelines, chart_multi_pipelines
+from llm_explainer import generate_timeframe_analysis, format_direction, get_llm_cache_stats
+from single_flight import get_single_flight_stats
+from signal_model import analysis_mode, local_analysis
+from llm_client import LLM_STREAMING
+from message_stream import StreamingMessage, MESSAGE_MAX_LENGTH, pack_lines
+from metrics import set_tags, get_stage_stats
 import re
 
+# Telegram id администраторов через запятую: им доступна команда /stats
+ADMIN_IDS = {int(x) for x in os.getenv("ADMIN_IDS", "").replace(" ", "").split(",") if x}
+
+async def send_full_charts(chat_id: int, symbol: str, pipelines: list, captions: list, parse_mode: str = None) -> None:
+    """
+    Графики полного прогноза: 15m/1h/4h одной картинкой (FULL_CHART_MODE=multi)
+    или тремя картинками одним альбомом.
+    """
+    if FULL_CHART_MODE == "multi":
+        png = await chart_multi_pipelines(pipelines)
+        if png:
+            caption = f"📊 График {' / '.join(p.timeframe for p in pipelines)}"
+            await send_chart(chat_id, png, symbol, "multi", caption=caption, parse_mode=parse_mode)
+        else:
+            await bot.send_message(chat_id, "⚠️ Не удалось построить график.")
+        return
+    charts = await chart_pipelines(pipelines)
+    await send_chart_group(chat_id, [
+        (png, symbol, p.timeframe, caption) for png, p, caption in zip(charts, pipelines, captions)
+    ], parse_mode=parse_mode)
+    for png, caption in zip(charts, captions):
+        if not png:
+            await bot.send_message(chat_id, f"⚠️ Не удалось построить {caption.lower()}.")
+
 # --- Главное меню ---
 def get_main_menu():
     kb = ReplyKeyboardMarkup(resize_keyboard=True)
@@ -64,6 +96,32 @@ async def help_command(msg: types.Message):
     """Обработчик команды /help. Выводит инструкцию по использованию бота."""
     await msg.answer("\U0001F4B0 <b>Инструкция:</b>\n1. Выберите монету.\n2. Выберите таймфрейм.\n3. Получите сигнал, объяснение и график.\n\nДля возврата используйте кнопку 'Назад'.", parse_mode="HTML")
 
+@dp.message_handler(commands=['stats'])
+async def stats_command(msg: types.Message):
+    """Обработчик команды /stats (только для ADMIN_IDS): задержки этапов и кэши."""
+    if msg.from_user.id not in ADMIN_IDS:
+        await msg.answer("Пожалуйста, выберите монету из списка или используйте /help.")
+        return
+    stages = get_stage_stats()
+    lines = [f"{'этап':<28}{'n':>6}{'p50':>9}{'p95':>9}{'p99':>9}"]
+    for stage, st in stages.items():
+        errors = f" ({st['errors']} ош.)" if st["errors"] else ""
+        lines.append(f"{stage:<28}{st['count']:>6}{st['p50_ms']:>9}{st['p95_ms']:>9}{st['p99_ms']:>9}{errors}")
+    if not stages:
+        lines.append("замеров пока нет")
+    caches = (
+        f"Свечи: {get_ohlcv_cache_stats()}\n"
+        f"Графики: {get_chart_cache_stats()}\n"
+        f"LLM: {get_llm_cache_stats()}\n"
+        f"Склейка: {get_single_flight_stats()}"
+    )
+    # Длинная таблица — несколькими сообщениями, каждое со своим <pre>
+    table = pack_lines(lines, MESSAGE_MAX_LENGTH - 64)
+    blocks = ["<b>📈 Задержки этапов, мс</b>\n<pre>" + table[0] + "</pre>"] + ["<pre>" + chunk + "</pre>" for chunk in table[1:]]
+    blocks.append("<b>Кэши</b>\n<pre>" + caches + "</pre>")
+    for text in pack_lines(blocks):
+        await msg.answer(text, parse_mode="HTML")
+
 def get_symbols_keyboard():
     kb = ReplyKeyboardMarkup(resize_keyboard=True)
     for i in range(0, len(symbols), 3):
@@ -102,85 +160,50 @@ async def choose_timeframe(msg: types.Message):
         "Полный прогноз": "full"
     }
     tf = tf_map[msg.text]
+    set_tags(handler="choose_timeframe", symbol=symbol, timeframe=tf)
     try:
-        import time
         user_id = msg.from_user.id
         loader_msg = await msg.answer("⏳ Анализируем... Пожалуйста, подождите", reply_markup=ReplyKeyboardRemove())
         if tf == "full":
-            # Получаем данные для всех таймфреймов
-            tf_data_15m = get_forecast(symbol, "15m")
-            tf_data_1h = get_forecast(symbol, "1h")
-            tf_data_4h = get_forecast(symbol, "4h")
-            # Получаем вероятности и направления для каждого таймфрейма
-            prob_15m = await generate_direction_and_probability(tf_data_15m["indicators"], "15m", symbol)
-            prob_1h = await generate_direction_and_probability(tf_data_1h["indicators"], "1h", symbol)
-            prob_4h = await generate_direction_and_probability(tf_data_4h["indicators"], "4h", symbol)
-            probs = {"15m": prob_15m, "1h": prob_1h, "4h": prob_4h}
-            # Получаем уровни поддержки/сопротивления
-            df_15m = get_ohlcv(symbol, "15m", limit=300)
-            support_15m, resistance_15m = get_support_resistance(df_15m)
-            df_1h = get_ohlcv(symbol, "1h", limit=300)
-            support_1h, resistance_1h = get_support_resistance(df_1h)
-            df_4h = get_ohlcv(symbol, "4h", limit=300)
-            support_4h, resistance_4h = get_support_resistance(df_4h)
-            # Генерируем графики
-            chart_path_15m = generate_chart(symbol, interval_binance="15m", output_path=f"chart_15m_{user_id}_{int(time.time())}.png", levels=[support_15m, resistance_15m])
-            chart_path_1h = generate_chart(symbol, interval_binance="1h", output_path=f"chart_1h_{user_id}_{int(time.time())}.png", levels=[support_1h, resistance_1h])
-            chart_path_4h = generate_chart(symbol, interval_binance="4h", output_path=f"chart_4h_{user_id}_{int(time.time())}.png", levels=[support_4h, resistance_4h])
-            # Новый: один LLM-запрос для всего анализа
-            full_forecast = await generate_full_forecast(symbol, tf_data_15m["indicators"], tf_data_1h["indicators"], tf_data_4h["indicators"])
-            formatted_forecast = format_full_forecast_text(full_forecast, probs=probs)
-            await msg.answer(f"<b>{symbol} — Полный прогноз</b>\n" + formatted_forecast, parse_mode="HTML")
-            # Отправляем графики
-            if chart_path_15m:
-                if os.path.exists(chart_path_15m):
-                    with open(chart_path_15m, "rb") as photo:
-                        await msg.answer_photo(photo, caption="График 15 минут")
-                    try:
-                        os.remove(chart_path_15m)
-                    except Exception as e:
-                        logging.warning(f"[CLEANUP] Не удалось удалить {chart_path_15m}: {e}")
-                else:
-                    await msg.answer("⚠️ Не удалось построить график 15 минут.")
-            if chart_path_1h:
-                if os.path.exists(chart_path_1h):
-                    with open(chart_path_1h, "rb") as photo:
-                        await msg.answer_photo(photo, caption="График 1 час")
-                    try:
-                        os.remove(chart_path_1h)
-                    except Exception as e:
-                        logging.warning(f"[CLEANUP] Не удалось удалить {chart_path_1h}: {e}")
-                else:
-                    await msg.answer("⚠️ Не удалось построить график 1 час.")
-            if chart_path_4h:
-                if os.path.exists(chart_path_4h):
-                    with open(chart_path_4h, "rb") as photo:
-                        await msg.answer_photo(photo, caption="График 4 часа")
-                    try:
-                        os.remove(chart_path_4h)
-                    except Exception as e:
-                        logging.warning(f"[CLEANUP] Не удалось удалить {chart_path_4h}: {e}")
-                else:
-                    await msg.answer("⚠️ Не удалось построить график 4 часа.")
+            # Свечи по всем таймфреймам загружаются один раз и параллельно
+            p15, p1h, p4h = await load_pipelines(symbol, ["15m", "1h", "4h"])
+            tf_data_15m, tf_data_1h, tf_data_4h = await forecast_pipelines([p15, p1h, p4h])
+            indicators = {"15m": tf_data_15m["indicators"], "1h": tf_data_1h["indicators"], "4h": tf_data_4h["indicators"]}
+            # Один структурный LLM-запрос на таймфрейм: вывод, направление и вероятность.
+            # Черновики выводов показываются в сообщении-заглушке по мере генерации
+            streamer = StreamingMessage(loader_msg.chat.id, loader_msg.message_id) if LLM_STREAMING else None
+            on_text = stream_preview(streamer, f"⏳ {symbol} — Полный прогноз", list(indicators)) if streamer else None
+            analyses = await analyze_timeframes(symbol, indicators, on_text=on_text)
+            formatted_forecast = format_full_forecast_text(analyses, indicators)
+            text = f"<b>{symbol} — Полный прогноз</b>\n" + formatted_forecast
+            if streamer is None or not await streamer.finish(text, parse_mode="HTML"):
+                await msg.answer(text, parse_mode="HTML")
+            # Графики на тех же свечах
+            await send_full_charts(msg.chat.id, symbol, [p15, p1h, p4h], ["График 15 минут", "График 1 час", "График 4 часа"])
         else:
             # Для отдельного таймфрейма логика прежняя
-            tf_data = get_forecast(symbol, tf)
-            short_comment = await safe_generate_short_comment(tf_data["indicators"], tf, symbol)
-            df = get_ohlcv(symbol, tf, limit=300)
-            support, resistance = get_support_resistance(df)
-            chart_path = generate_chart(symbol, interval_binance=tf, output_path=f"chart_{tf}_{user_id}_{int(time.time())}.png", levels=[support, resistance])
-            block = await format_analysis_block(symbol, tf, tf_data["indicators"], short_comment, support, resistance)
-            await msg.answer(block, parse_mode="HTML")
-            if chart_path:
-                if os.path.exists(chart_path):
-                    with open(chart_path, "rb") as photo:
-                        await msg.answer_photo(photo, caption=f"График {msg.text}")
-                    try:
-                        os.remove(chart_path)
-                    except Exception as e:
-                        logging.warning(f"[CLEANUP] Не удалось удалить {chart_path}: {e}")
-                else:
-                    await msg.answer(f"⚠️ Не удалось построить график {msg.text}.")
+            pipeline = AnalysisPipeline(symbol, tf)
+            await pipeline.load()
+            tf_data = await pipeline.forecast()
+            streamer = StreamingMessage(loader_msg.chat.id, loader_msg.message_id) if LLM_STREAMING else None
+            on_text = stream_preview(streamer, f"⏳ {symbol} — {msg.text}", [tf]) if streamer else None
+            # График рисуется, пока идёт ответ LLM
+            analysis, chart = await asyncio.gather(
+                safe_generate_analysis(tf_data["indicators"], tf, symbol, on_text=(lambda text: on_text(tf, text)) if on_text else None),
+                pipeline.chart()
+            )
+            support, resistance = pipeline.levels()
+            block = await format_analysis_block(symbol, tf, tf_data["indicators"], analysis, support, resistance)
+            if streamer is None or not await streamer.finish(block, parse_mode="HTML"):
+                await msg.answer(block, parse_mode="HTML")
+            if chart:
+                await send_chart(msg.chat.id, chart, symbol, tf, caption=f"График {msg.text}")
+            else:
+                await msg.answer(f"⚠️ Не удалось построить график {msg.text}.")
+        logging.info(f"[BINANCE][CACHE] {get_ohlcv_cache_stats()}")
+        logging.info(f"[CHART][CACHE] {get_chart_cache_stats()}")
+        logging.info(f"[LLM][CACHE] {get_llm_cache_stats()}")
+        logging.info(f"[SINGLE_FLIGHT] {get_single_flight_stats()}")
         await msg.answer("Выберите таймфрейм:", reply_markup=get_timeframes_keyboard())
     except Exception as e:
         await msg.answer(f"Ошибка анализа: {e}", reply_markup=get_timeframes_keyboard())
@@ -206,109 +229,68 @@ async def handle_forecast_query(callback_query: types.CallbackQuery):
     try:
         await callback_query.answer()
         tf = callback_query.data  # forecast_15m, forecast_1h, forecast_full
+        set_tags(handler="forecast_query", symbol=symbol, timeframe=tf.replace("forecast_", ""))
         logging.info(f"[FORECAST] Пользователь {user_id} запросил прогноз по {symbol} ({tf})")
-        import time
         if tf == "forecast_15m":
-            tf15 = get_forecast(symbol, "15m")
-            short_comment_15m = await safe_generate_short_comment(tf15["indicators"], "15m", symbol)
-            df_short = get_ohlcv(symbol, "15m", limit=300)
-            support, resistance = get_support_resistance(df_short)
-            levels = [float(support), float(resistance)]
-            chart_path_15m = None
-            try:
-                chart_path_15m = generate_chart(symbol, interval_binance="15m", output_path=f"chart_15m_{user_id}_{int(time.time())}.png", levels=levels)
-            except Exception as e:
-                logging.error(f"Ошибка генерации графика: {e}")
-            block = await format_analysis_block(symbol, '15m', tf15["indicators"], short_comment_15m, support, resistance)
+            pipeline = AnalysisPipeline(symbol, "15m")
+            await pipeline.load()
+            tf15 = await pipeline.forecast()
+            analysis_15m = await safe_generate_analysis(tf15["indicators"], "15m", symbol)
+            support, resistance = pipeline.levels()
+            chart_15m = await pipeline.chart()
+            block = await format_analysis_block(symbol, '15m', tf15["indicators"], analysis_15m, support, resistance)
             await bot.send_message(user_id, block, parse_mode="HTML")
-            if chart_path_15m and os.path.exists(chart_path_15m):
-                await bot.send_photo(user_id, InputFile(chart_path_15m), caption="📉 График 15m", parse_mode="HTML")
-                try:
-                    os.remove(chart_path_15m)
-                except Exception as e:
-                    logging.warning(f"[CLEANUP] Не удалось удалить {chart_path_15m}: {e}")
-            elif not chart_path_15m:
+            if chart_15m:
+                await send_chart(user_id, chart_15m, symbol, "15m", caption="📉 График 15m", parse_mode="HTML")
+            else:
                 await bot.send_message(user_id, "⚠️ Не удалось построить график.")
         elif tf == "forecast_1h":
-            tf1h = get_forecast(symbol, "1h")
-            short_comment_1h = await safe_generate_short_comment(tf1h["indicators"], "1h", symbol)
-            df_short = get_ohlcv(symbol, "1h", limit=300)
-            support, resistance = get_support_resistance(df_short)
-            levels = [float(support), float(resistance)]
-            chart_path_1h = None
-            try:
-                chart_path_1h = generate_chart(symbol, interval_binance="1h", output_path=f"chart_1h_{user_id}_{int(time.time())}.png", levels=levels)
-            except Exception as e:
-                logging.error(f"Ошибка генерации графика: {e}")
-            block = await format_analysis_block(symbol, '1h', tf1h["indicators"], short_comment_1h, support, resistance)
+            pipeline = AnalysisPipeline(symbol, "1h")
+            await pipeline.load()
+            tf1h = await pipeline.forecast()
+            analysis_1h = await safe_generate_analysis(tf1h["indicators"], "1h", symbol)
+            support, resistance = pipeline.levels()
+            chart_1h = await pipeline.chart()
+            block = await format_analysis_block(symbol, '1h', tf1h["indicators"], analysis_1h, support, resistance)
             await bot.send_message(user_id, block, parse_mode="HTML")
-            if chart_path_1h and os.path.exists(chart_path_1h):
-                await bot.send_photo(user_id, InputFile(chart_path_1h), caption="⏰ График 1h", parse_mode="HTML")
-                try:
-                    os.remove(chart_path_1h)
-                except Exception as e:
-                    logging.warning(f"[CLEANUP] Не удалось удалить {chart_path_1h}: {e}")
-            elif not chart_path_1h:
+            if chart_1h:
+                await send_chart(user_id, chart_1h, symbol, "1h", caption="⏰ График 1h", parse_mode="HTML")
+            else:
                 await bot.send_message(user_id, "⚠️ Не удалось построить график.")
         elif tf == "forecast_4h":
-            tf4h = get_forecast(symbol, "4h")
-            short_comment_4h = await safe_generate_short_comment(tf4h["indicators"], "4h", symbol)
-            df_short = get_ohlcv(symbol, "4h", limit=300)
-            support, resistance = get_support_resistance(df_short)
-            levels = [float(support), float(resistance)]
-            chart_path_4h = None
-            import time
-            try:
-                chart_path_4h = generate_chart(symbol, interval_binance="4h", output_path=f"chart_4h_{user_id}_{int(time.time())}.png", levels=levels)
-            except Exception as e:
-                logging.error(f"Ошибка генерации графика: {e}")
-            block = await format_analysis_block(symbol, '4h', tf4h["indicators"], short_comment_4h, support, resistance)
+            pipeline = AnalysisPipeline(symbol, "4h")
+            await pipeline.load()
+            tf4h = await pipeline.forecast()
+            analysis_4h = await safe_generate_analysis(tf4h["indicators"], "4h", symbol)
+            support, resistance = pipeline.levels()
+            chart_4h = await pipeline.chart()
+            block = await format_analysis_block(symbol, '4h', tf4h["indicators"], analysis_4h, support, resistance)
             await bot.send_message(user_id, block, parse_mode="HTML")
-            if chart_path_4h and os.path.exists(chart_path_4h):
-                await bot.send_photo(user_id, InputFile(chart_path_4h), caption="🕓 График 4h", parse_mode="HTML")
-                try:
-                    os.remove(chart_path_4h)
-                except Exception as e:
-                    logging.warning(f"[CLEANUP] Не удалось удалить {chart_path_4h}: {e}")
-            elif not chart_path_4h:
+            if chart_4h:
+                await send_chart(user_id, chart_4h, symbol, "4h", caption="🕓 График 4h", parse_mode="HTML")
+            else:
                 await bot.send_message(user_id, "⚠️ Не удалось построить график.")
         else:  # forecast_full
-            tf15 = get_forecast(symbol, "15m")
-            tf1h = get_forecast(symbol, "1h")
-            tf4h = get_forecast(symbol, "4h")
-            short_comment_15m = await safe_generate_short_comment(tf15["indicators"], "15m", symbol)
-            short_comment_1h = await safe_generate_short_comment(tf1h["indicators"], "1h", symbol)
-            short_comment_4h = await safe_generate_short_comment(tf4h["indicators"], "4h", symbol)
-            df_15m = get_ohlcv(symbol, "15m", limit=300)
-            support_15m, resistance_15m = get_support_resistance(df_15m)
-            df_1h = get_ohlcv(symbol, "1h", limit=300)
-            support_1h, resistance_1h = get_support_resistance(df_1h)
-            df_4h = get_ohlcv(symbol, "4h", limit=300)
-            support_4h, resistance_4h = get_support_resistance(df_4h)
-            chart_path_15m = None
-            chart_path_1h = None
-            chart_path_4h = None
-            try:
-                chart_path_15m = generate_chart(symbol, interval_binance="15m", output_path=f"chart_15m_{user_id}_{int(time.time())}.png", levels=[float(support_15m), float(resistance_15m)])
-                chart_path_1h = generate_chart(symbol, interval_binance="1h", output_path=f"chart_1h_{user_id}_{int(time.time())}.png", levels=[float(support_1h), float(resistance_1h)])
-                chart_path_4h = generate_chart(symbol, interval_binance="4h", output_path=f"chart_4h_{user_id}_{int(time.time())}.png", levels=[float(support_4h), float(resistance_4h)])
-            except Exception as e:
-                logging.error(f"Ошибка генерации графиков: {e}")
+            p15, p1h, p4h = await load_pipelines(symbol, ["15m", "1h", "4h"])
+            tf15, tf1h, tf4h = await forecast_pipelines([p15, p1h, p4h])
+            analyses = await analyze_timeframes(symbol, {"15m": tf15["indicators"], "1h": tf1h["indicators"], "4h": tf4h["indicators"]})
+            support_15m, resistance_15m = p15.levels()
+            support_1h, resistance_1h = p1h.levels()
+            support_4h, resistance_4h = p4h.levels()
             blocks = [
-                (await format_analysis_block(symbol, '15m', tf15["indicators"], short_comment_15m, support_15m, resistance_15m), chart_path_15m, "📉 График 15m"),
-                (await format_analysis_block(symbol, '1h', tf1h["indicators"], short_comment_1h, support_1h, resistance_1h), chart_path_1h, "⏰ График 1h"),
-                (await format_analysis_block(symbol, '4h', tf4h["indicators"], short_comment_4h, support_4h, resistance_4h), chart_path_4h, "🕓 График 4h")
+                await format_analysis_block(symbol, '15m', tf15["indicators"], analyses["15m"], support_15m, resistance_15m),
+                await format_analysis_block(symbol, '1h', tf1h["indicators"], analyses["1h"], support_1h, resistance_1h),
+                await format_analysis_block(symbol, '4h', tf4h["indicators"], analyses["4h"], support_4h, resistance_4h)
             ]
-            for block, chart_path, chart_caption in blocks:
+            for block in blocks:
                 await bot.send_message(user_id, block, parse_mode="HTML")
-                if chart_path and os.path.exists(chart_path):
-                    await bot.send_photo(user_id, InputFile(chart_path), caption=chart_caption, parse_mode="HTML")
-                    try:
-                        os.remove(chart_path)
-                    except Exception as e:
-                        logging.warning(f"[CLEANUP] Не удалось удалить {chart_path}: {e}")
+            await send_full_charts(user_id, symbol, [p15, p1h, p4h], ["📉 График 15m", "⏰ График 1h", "🕓 График 4h"], parse_mode="HTML")
             await bot.send_message(user_id, "💡 <b>Общий вывод:</b>\nПодтверждайте вход сигналом. Не используйте высокое плечо на слабом тренде.", parse_mode="HTML")
         logging.info(f"[FORECAST_SUCCESS] Анализ и графики по {symbol} отправлены пользователю {user_id}")
+        logging.info(f"[BINANCE][CACHE] {get_ohlcv_cache_stats()}")
+        logging.info(f"[CHART][CACHE] {get_chart_cache_stats()}")
+        logging.info(f"[LLM][CACHE] {get_llm_cache_stats()}")
+        logging.info(f"[SINGLE_FLIGHT] {get_single_flight_stats()}")
     except Exception as e:
         if 'insufficient_quota' in str(e):
             await bot.send_message(user_id, "🚫 Ошибка: превышен лимит OpenAI. Пополните баланс или используйте другой ключ.")
@@ -371,33 +353,67 @@ def build_indicators_block(symbol: str, indicators: dict) -> str:
         f"Текущий тренд: {indicators.get('trend', '-')}"
     )
 
-async def safe_generate_short_comment(indicators: dict, timeframe: str, symbol: str, max_retries: int = 3, delay: int = 2) -> str:
-    from llm_explainer import generate_short_comment
+async def safe_generate_analysis(indicators: dict, timeframe: str, symbol: str, max_retries: int = 3, delay: int = 2, on_text=None) -> dict:
+    """
+    Структурный анализ таймфрейма (вывод, направление, вероятность) с повторами при ошибке.
+    В режиме ANALYSIS_MODE=local (при откалиброванной модели) — локальная модель без LLM; если LLM не дала
+    направление, оно и вероятность берутся из модели.
+    """
+    if analysis_mode() == "local":
+        return local_analysis(indicators)
+    analysis = {"comment": "—", "direction": None, "probability": None}
     for attempt in range(max_retries):
+        # Ошибку LLM generate_timeframe_analysis не поднимает, а возвращает ответ без направления
         try:
-            return await generate_short_comment(indicators, timeframe, symbol)
+            analysis = await generate_timeframe_analysis(indicators, timeframe, symbol, on_text=on_text)
         except Exception as e:
-            import asyncio
-            if attempt < max_retries - 1:
-                await asyncio.sleep(delay)
-            else:
-                return "—"
-    return "—"
+            logging.exception(f"[LLM] Ошибка анализа {symbol} {timeframe} (попытка {attempt + 1}/{max_retries}): {e}")
+        if analysis["direction"] is not None and analysis["probability"] is not None:
+            break
+        if attempt < max_retries - 1:
+            logging.warning(f"[LLM] Нет направления в анализе {symbol} {timeframe} (попытка {attempt + 1}/{max_retries}), повтор через {delay} с")
+            await asyncio.sleep(delay)
+    if analysis["direction"] is None or analysis["probability"] is None:
+        local = local_analysis(indicators)
+        analysis["direction"] = local["direction"]
+        analysis["probability"] = local["probability"]
+        if analysis["comment"] in ("", "—"):
+            analysis["comment"] = local["comment"]
+    return analysis
+
+async def analyze_timeframes(symbol: str, indicators: dict, on_text=None) -> dict:
+    """
+    Параллельно получает анализ для нескольких таймфреймов: {tf: индикаторы} -> {tf: анализ}.
+    :param on_text: on_text(tf, черновик вывода) — для потокового показа ответа
+    """
+    def tf_callback(tf):
+        return (lambda text: on_text(tf, text)) if on_text is not None else None
+    results = await asyncio.gather(*(safe_generate_analysis(ind, tf, symbol, on_text=tf_callback(tf)) for tf, ind in indicators.items()))
+    return dict(zip(indicators, results))
+
+def stream_preview(streamer: StreamingMessage, title: str, timeframes: list):
+    """
+    Колбэк для analyze_timeframes: собирает черновики выводов по таймфреймам в одно сообщение.
+    """
+    tf_names = {"15m": "15 минут", "1h": "1 час", "4h": "4 часа"}
+    drafts = {}
+    def on_text(tf: str, text: str) -> None:
+        drafts[tf] = text
+        lines = [title] + [f"{tf_names.get(t, t)}: {drafts[t]}" for t in timeframes if t in drafts]
+        streamer.update("\n\n".join(lines))
+    return on_text
 
-async def generate_general_summary(symbol: str, indicators_15m: dict, indicators_1h: dict, indicators_4h: dict) -> str:
-    # Получаем прогноз направления и вероятности для каждого таймфрейма через LLM
-    pred_15m = await generate_direction_and_probability(indicators_15m, '15m', symbol)
-    pred_1h = await generate_direction_and_probability(indicators_1h, '1h', symbol)
-    pred_4h = await generate_direction_and_probability(indicators_4h, '4h', symbol)
-    # Определяем направление и вероятность для каждого таймфрейма
-    def parse_pred(pred):
-        if 'ШОРТ' in pred.upper():
-            return 'Шорт', int(''.join(filter(str.isdigit, pred))) if any(c.isdigit() for c in pred) else 0
+def generate_general_summary(analyses: dict) -> str:
+    # Общий вывод по направлениям и вероятностям таймфреймов — без отдельного запроса к LLM
+    def parse_pred(analysis):
+        prob = analysis.get('probability') or 0
+        if analysis.get('direction') == 'ШОРТ':
+            return 'Шорт', prob
         else:
-            return 'Лонг', int(''.join(filter(str.isdigit, pred))) if any(c.isdigit() for c in pred) else 0
-    dir_15m, prob_15m = parse_pred(pred_15m)
-    dir_1h, prob_1h = parse_pred(pred_1h)
-    dir_4h, prob_4h = parse_pred(pred_4h)
+            return 'Лонг', prob
+    dir_15m, prob_15m = parse_pred(analyses['15m'])
+    dir_1h, prob_1h = parse_pred(analyses['1h'])
+    dir_4h, prob_4h = parse_pred(analyses['4h'])
     # Формируем строки с эмодзи
     def emoji_line(tf, direction, prob):
         if direction == 'Лонг':
@@ -428,7 +444,7 @@ async def generate_general_summary(symbol: str, indicators_15m: dict, indicators
 
 # format_analysis_block — структура: аналитика, индикаторы, краткий вывод, ОДИН заголовок "Торговая рекомендация:", тело рекомендации, ОДНО предупреждение, ссылка
 
-async def format_analysis_block(symbol: str, tf: str, indicators: dict, short_comment: str, support: float, resistance: float) -> str:
+async def format_analysis_block(symbol: str, tf: str, indicators: dict, analysis: dict, support: float, resistance: float) -> str:
     tf_map = {"15m": "15 минут", "1h": "1 час", "4h": "4 часа"}
     # --- Индикаторы ---
     def build_indicators_block(symbol: str, indicators: dict) -> str:
@@ -446,75 +462,15 @@ async def format_analysis_block(symbol: str, tf: str, indicators: dict, short_co
             f"Текущий тренд: {indicators.get('trend', '-')}"
         )
     indicators_block = build_indicators_block(symbol, indicators)
-    short_comment = short_comment.strip()
-    # --- Вероятность и направление ---
-    prob_block = await generate_direction_and_probability(indicators, tf, symbol)
-    import re
-    
-    # Улучшенный парсинг ответа ИИ
-    def parse_ai_response(response: str, indicators: dict) -> tuple:
-        response_upper = response.upper()
-        
-        # Пытаемся найти направление в ответе ИИ
-        if "ЛОНГ" in response_upper or "ПОКУП" in response_upper or "ВВЕРХ" in response_upper:
-            direction = "ЛОНГ"
-            emoji = "🟢"
-        elif "ШОРТ" in response_upper or "ПРОДАЖ" in response_upper or "ВНИЗ" in response_upper:
-            direction = "ШОРТ"
-            emoji = "🔴"
-        else:
-            # Fallback: определяем направление по индикаторам
-            direction, emoji = determine_direction_from_indicators(indicators)
-        
-        # Извлекаем процент
-        match = re.search(r"(\d{2,3})", response)
-        percent = match.group(1) if match else "65"
-        
-        return direction, emoji, percent
-    
-    def determine_direction_from_indicators(indicators: dict) -> tuple:
-        """Определяет направление на основе индикаторов"""
-        buy_signals = 0
-        sell_signals = 0
-        
-        # RSI
-        rsi = indicators.get('RSI', '')
-        if isinstance(rsi, str) and rsi != '-':
-            try:
-                rsi_val = float(rsi)
-                if rsi_val < 30:
-                    buy_signals += 1
-                elif rsi_val > 70:
-                    sell_signals += 1
-            except:
-                pass
-        
-        # MACD
-        macd = indicators.get('MACD', '')
-        if isinstance(macd, str) and 'положительный' in macd.lower():
-            buy_signals += 1
-        elif isinstance(macd, str) and 'отрицательный' in macd.lower():
-            sell_signals += 1
-        
-
-        
-        # Тренд
-        trend = indicators.get('trend', '')
-        if 'бычий' in trend.lower():
-            buy_signals += 1
-        elif 'медвежий' in trend.lower():
-            sell_signals += 1
-        
-        # Определяем направление
-        if buy_signals > sell_signals:
-            return "ЛОНГ", "🟢"
-        elif sell_signals > buy_signals:
-            return "ШОРТ", "🔴"
-        else:
-            return "ЛОНГ", "🟢"  # По умолчанию лонг
-    
-    direction, emoji, percent = parse_ai_response(prob_block, indicators)
-    probability_line = f"☑️ Сигнал: {emoji} {direction} ({percent}%)"
+    short_comment = analysis.get("comment", "—").strip()
+    # --- Вероятность и направление (из ответа LLM или локальной модели) ---
+    direction = analysis.get("direction")
+    probability = analysis.get("probability")
+    if direction and probability is not None:
+        emoji = "🔴" if direction == "ШОРТ" else "🟢"
+        probability_line = f"☑️ Сигнал: {emoji} {direction} ({probability}%)"
+    else:
+        probability_line = "☑️ Сигнал: —"
     stop_loss_block = "⛔️ Стоп-лосс: 3%"
     take_profit_block = "🎯 Тейк-профит: 10%"
     leverage_block = "💸 Кредитное плечо: от 5 до 10"
@@ -534,103 +490,42 @@ async def format_analysis_block(symbol: str, tf: str, indicators: dict, short_co
     )
     return result
 
-def format_full_forecast_text(raw: str, probs: dict = None) -> str:
+def format_full_forecast_text(analyses: dict, indicators: dict) -> str:
     """
-    Форматирует текст полного прогноза от LLM для Telegram (HTML):
-    - Выделяет заголовки таймфреймов и общий вывод
-    - Жирный шрифт для ключевых блоков
-    - Добавляет эмодзи BUY/SELL/HOLD
-    - Вставляет разделители между блоками
-    - Вставляет отдельный блок индикаторов для каждого таймфрейма (без эмодзи)
-    - Подставляет значения вероятности и направления, если переданы через probs
+    Форматирует полный прогноз для Telegram (HTML) из структурных ответов LLM:
+    - Заголовки таймфреймов и общий вывод, разделители между блоками
+    - Краткий вывод и вероятность с направлением (эмодзи по направлению)
+    - Отдельный блок индикаторов для каждого таймфрейма (без эмодзи)
+    :param analyses: {tf: {"comment", "direction", "probability"}}
+    :param indicators: {tf: индикаторы}
     """
-    import re
-    def emoji(line):
-        if re.search(r'BUY|ПОКУП', line, re.I):
-            return '🟢'
-        if re.search(r'SELL|ПРОДА', line, re.I):
-            return '🔴'
-        if re.search(r'HOLD|НЕЙТР', line, re.I):
-            return '⚪'
-        return ''
-
-    header_map = {
-        '15 минут:': '🕒 <b>15 минут:</b>',
-        '1 час:': '⏰ <b>1 час:</b>',
-        '4 часа:': '🕓 <b>4 часа:</b>',
-        'Общий вывод:': '💡 <b>Общий вывод:</b>'
+    headers = {
+        '15m': '🕒 <b>15 минут:</b>',
+        '1h': '⏰ <b>1 час:</b>',
+        '4h': '🕓 <b>4 часа:</b>'
     }
-    replacements = [
-        (r'^(15 минут:)', header_map['15 минут:']),
-        (r'^(1 час:)', header_map['1 час:']),
-        (r'^(4 часа:)', header_map['4 часа:']),
-        (r'^(Общий вывод:)', header_map['Общий вывод:']),
-        (r'\* Краткий вывод:', r'• <b>Краткий вывод:</b>'),
-        (r'\* Вероятность и направление:', r'• <b>Вероятность и направление:</b>'),
-        (r'\* Основные индикаторы:', r'• <b>Основные индикаторы:</b>'),
-    ]
-    lines = raw.split('\n')
     out = []
-    indicators_block = []
-    in_indicators = False
-    current_tf = None
-    for i, line in enumerate(lines):
-        orig = line
-        for pat, repl in replacements:
-            line = re.sub(pat, repl, line)
-        if i > 0 and (line.startswith('🕒') or line.startswith('⏰') or line.startswith('🕓')):
+    for tf, header in headers.items():
+        analysis = analyses.get(tf, {})
+        ind = indicators.get(tf, {})
+        if out:
             out.append('<b>──────────────</b>')
-        if line.startswith('💡'):
-            out.append('<b>══════════════</b>')
-        # Определяем текущий таймфрейм для подстановки вероятности
-        if line.startswith('🕒'):
-            current_tf = '15m'
-        elif line.startswith('⏰'):
-            current_tf = '1h'
-        elif line.startswith('🕓'):
-            current_tf = '4h'
-        # Подставляем вероятность и направление, если есть
-        if '<b>Вероятность и направление:</b>' in line and probs and current_tf in probs:
-            prob_line = probs[current_tf]
-            em = emoji(prob_line)
-            line = f"{em} • <b>Вероятность и направление:</b> {prob_line}"
-        elif '<b>Вероятность и направление:</b>' in line:
-            em = emoji(line)
-            if em and em not in line:
-                line = f"{em} {line}"
-        if '<b>Краткий вывод:</b>' in line:
-            em = emoji(line)
-            if em and em not in line:
-                line = f"{em} {line}"
-        # Индикаторы: ищем значения и выводим в формате 'RSI: значение'
-        if '<b>Основные индикаторы:</b>' in line:
-            in_indicators = True
-            indicators_block = [f'<b>Индикаторы:</b>']
-            # Вытаскиваем пары "название: значение"
-            # Пример: 'RSI умеренный, MACD немного повышен, ...'
-            ind_match = re.findall(r'(RSI [^,]+|MACD [^,]+|Stoch RSI [^,]+|EMA\(50\) [^,]+|MA Summary [^,]+|тенденция [^.,]+)', line)
-            for ind in ind_match:
-                # Только жирное выделение названий, без эмодзи
-                ind = ind.replace('RSI', '<b>RSI</b>:').replace('MACD', '<b>MACD</b>:').replace('Stoch RSI', '<b>Stoch RSI</b>:')
-                ind = ind.replace('EMA(50)', '<b>EMA(50)</b>:').replace('MA Summary', '<b>MA Summary</b>:').replace('тенденция', '<b>Тенденция</b>:')
-                indicators_block.append(ind.strip())
-            continue
-        elif in_indicators and (line.strip() == '' or line.startswith('•')):
-            if indicators_block:
-                out.extend(indicators_block)
-                indicators_block = []
-            in_indicators = False
-        out.append(line)
-    if indicators_block:
-        out.extend(indicators_block)
-    formatted = '\n'.join([l for l in out if l.strip() != ''])
-    return formatted
-
-# --- В обработчике полного прогноза ---
-# После получения tf_data_15m, tf_data_1h, tf_data_4h:
-# Получить вероятности для каждого таймфрейма через generate_direction_and_probability
-# probs = { '15m': ..., '1h': ..., '4h': ... }
-# formatted_forecast = format_full_forecast_text(full_forecast, probs=probs)
+        direction = analysis.get('direction')
+        em = '🟢' if direction == 'ЛОНГ' else '🔴' if direction == 'ШОРТ' else '⚪'
+        out.append(header)
+        out.append(f"{em} • <b>Краткий вывод:</b> {analysis.get('comment', '—')}")
+        out.append(f"{em} • <b>Вероятность и направление:</b> {format_direction(analysis)}")
+        out.append('<b>Индикаторы:</b>')
+        out.append(f"<b>RSI</b>: {ind.get('RSI', '-')}")
+        out.append(f"<b>MACD</b>: {ind.get('MACD', '-')}")
+        out.append(f"<b>Stoch RSI</b>: {ind.get('StochRSI', '-')}")
+        out.append(f"<b>EMA(50)</b>: {ind.get('EMA50', '-')}")
+        out.append(f"<b>MA Summary</b>: {ind.get('MA_summary', '-')}")
+        out.append(f"<b>Тенденция</b>: {ind.get('trend', '-')}")
+    out.append('<b>══════════════</b>')
+    out.append('💡 <b>Общий вывод:</b>')
+    out.append(generate_general_summary(analyses))
+    return '\n'.join(out)
 
 @dp.message_handler()
 async def unknown_message(msg: types.Message):
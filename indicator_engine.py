@@ -0,0 +1,305 @@
+import logging
+import threading
+from collections import deque
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# Сколько закрытых свечей ряда помнит движок: значения пересчитываются к окну
+# любой длины до ENGINE_WINDOW + 1 свечей (get_forecast передаёт 300)
+ENGINE_WINDOW = 300
+EMA_PERIODS = (50, 100, 200)
+ATR_LENGTH = 14
+SUPERTREND_LENGTH = 10
+SUPERTREND_MULTIPLIER = 3.0
+PSAR_AF0 = 0.02
+PSAR_MAX_AF = 0.2
+NOT_ENOUGH_DATA = 'Недостаточно данных'
+
+_NAN = float("nan")
+
+
+class _SeriesState:
+    """
+    Состояние индикаторов ряда (symbol, interval) после последней закрытой свечи.
+    EMA и ATR хранятся как непрерывные рекурсии с начала наблюдения; история
+    последних ENGINE_WINDOW значений нужна, чтобы пересчитать их к окну
+    фиксированной длины (как при расчёте по DataFrame из 300 свечей) за O(1).
+    """
+    __slots__ = (
+        "count", "ema", "atr_num", "atr_den", "st_num", "st_den",
+        "prev_close", "prev_high", "prev_low", "prev2_high", "prev2_low",
+        "st_dir", "st_upper", "st_lower",
+        "psar_falling", "psar_sar", "psar_ep", "psar_af",
+        "history", "first_open_time", "live_open_time", "live_step"
+    )
+
+    def __init__(self, window: int):
+        self.count = 0
+        self.ema = {p: _NAN for p in EMA_PERIODS}
+        self.atr_num = self.atr_den = 0.0
+        self.st_num = self.st_den = 0.0
+        self.prev_close = self.prev_high = self.prev_low = _NAN
+        self.prev2_high = self.prev2_low = _NAN
+        self.st_dir = 1
+        self.st_upper = self.st_lower = _NAN
+        self.psar_falling = None
+        self.psar_sar = self.psar_ep = _NAN
+        self.psar_af = PSAR_AF0
+        # (close, EMA50, EMA100, EMA200, ATR num, ATR den) по закрытым свечам
+        self.history = deque(maxlen=window)
+        self.first_open_time: Optional[int] = None
+        self.live_open_time: Optional[int] = None
+        self.live_step: Optional[dict] = None
+
+
+def _step(state: _SeriesState, high: float, low: float, close: float) -> dict:
+    """
+    Один шаг всех рекурсий для свечи с индексом state.count. Состояние не меняется:
+    результат либо фиксируется (_commit), либо используется как «живая» свеча.
+    """
+    first = state.count == 0
+    # EMA (pandas ewm(span, adjust=False))
+    ema = {}
+    for p, prev in state.ema.items():
+        alpha = 2.0 / (p + 1)
+        ema[p] = close if first else (1 - alpha) * prev + alpha * close
+    # True range: у первой свечи нет предыдущего close
+    if first:
+        tr = None
+    else:
+        pc = state.prev_close
+        tr = max(abs(high - low), abs(high - pc), abs(pc - low))
+    # ATR = RMA(TR) как в pandas_ta: ewm(alpha=1/length, adjust=True)
+    atr_num, atr_den = state.atr_num, state.atr_den
+    st_num, st_den = state.st_num, state.st_den
+    if tr is not None:
+        decay = 1 - 1.0 / ATR_LENGTH
+        atr_num, atr_den = decay * atr_num + tr, decay * atr_den + 1
+        decay = 1 - 1.0 / SUPERTREND_LENGTH
+        st_num, st_den = decay * st_num + tr, decay * st_den + 1
+    # SuperTrend (pandas_ta supertrend(length=10, multiplier=3.0))
+    st_atr = st_num / st_den if state.count >= SUPERTREND_LENGTH else _NAN
+    hl2 = (high + low) / 2
+    upper = hl2 + SUPERTREND_MULTIPLIER * st_atr
+    lower = hl2 - SUPERTREND_MULTIPLIER * st_atr
+    st_dir = 1
+    if not first:
+        if close > state.st_upper:
+            st_dir = 1
+        elif close < state.st_lower:
+            st_dir = -1
+        else:
+            st_dir = state.st_dir
+            if st_dir > 0 and lower < state.st_lower:
+                lower = state.st_lower
+            if st_dir < 0 and upper > state.st_upper:
+                upper = state.st_upper
+    # Parabolic SAR (pandas_ta psar(af0=0.02, max_af=0.2))
+    falling, sar, ep, af = state.psar_falling, state.psar_sar, state.psar_ep, state.psar_af
+    if first:
+        sar = close
+    else:
+        if falling is None:
+            # Направление задаётся первыми двумя свечами (-DM > 0 — падение)
+            up = high - state.prev_high
+            dn = state.prev_low - low
+            falling = dn > up and dn > 0
+            ep = state.prev_low if falling else state.prev_high
+            af = PSAR_AF0
+        # Для второй свечи «позапрошлой» нет — берётся предыдущая
+        prev2_high = state.prev_high if state.count == 1 else state.prev2_high
+        prev2_low = state.prev_low if state.count == 1 else state.prev2_low
+        new_sar = sar + af * (ep - sar)
+        if falling:
+            reverse = high > new_sar
+            if low < ep:
+                ep = low
+                af = min(af + PSAR_AF0, PSAR_MAX_AF)
+            new_sar = max(state.prev_high, prev2_high, new_sar)
+        else:
+            reverse = low < new_sar
+            if high > ep:
+                ep = high
+                af = min(af + PSAR_AF0, PSAR_MAX_AF)
+            new_sar = min(state.prev_low, prev2_low, new_sar)
+        if reverse:
+            new_sar = ep
+            af = PSAR_AF0
+            falling = not falling
+            ep = low if falling else high
+        sar = new_sar
+    return {
+        "high": high, "low": low, "close": close, "ema": ema,
+        "atr_num": atr_num, "atr_den": atr_den, "st_num": st_num, "st_den": st_den,
+        "st_dir": st_dir, "st_upper": upper, "st_lower": lower,
+        "psar_falling": falling, "psar_sar": sar, "psar_ep": ep, "psar_af": af
+    }
+
+
+def _commit(state: _SeriesState, step: dict) -> None:
+    state.ema = step["ema"]
+    state.atr_num, state.atr_den = step["atr_num"], step["atr_den"]
+    state.st_num, state.st_den = step["st_num"], step["st_den"]
+    state.st_dir, state.st_upper, state.st_lower = step["st_dir"], step["st_upper"], step["st_lower"]
+    state.psar_falling, state.psar_sar = step["psar_falling"], step["psar_sar"]
+    state.psar_ep, state.psar_af = step["psar_ep"], step["psar_af"]
+    state.prev2_high, state.prev2_low = state.prev_high, state.prev_low
+    state.prev_high, state.prev_low, state.prev_close = step["high"], step["low"], step["close"]
+    ema = step["ema"]
+    state.history.append((step["close"], ema[50], ema[100], ema[200], step["atr_num"], step["atr_den"]))
+    state.count += 1
+
+
+def _snapshot(state: _SeriesState, step: dict, window: int) -> dict:
+    """
+    Значения индикаторов для свечи step (индекс state.count), приведённые к окну
+    из последних window свечей — так же, как их считает get_forecast по DataFrame.
+    """
+    t = state.count
+    length = min(window, t + 1)
+    start = None
+    if t + 1 > window:
+        # Первая свеча окна — из истории последних закрытых свечей
+        start = state.history[len(state.history) - window + 1]
+    result = {}
+    for i, p in enumerate(EMA_PERIODS):
+        key = f"EMA{p}"
+        if length < p:
+            result[key] = NOT_ENOUGH_DATA
+            continue
+        value = step["ema"][p]
+        if start is not None:
+            decay = (1 - 2.0 / (p + 1)) ** (window - 1)
+            value -= decay * (start[1 + i] - start[0])
+        result[key] = round(value, 2)
+    # ATR: первая свеча окна не имеет TR, поэтому валидных значений length - 1
+    atr = None
+    if length - 1 >= ATR_LENGTH:
+        num, den = step["atr_num"], step["atr_den"]
+        if start is not None:
+            decay = (1 - 1.0 / ATR_LENGTH) ** (window - 1)
+            num -= decay * start[4]
+            den -= decay * start[5]
+        atr = num / den if den > 0 else None
+    result["ATR"] = atr
+    result["SuperTrend"] = 'BUY' if step["st_dir"] == 1 else 'SELL'
+    falling = step["psar_falling"]
+    result["PSAR"] = None if falling is None else ('SELL' if falling else 'BUY')
+    return result
+
+
+def _frame_arrays(df: pd.DataFrame) -> Tuple[np.ndarray, list, list, list]:
+    open_times = df.index.values.astype("datetime64[ms]").astype(np.int64)
+    return (
+        open_times,
+        df["high"].to_numpy(dtype=float).tolist(),
+        df["low"].to_numpy(dtype=float).tolist(),
+        df["close"].to_numpy(dtype=float).tolist()
+    )
+
+
+class IndicatorEngine:
+    """
+    Потоковый расчёт EMA50/100/200, ATR(14), SuperTrend(10, 3) и PSAR по
+    каждому ряду (symbol, interval). Состояние обновляется за O(1) на новую
+    или изменившуюся свечу; запрос анализа только читает готовые значения.
+
+    update_frame считает индикаторы по переданному кадру: EMA и ATR
+    пересчитываются к окну из len(df) последних свечей и совпадают с
+    pandas/pandas_ta по этому кадру. Кадр длиннее истории движка
+    (window + 1 свечей) считается отдельным проходом, без потокового состояния.
+    SuperTrend и PSAR — рекурсии без окна: от расчёта по кадру они могут
+    отличаться только до первого общего разворота после начала наблюдения.
+    """
+
+    def __init__(self, window: int = ENGINE_WINDOW):
+        self.window = window
+        self._series: Dict[Tuple[str, str], _SeriesState] = {}
+        self._lock = threading.RLock()
+
+    def _seed(self, open_times, highs, lows, closes, window: Optional[int] = None) -> _SeriesState:
+        state = _SeriesState(window or self.window)
+        state.first_open_time = int(open_times[0])
+        last = len(closes) - 1
+        for i in range(last):
+            _commit(state, _step(state, highs[i], lows[i], closes[i]))
+        self._set_live(state, open_times[last], highs[last], lows[last], closes[last])
+        return state
+
+    @staticmethod
+    def _set_live(state: _SeriesState, open_time: int, high: float, low: float, close: float) -> None:
+        state.live_open_time = int(open_time)
+        state.live_step = _step(state, float(high), float(low), float(close))
+
+    def update_frame(self, symbol: str, interval: str, df: pd.DataFrame) -> Optional[dict]:
+        """
+        Обновляет состояние ряда свечами из DataFrame (обрабатываются только
+        новые строки) и возвращает значения индикаторов для последней свечи,
+        посчитанные по окну из len(df) свечей.
+        """
+        if df is None or df.empty:
+            return None
+        open_times, highs, lows, closes = _frame_arrays(df)
+        window = len(closes)
+        if window > self.window + 1:
+            # Истории движка не хватает для пересчёта к такому окну — считаем по кадру целиком
+            return self._public(self._seed(open_times, highs, lows, closes, window), window)
+        key = (symbol, interval)
+        with self._lock:
+            state = self._series.get(key)
+            if state is None or open_times[0] > state.live_open_time or open_times[0] < state.first_open_time:
+                # Первый запрос, разрыв или кадр с более ранней историей — строим состояние по кадру
+                state = self._seed(open_times, highs, lows, closes)
+                self._series[key] = state
+                logging.debug(f"[ENGINE] {symbol} {interval}: состояние построено по {window} свечам")
+                return self._public(state, window)
+            if open_times[-1] < state.live_open_time:
+                # Кадр старее состояния — считаем по нему отдельно, не трогая ряд
+                return self._public(self._seed(open_times, highs, lows, closes, window), window)
+            pos = int(np.searchsorted(open_times, state.live_open_time))
+            if pos >= len(open_times) or open_times[pos] != state.live_open_time:
+                state = self._seed(open_times, highs, lows, closes)
+                self._series[key] = state
+                return self._public(state, window)
+            # Свеча, бывшая «живой», закрылась — фиксируем её итоговые значения
+            for i in range(pos, len(open_times) - 1):
+                _commit(state, _step(state, highs[i], lows[i], closes[i]))
+            last = len(open_times) - 1
+            self._set_live(state, open_times[last], highs[last], lows[last], closes[last])
+            return self._public(state, window)
+
+    def update_candle(self, symbol: str, interval: str, open_time: int, high: float, low: float, close: float) -> Optional[dict]:
+        """
+        Обновляет ряд одной свечой (новой или текущей). Предыдущая «живая»
+        свеча фиксируется, если пришла свеча с большим open_time.
+        """
+        with self._lock:
+            state = self._series.get((symbol, interval))
+            if state is None:
+                return None
+            if open_time < state.live_open_time:
+                return self._public(state, self.window)
+            if open_time > state.live_open_time:
+                _commit(state, state.live_step)
+            self._set_live(state, open_time, high, low, close)
+            return self._public(state, self.window)
+
+    def snapshot(self, symbol: str, interval: str, window: Optional[int] = None) -> Optional[dict]:
+        with self._lock:
+            state = self._series.get((symbol, interval))
+            return self._public(state, window or self.window) if state is not None else None
+
+    def reset(self, symbol: Optional[str] = None, interval: Optional[str] = None) -> None:
+        with self._lock:
+            for key in list(self._series):
+                if (symbol is None or key[0] == symbol) and (interval is None or key[1] == interval):
+                    del self._series[key]
+
+    @staticmethod
+    def _public(state: _SeriesState, window: int) -> dict:
+        return _snapshot(state, state.live_step, window)
+
+
+indicator_engine = IndicatorEngine()
@@ -0,0 +1,388 @@
+import argparse
+import asyncio
+import logging
+import os
+import shutil
+import threading
+import time
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from binance_client import binance_client, REST_PAGE_LIMIT
+from candle_store import COLUMNS, klines_to_arrays
+from utils import interval_to_seconds
+
+# Архив закрытых свечей на диске: по каталогу на ряд (symbol, interval), в нём
+# по бинарному файлу на колонку (open_time int64 и OHLCV float64, little-endian).
+# Запись — только дописыванием в конец; чтение — через np.memmap, диапазон по
+# времени находится бинарным поиском по open_time, в память попадают только
+# нужные страницы. Глубокая история догружается с Binance страницами по 1000.
+KLINE_ARCHIVE_ENABLED = os.getenv("KLINE_ARCHIVE_ENABLED", "1") == "1"
+KLINE_ARCHIVE_DIR = os.getenv("KLINE_ARCHIVE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "klines"))
+
+TIME_DTYPE = np.dtype("<i8")
+VALUE_DTYPE = np.dtype("<f8")
+# open_time пишется последним: его длина — число целиком записанных свечей
+FILES = tuple((c, VALUE_DTYPE) for c in COLUMNS) + (("open_time", TIME_DTYPE),)
+
+TimeLike = Union[int, str, pd.Timestamp, None]
+
+
+def to_ms(value: TimeLike) -> Optional[int]:
+    """
+    Момент времени в unix-миллисекундах: int (уже мс), строка или Timestamp (UTC).
+    """
+    if value is None or isinstance(value, (int, np.integer)):
+        return value
+    ts = pd.Timestamp(value)
+    if ts.tzinfo is None:
+        ts = ts.tz_localize("UTC")
+    return int(ts.timestamp() * 1000)
+
+
+def closed_only(open_times: np.ndarray, values: np.ndarray, interval_ms: int, now_ms: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Отбрасывает ещё не закрытые свечи (в архив пишутся только окончательные).
+    """
+    now_ms = int(time.time() * 1000) if now_ms is None else now_ms
+    n = int(np.searchsorted(open_times, now_ms - interval_ms, side="right"))
+    return open_times[:n], values[:, :n]
+
+
+class KlineArchive:
+    """
+    Свечи одного ряда на диске. Срезы view() — memmap только для чтения: они
+    остаются валидными после дописывания и после перестройки ряда (старый файл
+    живёт, пока открыт). frame() копирует в DataFrame только запрошенный диапазон.
+    """
+
+    def __init__(self, symbol: str, interval: str, root: str = KLINE_ARCHIVE_DIR):
+        self.symbol = symbol.upper()
+        self.interval = interval
+        self.interval_ms = interval_to_seconds(interval) * 1000
+        self.path = os.path.join(root, f"{self.symbol}_{interval}")
+        self._lock = threading.Lock()
+        self._maps: Optional[Tuple[int, Dict[str, np.ndarray]]] = None
+        self._length = self._recover()
+
+    def _file(self, name: str, path: Optional[str] = None) -> str:
+        return os.path.join(path or self.path, f"{name}.bin")
+
+    def _recover(self) -> int:
+        """
+        Приводит колонки к общей длине после прерванной записи; возвращает число свечей.
+        """
+        # Перестройка прервалась после переименования старого каталога
+        if not os.path.isdir(self.path) and os.path.isdir(self.path + ".old"):
+            os.rename(self.path + ".old", self.path)
+        shutil.rmtree(self.path + ".new", ignore_errors=True)
+        os.makedirs(self.path, exist_ok=True)
+        sizes = {}
+        for name, dtype in FILES:
+            path = self._file(name)
+            sizes[name] = os.path.getsize(path) if os.path.exists(path) else 0
+        length = min(sizes[name] // dtype.itemsize for name, dtype in FILES)
+        for name, dtype in FILES:
+            # Лишние свечи или недописанное число в конце колонки
+            if sizes[name] != length * dtype.itemsize:
+                logging.warning(f"[ARCHIVE] {self.symbol} {self.interval}: {name} обрезан до {length} свечей")
+                with open(self._file(name), "ab") as f:
+                    f.truncate(length * dtype.itemsize)
+        return length
+
+    def __len__(self) -> int:
+        return self._length
+
+    def _columns(self) -> Dict[str, np.ndarray]:
+        with self._lock:
+            if self._maps is None or self._maps[0] != self._length:
+                length = self._length
+                maps = {}
+                for name, dtype in FILES:
+                    if length == 0:
+                        maps[name] = np.empty(0, dtype=dtype)
+                    else:
+                        maps[name] = np.memmap(self._file(name), dtype=dtype, mode="r", shape=(length,))
+                self._maps = (length, maps)
+            return self._maps[1]
+
+    @property
+    def first_open_time(self) -> Optional[int]:
+        return int(self._columns()["open_time"][0]) if self._length else None
+
+    @property
+    def last_open_time(self) -> Optional[int]:
+        return int(self._columns()["open_time"][-1]) if self._length else None
+
+    def append(self, open_times: np.ndarray, values: np.ndarray) -> int:
+        """
+        Дописывает свечи новее последней в архиве (более старые и повторы пропускаются).
+        :param values: Матрица 5 × n (open, high, low, close, volume), как klines_to_arrays
+        :return: Сколько свечей добавлено
+        """
+        with self._lock:
+            last = self._last_open_time()
+            if last is not None:
+                start = int(np.searchsorted(open_times, last, side="right"))
+                open_times, values = open_times[start:], values[:, start:]
+            n = len(open_times)
+            if n == 0:
+                return 0
+            for i, (name, dtype) in enumerate(FILES):
+                column = open_times if name == "open_time" else values[i]
+                with open(self._file(name), "ab") as f:
+                    f.write(np.ascontiguousarray(column, dtype=dtype).tobytes())
+            self._length += n
+            return n
+
+    def _last_open_time(self) -> Optional[int]:
+        # Без memmap: append держит _lock, а _columns() берёт его сам
+        if self._length == 0:
+            return None
+        with open(self._file("open_time"), "rb") as f:
+            f.seek((self._length - 1) * TIME_DTYPE.itemsize)
+            return int(np.frombuffer(f.read(TIME_DTYPE.itemsize), dtype=TIME_DTYPE)[0])
+
+    def prepend(self, open_times: np.ndarray, values: np.ndarray) -> int:
+        """
+        Добавляет историю старше первой свечи. Ряд перестраивается в соседнем
+        каталоге и подменяется переименованием — редкая операция глубокой дозагрузки.
+        :return: Сколько свечей добавлено
+        """
+        with self._lock:
+            if self._length:
+                first = int(np.memmap(self._file("open_time"), dtype=TIME_DTYPE, mode="r", shape=(1,))[0])
+                end = int(np.searchsorted(open_times, first, side="left"))
+                open_times, values = open_times[:end], values[:, :end]
+            n = len(open_times)
+            if n == 0:
+                return 0
+            staging = self.path + ".new"
+            os.makedirs(staging, exist_ok=True)
+            for i, (name, dtype) in enumerate(FILES):
+                column = open_times if name == "open_time" else values[i]
+                with open(self._file(name, staging), "wb") as out:
+                    out.write(np.ascontiguousarray(column, dtype=dtype).tobytes())
+                    if self._length:
+                        with open(self._file(name), "rb") as src:
+                            shutil.copyfileobj(src, out, 1 << 20)
+            os.rename(self.path, self.path + ".old")
+            os.rename(staging, self.path)
+            shutil.rmtree(self.path + ".old", ignore_errors=True)
+            self._length += n
+            self._maps = None
+            return n
+
+    def _bounds(self, start: TimeLike, end: TimeLike, limit: Optional[int]) -> Tuple[int, int]:
+        times = self._columns()["open_time"]
+        lo = 0 if start is None else int(np.searchsorted(times, to_ms(start), side="left"))
+        hi = len(times) if end is None else int(np.searchsorted(times, to_ms(end), side="left"))
+        if limit is not None:
+            lo = max(lo, hi - limit)
+        return lo, hi
+
+    def view(self, start: TimeLike = None, end: TimeLike = None, limit: Optional[int] = None) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+        """
+        Свечи с open_time в [start, end) как срезы memmap без копирования: (open_time, {колонка: массив}).
+        :param limit: Не больше limit последних свечей диапазона
+        """
+        lo, hi = self._bounds(start, end, limit)
+        columns = self._columns()
+        return columns["open_time"][lo:hi], {c: columns[c][lo:hi] for c in COLUMNS}
+
+    def frame(self, start: TimeLike = None, end: TimeLike = None, limit: Optional[int] = None) -> pd.DataFrame:
+        """
+        Свечи диапазона как DataFrame в формате get_ohlcv (индекс datetime).
+        """
+        times, columns = self.view(start, end, limit)
+        index = pd.DatetimeIndex(np.asarray(times).astype("datetime64[ms]"), name="timestamp")
+        return pd.DataFrame({c: np.array(columns[c]) for c in COLUMNS}, index=index)
+
+    def disk_bytes(self) -> int:
+        return sum(os.path.getsize(self._file(name)) for name, _ in FILES)
+
+
+_archives: Dict[Tuple[str, str], KlineArchive] = {}
+_archives_lock = threading.Lock()
+# Ряд -> задача дозагрузки (одна на ряд одновременно)
+_updates: Dict[Tuple[str, str], asyncio.Task] = {}
+
+
+def get_archive(symbol: str, interval: str) -> KlineArchive:
+    key = (symbol.upper(), interval)
+    with _archives_lock:
+        archive = _archives.get(key)
+        if archive is None:
+            archive = _archives[key] = KlineArchive(*key)
+        return archive
+
+
+async def _fetch_forward(symbol: str, interval: str, start_ms: int, end_ms: Optional[int] = None):
+    """
+    Свечи с open_time >= start_ms (и < end_ms) страницами по 1000, от старых к новым.
+    """
+    interval_ms = interval_to_seconds(interval) * 1000
+    cursor = start_ms
+    while end_ms is None or cursor < end_ms:
+        page = await binance_client.get_klines(
+            symbol, interval, limit=REST_PAGE_LIMIT, start_time=cursor,
+            end_time=None if end_ms is None else end_ms - 1
+        )
+        if not page:
+            return
+        open_times, values = klines_to_arrays(page)
+        yield open_times, values
+        cursor = int(open_times[-1]) + interval_ms
+        if len(page) < REST_PAGE_LIMIT:
+            return
+
+
+async def _write(method, open_times: np.ndarray, values: np.ndarray) -> int:
+    """
+    append/prepend архива в пуле потоков: запись и перестройка ряда (копирование
+    файлов при prepend) не должны блокировать цикл событий бота.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, method, open_times, values)
+
+
+async def update_archive(symbol: str, interval: str) -> int:
+    """
+    Дописывает свечи, закрывшиеся после последней в архиве. Пустой архив
+    начинается с последних REST_PAGE_LIMIT свечей.
+    :return: Сколько свечей добавлено
+    """
+    archive = get_archive(symbol, interval)
+    last = archive.last_open_time
+    added = 0
+    if last is None:
+        page = await binance_client.get_klines(symbol, interval, limit=REST_PAGE_LIMIT)
+        added = await _write(archive.append, *closed_only(*klines_to_arrays(page), archive.interval_ms))
+    else:
+        async for open_times, values in _fetch_forward(symbol, interval, last + archive.interval_ms):
+            added += await _write(archive.append, *closed_only(open_times, values, archive.interval_ms))
+    if added:
+        logging.info(f"[ARCHIVE] {archive.symbol} {interval}: +{added} свечей, всего {len(archive)}")
+    return added
+
+
+async def backfill_archive(symbol: str, interval: str, start: TimeLike) -> int:
+    """
+    Догружает историю с момента start: всё, чего нет до первой свечи архива
+    (страницами, от старых к новым), затем свечи после последней.
+    :return: Сколько свечей добавлено
+    """
+    archive = get_archive(symbol, interval)
+    start_ms = to_ms(start)
+    added = 0
+    first = archive.first_open_time
+    if first is None:
+        async for open_times, values in _fetch_forward(symbol, interval, start_ms):
+            added += await _write(archive.append, *closed_only(open_times, values, archive.interval_ms))
+    elif start_ms <= first - archive.interval_ms:
+        pages = [page async for page in _fetch_forward(symbol, interval, start_ms, first)]
+        if pages:
+            added += await _write(archive.prepend, np.concatenate([p[0] for p in pages]), np.hstack([p[1] for p in pages]))
+        logging.info(f"[ARCHIVE] {archive.symbol} {interval}: история с {pd.Timestamp(start_ms, unit='ms')} — +{added} свечей")
+    return added + await update_archive(symbol, interval)
+
+
+def archive_frame(symbol: str, interval: str, df: pd.DataFrame) -> None:
+    """
+    Дописывает в архив закрытые свечи из уже загруженного окна (без запросов к API).
+    Если окно не стыкуется с архивом, недостающее догружается в фоне.
+    """
+    if not KLINE_ARCHIVE_ENABLED or df is None or df.empty:
+        return
+    archive = get_archive(symbol, interval)
+    open_times = df.index.values.astype("datetime64[ms]").astype(np.int64)
+    values = np.vstack([df[c].to_numpy(dtype=float) for c in COLUMNS])
+    last = archive.last_open_time
+    if last is not None and open_times[0] > last + archive.interval_ms:
+        _schedule_update(archive.symbol, interval)
+        return
+    try:
+        archive.append(*closed_only(open_times, values, archive.interval_ms))
+    except OSError as e:
+        logging.warning(f"[ARCHIVE] Не удалось записать {archive.symbol} {interval}: {e}")
+
+
+def _schedule_update(symbol: str, interval: str) -> None:
+    key = (symbol, interval)
+    task = _updates.get(key)
+    if task is None or task.done():
+        _updates[key] = asyncio.create_task(_safe_update(symbol, interval))
+
+
+async def _safe_update(symbol: str, interval: str) -> None:
+    try:
+        await update_archive(symbol, interval)
+    except Exception as e:
+        logging.warning(f"[ARCHIVE] Не удалось дозагрузить {symbol} {interval}: {e}")
+
+
+async def read_recent(symbol: str, interval: str, limit: int) -> pd.DataFrame:
+    """
+    Последние limit свечей (включая текущую) для окон длиннее одного запроса
+    к Binance: закрытые — из архива после дозагрузки хвоста, текущая — с REST.
+    """
+    archive = get_archive(symbol, interval)
+    if len(archive) < limit - 1:
+        start = int(time.time() * 1000) - limit * archive.interval_ms
+        await backfill_archive(symbol, interval, start)
+    else:
+        await update_archive(symbol, interval)
+    current = await binance_client.get_klines(symbol, interval, limit=1)
+    df = archive.frame(limit=limit - len(current))
+    if current:
+        open_times, values = klines_to_arrays(current)
+        if not len(df) or open_times[0] > df.index[-1].value // 1_000_000:
+            tail = pd.DataFrame(
+                {c: values[i] for i, c in enumerate(COLUMNS)},
+                index=pd.DatetimeIndex(open_times.astype("datetime64[ms]"), name="timestamp")
+            )
+            df = pd.concat([df, tail])
+    return df.iloc[-limit:]
+
+
+def get_archive_stats() -> dict:
+    with _archives_lock:
+        archives = list(_archives.values())
+    return {
+        "series": len(archives),
+        "candles": sum(len(a) for a in archives),
+        "bytes": sum(a.disk_bytes() for a in archives)
+    }
+
+
+async def _backfill_all(symbols: List[str], intervals: List[str], start_ms: int) -> None:
+    try:
+        await asyncio.gather(*(backfill_archive(s, tf, start_ms) for s in symbols for tf in intervals))
+    finally:
+        from binance_client import close_binance_client
+        await close_binance_client()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    from utils import symbols as default_symbols
+    parser = argparse.ArgumentParser(description="Дозагрузка архива свечей Binance")
+    parser.add_argument("--intervals", nargs="*", default=["15m", "1h", "4h"])
+    parser.add_argument("--days", type=int, default=365, help="глубина истории в днях")
+    parser.add_argument("--symbols", nargs="*", default=default_symbols)
+    args = parser.parse_args(argv)
+    start_ms = int(time.time() * 1000) - args.days * 86_400_000
+    started = time.perf_counter()
+    asyncio.run(_backfill_all(args.symbols, args.intervals, start_ms))
+    for s in args.symbols:
+        for tf in args.intervals:
+            a = get_archive(s, tf)
+            since = pd.Timestamp(a.first_open_time, unit="ms") if len(a) else "—"
+            print(f"{a.symbol:<10}{tf:>4}{len(a):>9} свечей с {since}  {a.disk_bytes() / 1e6:.1f} МБ")
+    print(f"Готово за {time.perf_counter() - started:.1f} с, архив: {KLINE_ARCHIVE_DIR}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s | %(levelname)s | %(message)s')
+    main()
@@ -0,0 +1,187 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+import aiohttp
+import pandas as pd
+
+from binance_client import binance_client, REST_PAGE_LIMIT
+from candle_store import CandleStore, klines_to_arrays
+from indicator_engine import indicator_engine
+from utils import symbols as default_symbols
+
+# Потоковые свечи Binance (kline WebSocket) в памяти: get_ohlcv сначала смотрит сюда.
+KLINE_STREAM_ENABLED = os.getenv("KLINE_STREAM_ENABLED", "1") == "1"
+BINANCE_WS_URL = os.getenv("BINANCE_WS_URL", "wss://stream.binance.com:9443")
+# Сколько последних свечей хранить по каждому ряду (REST отдаёт максимум 1000 за запрос)
+KLINE_BUFFER_SIZE = int(os.getenv("KLINE_BUFFER_SIZE", "1000"))
+STREAM_INTERVALS = ["15m", "1h", "4h"]
+# Пауза перед переподключением: 1, 2, 4 ... RECONNECT_MAX_DELAY секунд
+RECONNECT_MAX_DELAY = 60
+
+
+def _parse_ws_kline(k: dict) -> Tuple[int, float, float, float, float, float]:
+    return (int(k["t"]), float(k["o"]), float(k["h"]), float(k["l"]), float(k["c"]), float(k["v"]))
+
+
+class KlineStream:
+    """
+    Подписка на kline-потоки Binance (combined stream) для набора монет и
+    таймфреймов. При подключении и при пропусках свечей буферы дозагружаются
+    через REST; обрыв соединения — переподключение с экспоненциальной паузой.
+    """
+
+    def __init__(
+        self,
+        symbols: Optional[List[str]] = None,
+        intervals: Optional[List[str]] = None,
+        url: str = BINANCE_WS_URL,
+        buffer_size: int = KLINE_BUFFER_SIZE
+    ):
+        self.symbols = [s.upper() for s in (symbols or default_symbols)]
+        self.intervals = intervals or STREAM_INTERVALS
+        self.url = url.rstrip("/")
+        self.buffer_size = buffer_size
+        self.buffers: Dict[Tuple[str, str], CandleStore] = {
+            (s, tf): CandleStore(tf, buffer_size) for s in self.symbols for tf in self.intervals
+        }
+        self.connected = False
+        self._task: Optional[asyncio.Task] = None
+        self._backfills: Dict[Tuple[str, str], asyncio.Task] = {}
+
+    def stream_url(self) -> str:
+        streams = "/".join(f"{s.lower()}@kline_{tf}" for s in self.symbols for tf in self.intervals)
+        return f"{self.url}/stream?streams={streams}"
+
+    async def backfill(self, symbol: str, interval: str) -> None:
+        """
+        Дозагружает свечи ряда через REST: с последней известной свечи или последние buffer_size.
+        """
+        buffer = self.buffers[(symbol, interval)]
+        last_open = buffer.last_open_time
+        if last_open is None:
+            data = await binance_client.get_klines(symbol, interval, limit=min(self.buffer_size, REST_PAGE_LIMIT))
+        else:
+            data = await binance_client.get_klines(symbol, interval, limit=REST_PAGE_LIMIT, start_time=last_open)
+        buffer.extend(*klines_to_arrays(data))
+        logging.debug(f"[STREAM] Дозагрузка {symbol} {interval}: {len(data)} свечей, в буфере {len(buffer)}")
+
+    def _schedule_backfill(self, symbol: str, interval: str) -> None:
+        key = (symbol, interval)
+        task = self._backfills.get(key)
+        if task is None or task.done():
+            self._backfills[key] = asyncio.create_task(self._safe_backfill(symbol, interval))
+
+    async def _safe_backfill(self, symbol: str, interval: str) -> None:
+        try:
+            await self.backfill(symbol, interval)
+        except Exception as e:
+            logging.warning(f"[STREAM] Не удалось дозагрузить {symbol} {interval}: {e}")
+
+    def handle_message(self, message: dict) -> None:
+        data = message.get("data", message)
+        if data.get("e") != "kline":
+            return
+        k = data["k"]
+        key = (k["s"].upper(), k["i"])
+        buffer = self.buffers.get(key)
+        if buffer is None:
+            return
+        candle = _parse_ws_kline(k)
+        if not buffer.upsert(*candle):
+            logging.info(f"[STREAM] Пропуск свечей {key[0]} {key[1]} — дозагрузка через REST")
+            self._schedule_backfill(*key)
+            return
+        indicator_engine.update_candle(key[0], key[1], candle[0], candle[2], candle[3], candle[4])
+
+    async def _listen(self) -> None:
+        session = aiohttp.ClientSession()
+        try:
+            async with session.ws_connect(self.stream_url(), heartbeat=30) as ws:
+                logging.info(f"[STREAM] Подключено: {len(self.buffers)} потоков")
+                # Всё, что пропустили до подключения, догружаем через REST
+                await asyncio.gather(*(self._safe_backfill(s, tf) for s, tf in self.buffers))
+                logging.info("[STREAM] Буферы дозагружены через REST")
+                self.connected = True
+                async for msg in ws:
+                    if msg.type == aiohttp.WSMsgType.TEXT:
+                        self.handle_message(msg.json())
+                    elif msg.type in (aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
+                        break
+        finally:
+            self.connected = False
+            await session.close()
+
+    async def run(self) -> None:
+        delay = 1
+        while True:
+            started = time.monotonic()
+            try:
+                await self._listen()
+                logging.warning("[STREAM] Соединение закрыто сервером")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.warning(f"[STREAM] Ошибка соединения: {e}")
+            # Соединение продержалось долго — начинаем паузы заново
+            if time.monotonic() - started > RECONNECT_MAX_DELAY:
+                delay = 1
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
+    def get_frame(self, symbol: str, interval: str, limit: int) -> Optional[pd.DataFrame]:
+        """
+        Свечи из буфера, если поток подключён и последняя свеча — текущая.
+        Иначе None: вызывающий код идёт в REST.
+        """
+        if not self.connected:
+            return None
+        buffer = self.buffers.get((symbol.upper(), interval))
+        if buffer is None:
+            return None
+        last_open = buffer.last_open_time
+        current_open = int(time.time() // (buffer.interval_ms / 1000)) * buffer.interval_ms
+        if last_open is None or last_open < current_open or len(buffer) < limit:
+            return None
+        return buffer.frame(limit)
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        for task in list(self._backfills.values()) + ([self._task] if self._task else []):
+            task.cancel()
+        for task in list(self._backfills.values()) + ([self._task] if self._task else []):
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
+        self._task = None
+        self._backfills.clear()
+        self.connected = False
+
+
+kline_stream = KlineStream()
+
+
+def get_stream_frame(symbol: str, interval: str, limit: int) -> Optional[pd.DataFrame]:
+    """
+    Свечи из потокового буфера или None, если поток выключен/не готов.
+    """
+    if not KLINE_STREAM_ENABLED:
+        return None
+    return kline_stream.get_frame(symbol, interval, limit)
+
+
+async def start_kline_stream() -> None:
+    if not KLINE_STREAM_ENABLED:
+        logging.info("[STREAM] Отключён (KLINE_STREAM_ENABLED=0)")
+        return
+    kline_stream.start()
+
+
+async def stop_kline_stream() -> None:
+    await kline_stream.stop()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Локальная замена Binance для проверки kline_stream без сети.
+
+Отдаёт combined stream /stream?streams=btcusdt@kline_15m/... в формате Binance
+и REST /api/v3/klines для дозагрузки. Цены — случайное блуждание, время реальное.
+
+Запуск:
+    python kline_stream_stub.py --port 8765
+    BINANCE_WS_URL=ws://127.0.0.1:8765 BINANCE_API_URL=http://127.0.0.1:8765 python main.py
+"""
+
+import argparse
+import asyncio
+import logging
+import random
+import time
+from typing import Dict, List, Tuple
+
+from aiohttp import web
+
+from utils import interval_to_seconds
+
+HISTORY_SIZE = 1000
+
+
+class _Series:
+    def __init__(self, symbol: str, interval: str, price: float):
+        self.symbol = symbol
+        self.interval = interval
+        self.interval_ms = interval_to_seconds(interval) * 1000
+        self.candles: List[List[float]] = []
+        now_open = int(time.time() * 1000) // self.interval_ms * self.interval_ms
+        for i in range(HISTORY_SIZE, 0, -1):
+            price = self._append(now_open - i * self.interval_ms, price)
+        self._append(now_open, price)
+
+    def _append(self, open_time: int, price: float) -> float:
+        close = price * (1 + random.uniform(-0.004, 0.004))
+        self.candles.append([
+            open_time, price, max(price, close) * 1.001, min(price, close) * 0.999, close,
+            random.uniform(10, 1000)
+        ])
+        return close
+
+    def tick(self) -> Tuple[List[float], bool]:
+        """
+        Двигает цену текущей свечи; на границе интервала закрывает её и открывает новую.
+        :return: (свеча, закрыта ли она)
+        """
+        now_open = int(time.time() * 1000) // self.interval_ms * self.interval_ms
+        last = self.candles[-1]
+        if now_open > last[0]:
+            self._append(now_open, last[4])
+            self.candles = self.candles[-HISTORY_SIZE - 1:]
+            return last, True
+        close = last[4] * (1 + random.uniform(-0.001, 0.001))
+        last[2] = max(last[2], close)
+        last[3] = min(last[3], close)
+        last[4] = close
+        last[5] += random.uniform(0, 5)
+        return last, False
+
+    def kline_event(self, candle: List[float], closed: bool) -> dict:
+        return {
+            "stream": f"{self.symbol.lower()}@kline_{self.interval}",
+            "data": {
+                "e": "kline",
+                "E": int(time.time() * 1000),
+                "s": self.symbol,
+                "k": {
+                    "t": candle[0],
+                    "T": candle[0] + self.interval_ms - 1,
+                    "s": self.symbol,
+                    "i": self.interval,
+                    "o": f"{candle[1]:.8f}",
+                    "h": f"{candle[2]:.8f}",
+                    "l": f"{candle[3]:.8f}",
+                    "c": f"{candle[4]:.8f}",
+                    "v": f"{candle[5]:.8f}",
+                    "x": closed
+                }
+            }
+        }
+
+    def rest_rows(self, limit: int, start_time=None, end_time=None) -> list:
+        rows = self.candles
+        if start_time is not None:
+            rows = [c for c in rows if c[0] >= start_time]
+        if end_time is not None:
+            rows = [c for c in rows if c[0] <= end_time]
+        rows = rows[:limit] if start_time is not None else rows[-limit:]
+        return [
+            [c[0], f"{c[1]:.8f}", f"{c[2]:.8f}", f"{c[3]:.8f}", f"{c[4]:.8f}", f"{c[5]:.8f}",
+             c[0] + self.interval_ms - 1, "0", 0, "0", "0", "0"]
+            for c in rows
+        ]
+
+
+def create_app(tick: float = 1.0, drop_after: float = 0) -> web.Application:
+    """
+    :param tick: Период обновления свечей в потоке, сек
+    :param drop_after: Разрывать WebSocket через столько секунд (0 — не разрывать), для проверки переподключения
+    """
+    series: Dict[Tuple[str, str], _Series] = {}
+
+    def get_series(symbol: str, interval: str) -> _Series:
+        key = (symbol.upper(), interval)
+        if key not in series:
+            series[key] = _Series(key[0], interval, random.uniform(1, 100000))
+        return series[key]
+
+    async def klines(request: web.Request) -> web.Response:
+        q = request.query
+        s = get_series(q["symbol"], q["interval"])
+        start = int(q["startTime"]) if "startTime" in q else None
+        end = int(q["endTime"]) if "endTime" in q else None
+        return web.json_response(s.rest_rows(int(q.get("limit", 500)), start, end))
+
+    async def stream(request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        names = [n for n in request.query.get("streams", "").split("/") if "@kline_" in n]
+        subscribed = [get_series(n.split("@")[0], n.split("@kline_")[1]) for n in names]
+        logging.info(f"[STUB] Подписка на {len(subscribed)} потоков")
+        started = time.monotonic()
+        try:
+            while not ws.closed:
+                for s in subscribed:
+                    candle, closed = s.tick()
+                    await ws.send_json(s.kline_event(candle, closed))
+                    if closed:
+                        await ws.send_json(s.kline_event(s.candles[-1], False))
+                if drop_after and time.monotonic() - started > drop_after:
+                    await ws.close()
+                    break
+                await asyncio.sleep(tick)
+        except ConnectionResetError:
+            pass
+        return ws
+
+    app = web.Application()
+    app.router.add_get("/api/v3/klines", klines)
+    app.router.add_get("/stream", stream)
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Локальная замена Binance kline WebSocket/REST")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--tick", type=float, default=1.0)
+    parser.add_argument("--drop-after", type=float, default=0)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s | %(levelname)s | %(message)s')
+    web.run_app(create_app(args.tick, args.drop_after), host=args.host, port=args.port)
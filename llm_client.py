@@ -0,0 +1,249 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+from typing import AsyncIterator, List, Optional
+
+from dotenv import load_dotenv
+from openai import AsyncOpenAI
+
+load_dotenv()
+
+# Together AI через асинхронный клиент OpenAI. Один клиент на процесс —
+# одно пуловое HTTP-соединение с keep-alive для всех запросов.
+TOGETHER_BASE_URL = os.getenv("TOGETHER_BASE_URL", "https://api.together.xyz/v1")
+LLM_MODEL = os.getenv("LLM_MODEL", "mistralai/Mixtral-8x7B-Instruct-v0.1")
+# Лимиты: запросов в секунду (с запасом LLM_BURST подряд) и токенов в минуту; 0 — без лимита
+LLM_RPS = float(os.getenv("LLM_RPS", "1"))
+LLM_BURST = int(os.getenv("LLM_BURST", "3"))
+LLM_TPM = int(os.getenv("LLM_TPM", "60000"))
+# Сколько запросов к LLM выполняется одновременно
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+# Таймаут одного вызова (ожидание в очереди + запрос), сек
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "30"))
+# Потоковые ответы (stream=True): текст показывается пользователю по мере генерации
+LLM_STREAMING = os.getenv("LLM_STREAMING", "1") == "1"
+
+# Очереди: интерактивные запросы пользователей идут раньше фоновых
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+
+client = AsyncOpenAI(
+    api_key=os.getenv("TOGETHER_API_KEY"),
+    base_url=TOGETHER_BASE_URL,
+    timeout=LLM_TIMEOUT,
+    max_retries=1
+)
+
+
+class TokenBucketLimiter:
+    """
+    Два ведра токенов — запросы/сек и токены/мин — плюс предел одновременных
+    запросов. Ожидающие обслуживаются по приоритету, внутри приоритета — по очереди.
+    Токены списываются по оценке до запроса и уточняются по usage после.
+    """
+
+    def __init__(self, rps: float, burst: int, tpm: int, max_concurrency: int):
+        self.rps = rps
+        self.burst = max(1, burst)
+        self.tpm = tpm
+        self.max_concurrency = max(1, max_concurrency)
+        self._requests = float(self.burst)
+        self._tokens = float(tpm)
+        self._updated = time.monotonic()
+        self._in_flight = 0
+        self._waiters: list = []
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._pump_task: Optional[asyncio.Task] = None
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        if self.rps > 0:
+            self._requests = min(float(self.burst), self._requests + elapsed * self.rps)
+        if self.tpm > 0:
+            self._tokens = min(float(self.tpm), self._tokens + elapsed * self.tpm / 60)
+
+    def _wait_time(self, tokens: int) -> float:
+        """
+        Сколько секунд ждать, пока в обоих ведрах хватит на запрос.
+        """
+        wait = 0.0
+        if self.rps > 0 and self._requests < 1:
+            wait = (1 - self._requests) / self.rps
+        need = min(tokens, self.tpm)
+        if self.tpm > 0 and self._tokens < need:
+            wait = max(wait, (need - self._tokens) / (self.tpm / 60))
+        return wait
+
+    async def _pump(self) -> None:
+        try:
+            while self._waiters:
+                _, _, future, tokens = self._waiters[0]
+                if future.done():
+                    heapq.heappop(self._waiters)
+                    continue
+                self._refill()
+                if self._in_flight >= self.max_concurrency:
+                    wait = None
+                else:
+                    wait = self._wait_time(tokens)
+                    if wait <= 0:
+                        heapq.heappop(self._waiters)
+                        if self.rps > 0:
+                            self._requests -= 1
+                        if self.tpm > 0:
+                            self._tokens -= tokens
+                        self._in_flight += 1
+                        future.set_result(None)
+                        continue
+                # Ждём пополнения, освобождения слота или более срочного запроса
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._pump_task = None
+
+    def _kick(self) -> None:
+        self._wakeup.set()
+        if self._pump_task is None:
+            self._pump_task = asyncio.get_running_loop().create_task(self._pump())
+
+    async def acquire(self, tokens: int, priority: int = PRIORITY_INTERACTIVE) -> None:
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future, tokens))
+        self._kick()
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Слот уже выдан, но вызывающий отменён — возвращаем его
+            if future.done() and not future.cancelled():
+                self.release(tokens, tokens)
+            raise
+
+    def release(self, estimated: int, used: int) -> None:
+        if self.tpm > 0:
+            self._tokens -= used - estimated
+        self._in_flight -= 1
+        if self._waiters:
+            self._kick()
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self._in_flight,
+            "waiting": sum(1 for w in self._waiters if not w[2].done()),
+            "requests_left": round(self._requests, 2),
+            "tokens_left": int(self._tokens)
+        }
+
+
+limiter = TokenBucketLimiter(LLM_RPS, LLM_BURST, LLM_TPM, LLM_MAX_CONCURRENCY)
+
+
+def _estimate_tokens(messages: List[dict], max_tokens: int) -> int:
+    # Грубая оценка: ~3 символа на токен для русского текста плюс максимум ответа
+    return sum(len(m["content"]) for m in messages) // 3 + max_tokens
+
+
+async def _complete(messages: List[dict], max_tokens: int, temperature: float, priority: int, timeout: float) -> str:
+    estimated = _estimate_tokens(messages, max_tokens)
+    await limiter.acquire(estimated, priority)
+    used = estimated
+    try:
+        response = await client.chat.completions.create(
+            model=LLM_MODEL,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            timeout=timeout
+        )
+        if response.usage is not None:
+            used = response.usage.total_tokens
+        return response.choices[0].message.content or ""
+    finally:
+        limiter.release(estimated, used)
+
+
+async def complete(
+    messages: List[dict],
+    max_tokens: int,
+    temperature: float = 0.5,
+    priority: int = PRIORITY_INTERACTIVE,
+    timeout: float = LLM_TIMEOUT
+) -> str:
+    """
+    Запрос к LLM через общий лимитер.
+    :param priority: PRIORITY_INTERACTIVE для ответов пользователю, PRIORITY_BACKGROUND для фоновых задач
+    :param timeout: Общий таймаут с учётом ожидания в очереди, сек
+    :return: Текст ответа ("" если модель ничего не вернула)
+    """
+    started = time.monotonic()
+    try:
+        return await asyncio.wait_for(_complete(messages, max_tokens, temperature, priority, timeout), timeout)
+    finally:
+        logging.debug(f"[LLM] Запрос за {time.monotonic() - started:.2f} с, лимитер: {limiter.stats()}")
+
+
+async def stream(
+    messages: List[dict],
+    max_tokens: int,
+    temperature: float = 0.5,
+    priority: int = PRIORITY_INTERACTIVE,
+    timeout: float = LLM_TIMEOUT
+) -> AsyncIterator[str]:
+    """
+    Потоковый запрос к LLM через общий лимитер: отдаёт куски текста по мере генерации.
+    :param timeout: Общий таймаут с учётом ожидания в очереди и всего потока, сек
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    estimated = _estimate_tokens(messages, max_tokens)
+    await asyncio.wait_for(limiter.acquire(estimated, priority), timeout)
+    used = estimated
+    response = None
+    started = time.monotonic()
+    try:
+        response = await asyncio.wait_for(
+            client.chat.completions.create(
+                model=LLM_MODEL,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                stream=True,
+                timeout=timeout
+            ),
+            deadline - loop.time()
+        )
+        chunks = response.__aiter__()
+        first = True
+        while True:
+            try:
+                chunk = await asyncio.wait_for(chunks.__anext__(), deadline - loop.time())
+            except StopAsyncIteration:
+                break
+            if getattr(chunk, "usage", None) is not None:
+                used = chunk.usage.total_tokens
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                if first:
+                    logging.debug(f"[LLM] Первый фрагмент через {time.monotonic() - started:.2f} с")
+                    first = False
+                yield delta
+    finally:
+        limiter.release(estimated, used)
+        if response is not None and hasattr(response, "close"):
+            await response.close()
+        logging.debug(f"[LLM] Поток за {time.monotonic() - started:.2f} с, лимитер: {limiter.stats()}")
+
+
+async def close_llm_client() -> None:
+    await client.close()
+    logging.info("[LLM] HTTP-клиент закрыт")
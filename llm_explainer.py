@@ -1,37 +1,146 @@
+import json
+import math
 import os
-from openai import OpenAI
-from dotenv import load_dotenv
+import re
+import threading
+import time
+from collections import OrderedDict
 import logging
-import asyncio
-
-load_dotenv()
-
-client = OpenAI(
-    api_key=os.getenv("TOGETHER_API_KEY"),
-    base_url="https://api.together.xyz/v1"
+from typing import Callable, Dict, List, Optional
+from llm_client import complete, stream, PRIORITY_INTERACTIVE, LLM_STREAMING
+from single_flight import SingleFlight
+from metrics import timed
+from utils import interval_to_seconds
+
+# --- Кэш ответов LLM ---
+# Пока свеча не закрылась, индикаторы почти не меняются, и несколько пользователей,
+# спросивших про одну монету, получают один и тот же ответ без повторного запроса.
+# Ключ: (функция, symbol, timeframe, PROMPT_VERSION, отпечаток индикаторов);
+# запись живёт до закрытия свечи таймфрейма, всего не больше LLM_CACHE_SIZE записей.
+# Увеличивайте PROMPT_VERSION при любом изменении промптов.
+PROMPT_VERSION = 2
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "512"))
+# Поля индикаторов, которые попадают в промпты
+PROMPT_FIELDS = (
+    "final_signal", "SevenDays", "recommendation", "RSI", "MACD", "StochRSI",
+    "EMA9", "EMA20", "EMA50", "MA_summary", "MA_buy", "MA_sell", "candles", "trend", "volume"
 )
-
-# Очередь и воркер для Together AI
-_together_queue = asyncio.Queue()
-TOGETHER_RATE_LIMIT = 1  # 1 запрос в секунду
-
-async def together_worker():
-    while True:
-        func, args, kwargs, future = await _together_queue.get()
+# Шаг квантования числовых полей отпечатка: ("abs", шаг) — в единицах индикатора,
+# ("price", доля) — доля порядка цены (EMA50 95 000 -> 10 000), чтобы корзина
+# EMA/MACD была сопоставимой на любой монете. Остальные поля сравниваются как есть.
+FINGERPRINT_STEPS = {
+    "RSI": ("abs", 1.0),
+    "StochRSI": ("abs", 1.0),
+    "MACD": ("price", 0.001),
+    "EMA9": ("price", 0.002),
+    "EMA20": ("price", 0.002),
+    "EMA50": ("price", 0.002),
+}
+# Объём незакрытой свечи растёт с каждым тиком потока — в отпечаток не входит
+FINGERPRINT_FIELDS = tuple(field for field in PROMPT_FIELDS if field != "volume")
+_llm_cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+_llm_cache_lock = threading.Lock()
+_llm_cache_stats = {"hits": 0, "misses": 0}
+# Пока ответ по ключу кэша ещё идёт, такие же запросы ждут его, а не идут в LLM
+_llm_flights = SingleFlight("llm")
+# Черновики потокового ответа рассылаются всем, кто ждёт тот же запрос, а не
+# только первому: ключ кэша -> колбэки on_text ожидающих и последний черновик
+# (для присоединившихся позже). Только из event loop, без блокировок.
+_draft_listeners: Dict[tuple, List[Callable[[str], None]]] = {}
+_drafts: Dict[tuple, str] = {}
+
+
+def _to_number(value) -> Optional[float]:
+    """
+    Число из значения индикатора: индикаторы приходят и числами, и строками format_float ("45.23").
+    """
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
         try:
-            result = await func(*args, **kwargs)
-            future.set_result(result)
-        except Exception as e:
-            future.set_exception(e)
-        await asyncio.sleep(1 / TOGETHER_RATE_LIMIT)
+            return float(value)
+        except ValueError:
+            return None
+    return None
+
+
+def _price_scale(indicators: dict) -> Optional[float]:
+    price = _to_number(indicators.get("EMA50"))
+    if not price:
+        return None
+    return 10.0 ** math.floor(math.log10(abs(price)))
+
+
+def _quantize(field: str, value, scale: Optional[float]):
+    step = FINGERPRINT_STEPS.get(field)
+    number = _to_number(value)
+    if step is None or number is None:
+        return value
+    kind, size = step
+    if kind == "price":
+        if scale is None:
+            return number
+        size *= scale
+    return round(number / size)
+
+
+def _fingerprint(indicators: dict) -> tuple:
+    scale = _price_scale(indicators)
+    return tuple(_quantize(field, indicators.get(field), scale) for field in FINGERPRINT_FIELDS)
+
+
+def _llm_cache_key(function: str, symbol: str, timeframe: str, *indicators: dict) -> tuple:
+    return (function, symbol.upper(), timeframe, PROMPT_VERSION) + tuple(_fingerprint(i) for i in indicators)
+
+
+def _get_cached_llm(key: tuple):
+    now = time.time()
+    with _llm_cache_lock:
+        entry = _llm_cache.get(key)
+        if entry is not None and entry[1] <= now:
+            del _llm_cache[key]
+            entry = None
+        if entry is None:
+            _llm_cache_stats["misses"] += 1
+            return None
+        _llm_cache.move_to_end(key)
+        _llm_cache_stats["hits"] += 1
+        # Структурные ответы — копией, чтобы вызывающий код не испортил кэш
+        return dict(entry[0]) if isinstance(entry[0], dict) else entry[0]
+
+
+def _store_cached_llm(key: tuple, value, timeframe: str) -> None:
+    seconds = interval_to_seconds(timeframe)
+    expires_at = (time.time() // seconds + 1) * seconds
+    with _llm_cache_lock:
+        _llm_cache[key] = (value, expires_at)
+        _llm_cache.move_to_end(key)
+        while len(_llm_cache) > LLM_CACHE_SIZE:
+            _llm_cache.popitem(last=False)
+
+
+def get_llm_cache_stats() -> dict:
+    """
+    Счётчики попаданий/промахов кэша ответов LLM.
+    """
+    with _llm_cache_lock:
+        hits = _llm_cache_stats["hits"]
+        misses = _llm_cache_stats["misses"]
+        entries = len(_llm_cache)
+    total = hits + misses
+    return {
+        "hits": hits,
+        "misses": misses,
+        "entries": entries,
+        "hit_rate": round(hits / total, 3) if total else 0.0
+    }
 
-asyncio.get_event_loop().create_task(together_worker())
 
-async def together_request(func, *args, **kwargs):
-    loop = asyncio.get_event_loop()
-    future = loop.create_future()
-    await _together_queue.put((func, args, kwargs, future))
-    return await future
+def clear_llm_cache() -> None:
+    with _llm_cache_lock:
+        _llm_cache.clear()
 
 
 def translate_timeframe(tf: str) -> str:
@@ -43,7 +152,12 @@ def translate_timeframe(tf: str) -> str:
     }.get(tf, tf)
 
 
-async def generate_explanation(indicators: dict, timeframe: str, symbol: str = "BTCUSDT") -> str:
+@timed("llm_explanation")
+async def generate_explanation(indicators: dict, timeframe: str, symbol: str = "BTCUSDT", priority: int = PRIORITY_INTERACTIVE) -> str:
+    key = _llm_cache_key("explanation", symbol, timeframe, indicators)
+    cached = _get_cached_llm(key)
+    if cached is not None:
+        return cached
     readable_tf = translate_timeframe(timeframe)
 
     prompt = f"""
@@ -96,72 +210,101 @@ async def generate_explanation(indicators: dict, timeframe: str, symbol: str = "
 - Тренд: {indicators.get('trend')}
 """
 
-    try:
-        response = await asyncio.get_event_loop().run_in_executor(
-            None,
-            lambda: client.chat.completions.create(
-                model="mistralai/Mixtral-8x7B-Instruct-v0.1",
+    async def request() -> str:
+        try:
+            content = await complete(
                 messages=[
                     {"role": "system", "content": "Ты эксперт по криптоанализу. Строго следуй шаблону из примера пользователя. После блока с показателями всегда добавляй краткий вывод отдельной строкой (Краткий вывод: ...). Не добавляй лишних пояснений. Пиши только по одному таймфрейму, не добавляй блоки по другим таймфреймам. Пиши на русском."},
                     {"role": "user", "content": prompt.strip()}
                 ],
-                temperature=0.5,
-                max_tokens=600
+                max_tokens=600,
+                priority=priority
             )
-        )
-        content = response.choices[0].message.content
-        return content.strip() if content else "⚠️ Ответ от ИИ пустой."
+            if not content:
+                return "⚠️ Ответ от ИИ пустой."
+            _store_cached_llm(key, content.strip(), timeframe)
+            return content.strip()
 
-    except Exception as e:
-        logging.exception(f"[TOGETHER AI] Ошибка при получении пояснения: {e}")
-        return f"⚠️ Не удалось получить пояснение от ИИ (Together AI): {str(e)}"
+        except Exception as e:
+            logging.exception(f"[TOGETHER AI] Ошибка при получении пояснения: {e}")
+            return f"⚠️ Не удалось получить пояснение от ИИ (Together AI): {str(e)}"
 
+    return await _llm_flights.do(key, request)
 
-async def generate_short_comment(indicators: dict, timeframe: str, symbol: str = "BTCUSDT") -> str:
-    readable_tf = translate_timeframe(timeframe)
-    # Формируем краткий prompt только для вывода
-    prompt = f"""
-На основе этих индикаторов для {symbol} на таймфрейме {readable_tf} дай краткий вывод (1-2 предложения) для трейдера. Не повторяй показатели, не пиши шапку, только вывод. Пиши только на русском языке, не используй английский, не вставляй англоязычные слова и фразы. Если в индикаторах встречаются английские слова, обязательно переводи их на русский.
 
-Индикаторы:
-- Итоговый сигнал: {indicators.get('final_signal')}
-- Seven days: {indicators.get('SevenDays')}
-- Рекомендация: {indicators.get('recommendation')}
-- RSI: {indicators.get('RSI')}
-- MACD: {indicators.get('MACD')}
-- Stoch RSI: {indicators.get('StochRSI')}
-- EMA(9): {indicators.get('EMA9')}
-- EMA(20): {indicators.get('EMA20')}
-- EMA(50): {indicators.get('EMA50')}
-- Объём: {indicators.get('volume')}
-- Тренд: {indicators.get('trend')}
-"""
+def _parse_analysis(content: str) -> dict:
+    """
+    Разбирает JSON-ответ {"comment", "direction", "probability"}; невалидные поля -> None.
+    """
+    result = {"comment": "—", "direction": None, "probability": None}
+    match = re.search(r"\{.*\}", content or "", re.S)
+    if not match:
+        return result
     try:
-        response = await asyncio.get_event_loop().run_in_executor(
-            None,
-            lambda: client.chat.completions.create(
-                model="mistralai/Mixtral-8x7B-Instruct-v0.1",
-                messages=[
-                    {"role": "system", "content": "Ты эксперт по криптоанализу. Дай только краткий вывод по индикаторам, не повторяй показатели, не пиши шапку, только вывод. Пиши только на русском языке, не используй английский, не вставляй англоязычные слова и фразы. Запрещено использовать английские слова, даже в технических терминах."},
-                    {"role": "user", "content": prompt.strip()}
-                ],
-                temperature=0.5,
-                max_tokens=200
-            )
-        )
-        content = response.choices[0].message.content
-        return content.strip() if content else "—"
-    except Exception as e:
-        logging.exception(f"[TOGETHER AI] Ошибка при получении краткого вывода: {e}")
-        return "—"
+        data = json.loads(match.group(0))
+    except ValueError:
+        return result
+    comment = str(data.get("comment") or "").strip()
+    if comment:
+        result["comment"] = comment
+    direction = str(data.get("direction") or "").upper()
+    if "ЛОНГ" in direction or "LONG" in direction:
+        result["direction"] = "ЛОНГ"
+    elif "ШОРТ" in direction or "SHORT" in direction:
+        result["direction"] = "ШОРТ"
+    try:
+        result["probability"] = min(95, max(50, int(float(data.get("probability")))))
+    except (TypeError, ValueError):
+        pass
+    return result
 
 
-async def generate_direction_and_probability(indicators: dict, timeframe: str, symbol: str = "BTCUSDT") -> str:
+_PARTIAL_COMMENT = re.compile(r'"comment"\s*:\s*"((?:[^"\\]|\\.)*)', re.S)
+
+
+def _partial_comment(content: str) -> str:
+    """
+    Уже сгенерированная часть поля comment из недописанного JSON-ответа.
+    """
+    match = _PARTIAL_COMMENT.search(content)
+    if not match:
+        return ""
+    text = match.group(1)
+    if text.endswith("\\"):
+        text = text[:-1]
+    try:
+        return json.loads(f'"{text}"')
+    except ValueError:
+        return text
+
+
+@timed("llm_timeframe_analysis")
+async def generate_timeframe_analysis(
+    indicators: dict,
+    timeframe: str,
+    symbol: str = "BTCUSDT",
+    priority: int = PRIORITY_INTERACTIVE,
+    on_text: Optional[Callable[[str], None]] = None
+) -> dict:
+    """
+    Один запрос к LLM на таймфрейм: краткий вывод, направление и вероятность вместе.
+    :param on_text: Вызывается с уже готовой частью вывода по мере потоковой генерации (LLM_STREAMING),
+                    в том числе когда ответ для другого пользователя уже идёт. Если первый запрос
+                    пошёл без потока (никто не ждал черновиков), черновиков не будет — только итог
+    :return: {"comment": str, "direction": "ЛОНГ"/"ШОРТ"/None, "probability": int/None}
+    """
+    key = _llm_cache_key("timeframe_analysis", symbol, timeframe, indicators)
+    cached = _get_cached_llm(key)
+    if cached is not None:
+        return cached
     readable_tf = translate_timeframe(timeframe)
     prompt = f"""
-На основе этих индикаторов для {symbol} на таймфрейме {readable_tf} оцени, куда с большей вероятностью пойдёт цена. 
+На основе этих индикаторов для {symbol} на таймфрейме {readable_tf} дай краткий вывод для трейдера и оцени, куда с большей вероятностью пойдёт цена.
 
-ВАЖНО: Ответь ТОЛЬКО в формате "ЛОНГ XX%" или "ШОРТ XX%" где XX - процент уверенности от 50 до 95.
+ВАЖНО: Ответь ТОЛЬКО одним JSON-объектом без пояснений:
+{{"comment": "<краткий вывод, 1-2 предложения>", "direction": "ЛОНГ" или "ШОРТ", "probability": <целое число от 50 до 95>}}
+
+В выводе не повторяй показатели и не пиши шапку. Пиши только на русском языке, не используй английский, не вставляй англоязычные слова и фразы. Если в индикаторах встречаются английские слова, обязательно переводи их на русский.
 
 Индикаторы:
 - Итоговый сигнал: {indicators.get('final_signal')}
@@ -178,99 +321,57 @@ async def generate_direction_and_probability(indicators: dict, timeframe: str, s
 - Тренд: {indicators.get('trend')}
 - Объём: {indicators.get('volume')}
 """
-    try:
-        response = await asyncio.get_event_loop().run_in_executor(
-            None,
-            lambda: client.chat.completions.create(
-                model="mistralai/Mixtral-8x7B-Instruct-v0.1",
-                messages=[
-                    {"role": "system", "content": "Ты эксперт по криптоанализу. Отвечай СТРОГО в формате 'ЛОНГ XX%' или 'ШОРТ XX%' где XX - процент от 50 до 95. Никаких других слов или пояснений."},
-                    {"role": "user", "content": prompt.strip()}
-                ],
-                temperature=0.5,
-                max_tokens=20
-            )
-        )
-        content = response.choices[0].message.content
-        return content.strip() if content else "—"
-    except Exception as e:
-        logging.exception(f"[TOGETHER AI] Ошибка при получении направления и вероятности: {e}")
-        return "—"
-
-
-def build_full_forecast_prompt(symbol: str, indicators_15m: dict, indicators_1h: dict, indicators_4h: dict) -> str:
-    return f"""
-Ты — криптовалютный аналитик. На основе индикаторов для {symbol} составь структурированный прогноз по шаблону:
-
-1. Для каждого таймфрейма (15 минут, 1 час, 4 часа):
-   - Краткий вывод (1-2 предложения)
-   - Вероятность и направление (ЛОНГ/ШОРТ и %)
-   - Основные индикаторы (RSI, MACD, Stoch RSI, EMA(9/20/50), MA Summary, Свечные сигналы, Тренд)
-
-2. В конце — общий вывод по всем таймфреймам (1-2 предложения, только по делу, с акцентом на неопределённость/силу сигнала, если она есть).
-
-Данные для анализа:
-
-15 минут:
-- Итоговый сигнал: {indicators_15m.get('final_signal')}
-- Seven days: {indicators_15m.get('SevenDays')}
-- Рекомендация: {indicators_15m.get('recommendation')}
-- RSI: {indicators_15m.get('RSI')}
-- MACD: {indicators_15m.get('MACD')}
-- Stoch RSI: {indicators_15m.get('StochRSI')}
-- EMA(9): {indicators_15m.get('EMA9')}
-- EMA(20): {indicators_15m.get('EMA20')}
-- EMA(50): {indicators_15m.get('EMA50')}
-- MA Summary: {indicators_15m.get('MA_summary')} (Покупка: {indicators_15m.get('MA_buy')}, Продажа: {indicators_15m.get('MA_sell')})
-- Свечные сигналы: {indicators_15m.get('candles')}
-- Тренд: {indicators_15m.get('trend')}
-
-1 час:
-- Итоговый сигнал: {indicators_1h.get('final_signal')}
-- Seven days: {indicators_1h.get('SevenDays')}
-- Рекомендация: {indicators_1h.get('recommendation')}
-- RSI: {indicators_1h.get('RSI')}
-- MACD: {indicators_1h.get('MACD')}
-- Stoch RSI: {indicators_1h.get('StochRSI')}
-- EMA(9): {indicators_1h.get('EMA9')}
-- EMA(20): {indicators_1h.get('EMA20')}
-- EMA(50): {indicators_1h.get('EMA50')}
-- MA Summary: {indicators_1h.get('MA_summary')} (Покупка: {indicators_1h.get('MA_buy')}, Продажа: {indicators_1h.get('MA_sell')})
-- Свечные сигналы: {indicators_1h.get('candles')}
-- Тренд: {indicators_1h.get('trend')}
-
-4 часа:
-- Итоговый сигнал: {indicators_4h.get('final_signal')}
-- Seven days: {indicators_4h.get('SevenDays')}
-- Рекомендация: {indicators_4h.get('recommendation')}
-- RSI: {indicators_4h.get('RSI')}
-- MACD: {indicators_4h.get('MACD')}
-- Stoch RSI: {indicators_4h.get('StochRSI')}
-- EMA(9): {indicators_4h.get('EMA9')}
-- EMA(20): {indicators_4h.get('EMA20')}
-- EMA(50): {indicators_4h.get('EMA50')}
-- MA Summary: {indicators_4h.get('MA_summary')} (Покупка: {indicators_4h.get('MA_buy')}, Продажа: {indicators_4h.get('MA_sell')})
-- Свечные сигналы: {indicators_4h.get('candles')}
-- Тренд: {indicators_4h.get('trend')}
-"""
 
-async def generate_full_forecast(symbol: str, indicators_15m: dict, indicators_1h: dict, indicators_4h: dict) -> str:
-    prompt = build_full_forecast_prompt(symbol, indicators_15m, indicators_1h, indicators_4h)
+    messages = [
+        {"role": "system", "content": "Ты эксперт по криптоанализу. Отвечай СТРОГО одним JSON-объектом с полями comment, direction (ЛОНГ или ШОРТ) и probability (от 50 до 95). Никаких других слов. Вывод в comment — только на русском языке."},
+        {"role": "user", "content": prompt.strip()}
+    ]
+
+    async def request() -> dict:
+        try:
+            if LLM_STREAMING and _draft_listeners.get(key):
+                content = ""
+                shown = ""
+                async for delta in stream(messages=messages, max_tokens=300, priority=priority):
+                    content += delta
+                    comment = _partial_comment(content)
+                    if comment != shown:
+                        shown = _drafts[key] = comment
+                        for listener in list(_draft_listeners.get(key, ())):
+                            listener(comment)
+            else:
+                content = await complete(messages=messages, max_tokens=300, priority=priority)
+            analysis = _parse_analysis(content)
+            if analysis["direction"] is None or analysis["probability"] is None:
+                logging.warning(f"[TOGETHER AI] Неполный ответ анализа {symbol} {timeframe}: {analysis}")
+            else:
+                _store_cached_llm(key, analysis, timeframe)
+            return analysis
+        except Exception as e:
+            logging.exception(f"[TOGETHER AI] Ошибка при получении анализа таймфрейма: {e}")
+            return {"comment": "—", "direction": None, "probability": None}
+        finally:
+            _drafts.pop(key, None)
+
+    if on_text is not None:
+        _draft_listeners.setdefault(key, []).append(on_text)
+        if _drafts.get(key):
+            on_text(_drafts[key])
     try:
-        response = await asyncio.get_event_loop().run_in_executor(
-            None,
-            lambda: client.chat.completions.create(
-                model="mistralai/Mixtral-8x7B-Instruct-v0.1",
-                messages=[
-                    {"role": "system", "content": "Ты эксперт по криптоанализу. Строго следуй шаблону. Для каждого таймфрейма дай краткий вывод, вероятность и направление, индикаторы. В конце — общий вывод. Пиши только на русском языке, не используй английский, не вставляй англоязычные слова и фразы."},
-                    {"role": "user", "content": prompt.strip()}
-                ],
-                temperature=0.5,
-                max_tokens=900
-            )
-        )
-        content = response.choices[0].message.content
-        return content.strip() if content else "⚠️ Ответ от ИИ пустой."
-    except Exception as e:
-        logging.exception(f"[TOGETHER AI] Ошибка при получении полного прогноза: {e}")
-        return f"⚠️ Не удалось получить полный прогноз от ИИ (Together AI): {str(e)}"
+        # Копия: вызывающий код может менять словарь, а результат общий для ожидающих
+        return dict(await _llm_flights.do(key, request))
+    finally:
+        if on_text is not None:
+            listeners = _draft_listeners[key]
+            listeners.remove(on_text)
+            if not listeners:
+                del _draft_listeners[key]
+
+
+def format_direction(analysis: dict) -> str:
+    """
+    "ЛОНГ 70%" из структурного ответа или "—", если направление не получено.
+    """
+    if analysis.get("direction") and analysis.get("probability") is not None:
+        return f"{analysis['direction']} {analysis['probability']}%"
+    return "—"
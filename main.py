@@ -31,4 +31,29 @@ if __name__ == '__main__':
     )
     logging.info('[STARTUP] Бот запущен')
     from aiogram.utils import executor
-    executor.start_polling(dp, skip_updates=True) 
\ No newline at end of file
+    from binance_client import close_binance_client
+    from scheduler import start_scheduler, stop_scheduler
+    from kline_stream import start_kline_stream, stop_kline_stream
+    from chart_renderer import start_chart_renderer, stop_chart_renderer
+    from llm_client import close_llm_client
+    from metrics import start_metrics_server, stop_metrics_server
+
+    async def on_startup(dp):
+        # Пул отрисовки поднимаем заранее, чтобы первый график не ждал запуска
+        # процессов (воркеры стартуют через forkserver, потоки бота им не мешают)
+        await start_chart_renderer()
+        # Потоковые свечи Binance и фоновое обновление на закрытии свечей
+        await start_kline_stream()
+        await start_scheduler()
+        # Локальный эндпоинт /metrics для Prometheus
+        await start_metrics_server()
+
+    async def on_shutdown(dp):
+        await stop_metrics_server()
+        await stop_scheduler()
+        await stop_kline_stream()
+        await close_binance_client()
+        await close_llm_client()
+        await stop_chart_renderer()
+
+    executor.start_polling(dp, skip_updates=True, on_startup=on_startup, on_shutdown=on_shutdown) 
\ No newline at end of file
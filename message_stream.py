@@ -0,0 +1,131 @@
+import asyncio
+import logging
+import os
+from typing import List, Optional
+
+from aiogram.utils.exceptions import MessageNotModified, RetryAfter, TelegramAPIError
+
+from bot_init import bot
+
+# Постепенное обновление сообщения по мере генерации ответа LLM. Telegram
+# ограничивает частоту правок (около одной в секунду на чат), поэтому правки
+# идут не чаще STREAM_EDIT_INTERVAL, а промежуточные версии текста
+# схлопываются — отправляется только самая свежая.
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.0"))
+# Максимальная длина текста сообщения в Telegram
+MESSAGE_MAX_LENGTH = 4096
+FINAL_EDIT_ATTEMPTS = 3
+
+
+def pack_lines(lines: List[str], limit: int = MESSAGE_MAX_LENGTH) -> List[str]:
+    """
+    Склеивает строки в сообщения не длиннее limit, разрывая только между
+    строками (строка длиннее limit обрезается) — разметка внутри строки цела.
+    """
+    messages: List[str] = []
+    current: Optional[str] = None
+    for line in lines:
+        line = line[:limit]
+        if current is not None and len(current) + 1 + len(line) <= limit:
+            current += "\n" + line
+            continue
+        if current is not None:
+            messages.append(current)
+        current = line
+    if current is not None:
+        messages.append(current)
+    return messages
+
+
+class StreamingMessage:
+    """
+    Сообщение-заглушка («⏳ Анализируем...»), в которое пишется черновой текст
+    через update() и которое finish() заменяет итоговым оформленным текстом.
+    """
+
+    def __init__(self, chat_id: int, message_id: int, interval: float = STREAM_EDIT_INTERVAL):
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.interval = interval
+        self._text: Optional[str] = None
+        self._sent: Optional[str] = None
+        self._last_edit = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self._closed = False
+        self.edits = 0
+
+    def update(self, text: str) -> None:
+        """
+        Новый черновой текст (без разметки); правка будет отправлена при ближайшей возможности.
+        """
+        if self._closed:
+            return
+        self._text = text[:MESSAGE_MAX_LENGTH]
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._flush())
+
+    async def _wait_turn(self) -> None:
+        wait = self._last_edit + self.interval - asyncio.get_running_loop().time()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    async def _flush(self) -> None:
+        while not self._closed and self._text != self._sent:
+            await self._wait_turn()
+            if self._closed:
+                break
+            await self._edit(self._text)
+
+    def _retry_after(self, e: RetryAfter) -> None:
+        # Следующая правка — не раньше, чем разрешит Telegram
+        logging.warning(f"[TELEGRAM] Лимит правок сообщения, пауза {e.timeout} с")
+        self._last_edit = asyncio.get_running_loop().time() + e.timeout - self.interval
+
+    async def _edit(self, text: str, parse_mode: Optional[str] = None) -> bool:
+        self._last_edit = asyncio.get_running_loop().time()
+        try:
+            await bot.edit_message_text(text, self.chat_id, self.message_id, parse_mode=parse_mode)
+            self.edits += 1
+            self._sent = text
+            return True
+        except MessageNotModified:
+            self._sent = text
+            return True
+        except RetryAfter as e:
+            self._retry_after(e)
+            return False
+        except TelegramAPIError as e:
+            # Черновик не обязателен — пропускаем эту версию текста
+            logging.warning(f"[TELEGRAM] Не удалось обновить сообщение: {e}")
+            self._sent = text
+            return False
+
+    async def finish(self, text: str, parse_mode: Optional[str] = None) -> bool:
+        """
+        Заменяет черновик итоговым текстом.
+        :return: False, если заменить не удалось — тогда итог нужно отправить отдельным сообщением
+        """
+        self._closed = True
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if len(text) > MESSAGE_MAX_LENGTH:
+            return False
+        for _ in range(FINAL_EDIT_ATTEMPTS):
+            await self._wait_turn()
+            self._last_edit = asyncio.get_running_loop().time()
+            try:
+                await bot.edit_message_text(text, self.chat_id, self.message_id, parse_mode=parse_mode)
+                self.edits += 1
+                return True
+            except MessageNotModified:
+                return True
+            except RetryAfter as e:
+                self._retry_after(e)
+            except TelegramAPIError as e:
+                logging.warning(f"[TELEGRAM] Не удалось заменить сообщение итоговым текстом: {e}")
+                return False
+        return False
@@ -0,0 +1,265 @@
+import asyncio
+import bisect
+import functools
+import inspect
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Dict, Optional, Tuple
+
+from aiohttp import web
+
+# Замеры длительности этапов обработки запроса (свечи, TradingView, индикаторы,
+# графики, LLM, Telegram). Каждый замер помечен этапом, монетой, таймфреймом и
+# обработчиком; по ним строятся гистограммы (p50/p95/p99), доступные на
+# локальном HTTP-эндпоинте в формате Prometheus и в команде /stats.
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+# 0 — эндпоинт выключен
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+# Границы корзин гистограммы, сек
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Сколько последних замеров ряда хранится для точных перцентилей
+RECENT_SAMPLES = int(os.getenv("METRICS_RECENT_SAMPLES", "1024"))
+QUANTILES = (0.5, 0.95, 0.99)
+LABELS = ("stage", "symbol", "timeframe", "handler")
+
+# Метки текущего запроса (обработчик, монета, таймфрейм) — наследуются задачами
+_tags: ContextVar[Dict[str, str]] = ContextVar("metrics_tags", default={})
+
+SeriesKey = Tuple[str, str, str, str]
+
+
+class Histogram:
+    """
+    Корзины и сумма за всё время (для Prometheus) плюс последние замеры для перцентилей.
+    """
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.errors = 0
+        self.recent = deque(maxlen=RECENT_SAMPLES)
+
+    def observe(self, seconds: float, error: bool = False) -> None:
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+        self.errors += error
+        self.recent.append(seconds)
+
+    def merge(self, other: "Histogram") -> None:
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.total += other.total
+        self.count += other.count
+        self.errors += other.errors
+        self.recent.extend(other.recent)
+
+    def quantiles(self) -> Dict[float, float]:
+        samples = sorted(self.recent)
+        if not samples:
+            return {q: 0.0 for q in QUANTILES}
+        # Ближайший ранг: p50 из [a, b] — a
+        return {q: samples[max(0, math.ceil(q * len(samples)) - 1)] for q in QUANTILES}
+
+
+_series: Dict[SeriesKey, Histogram] = {}
+_series_lock = threading.Lock()
+
+
+def set_tags(**tags: str) -> None:
+    """
+    Метки для всех замеров текущего запроса (и запущенных из него задач).
+    """
+    _tags.set({**_tags.get(), **{k: str(v) for k, v in tags.items() if v is not None}})
+
+
+def observe(stage: str, seconds: float, symbol: Optional[str] = None, timeframe: Optional[str] = None, error: bool = False) -> None:
+    tags = _tags.get()
+    key = (
+        stage,
+        (symbol or tags.get("symbol") or "-").upper(),
+        timeframe or tags.get("timeframe") or "-",
+        tags.get("handler", "-")
+    )
+    with _series_lock:
+        histogram = _series.get(key)
+        if histogram is None:
+            histogram = _series[key] = Histogram()
+        histogram.observe(seconds, error)
+
+
+class span:
+    """
+    Замер блока кода: `with span("render_chart", symbol, tf):` или `async with ...`.
+    Исключение внутри блока учитывается как ошибка этапа и пробрасывается дальше.
+    """
+
+    def __init__(self, stage: str, symbol: Optional[str] = None, timeframe: Optional[str] = None):
+        self.stage = stage
+        self.symbol = symbol
+        self.timeframe = timeframe
+        self.started = 0.0
+
+    def __enter__(self) -> "span":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        observe(self.stage, time.perf_counter() - self.started, self.symbol, self.timeframe, error=exc_type is not None)
+
+    async def __aenter__(self) -> "span":
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        self.__exit__(exc_type, exc, tb)
+
+
+def timed(stage: str, symbol: str = "symbol", timeframe: str = "timeframe"):
+    """
+    Декоратор замера функции (обычной или async). Монета и таймфрейм берутся из
+    аргументов с указанными именами, если они есть.
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        def labels(args, kwargs) -> Tuple[Optional[str], Optional[str]]:
+            try:
+                bound = signature.bind_partial(*args, **kwargs).arguments
+            except TypeError:
+                return None, None
+            return bound.get(symbol), bound.get(timeframe)
+
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(stage, *labels(args, kwargs)):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(stage, *labels(args, kwargs)):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _snapshot() -> Dict[SeriesKey, Histogram]:
+    with _series_lock:
+        result = {}
+        for key, histogram in _series.items():
+            copy = Histogram()
+            copy.merge(histogram)
+            result[key] = copy
+        return result
+
+
+def get_stage_stats() -> Dict[str, dict]:
+    """
+    Сводка по этапам (все монеты, таймфреймы и обработчики вместе): число замеров, ошибки, p50/p95/p99 в мс.
+    """
+    stages: Dict[str, Histogram] = {}
+    for key, histogram in _snapshot().items():
+        stages.setdefault(key[0], Histogram()).merge(histogram)
+    result = {}
+    for stage, histogram in sorted(stages.items()):
+        q = histogram.quantiles()
+        result[stage] = {
+            "count": histogram.count,
+            "errors": histogram.errors,
+            "p50_ms": round(q[0.5] * 1000, 1),
+            "p95_ms": round(q[0.95] * 1000, 1),
+            "p99_ms": round(q[0.99] * 1000, 1)
+        }
+    return result
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(key: SeriesKey, **extra: str) -> str:
+    pairs = list(zip(LABELS, key)) + list(extra.items())
+    return ",".join(f'{name}="{_escape(value)}"' for name, value in pairs)
+
+
+def render_prometheus() -> str:
+    """
+    Все ряды в текстовом формате Prometheus: гистограмма длительностей,
+    перцентили по последним замерам и счётчик ошибок.
+    """
+    lines = [
+        "# HELP bot_stage_duration_seconds Длительность этапа обработки запроса",
+        "# TYPE bot_stage_duration_seconds histogram"
+    ]
+    snapshot = sorted(_snapshot().items())
+    for key, histogram in snapshot:
+        cumulative = 0
+        for bound, count in zip(BUCKETS, histogram.counts):
+            cumulative += count
+            lines.append(f"bot_stage_duration_seconds_bucket{{{_labels(key, le=repr(bound))}}} {cumulative}")
+        lines.append(f'bot_stage_duration_seconds_bucket{{{_labels(key, le="+Inf")}}} {histogram.count}')
+        lines.append(f"bot_stage_duration_seconds_sum{{{_labels(key)}}} {histogram.total:.6f}")
+        lines.append(f"bot_stage_duration_seconds_count{{{_labels(key)}}} {histogram.count}")
+    lines += [
+        "# HELP bot_stage_duration_quantile_seconds Перцентили длительности по последним замерам",
+        "# TYPE bot_stage_duration_quantile_seconds gauge"
+    ]
+    for key, histogram in snapshot:
+        for q, value in histogram.quantiles().items():
+            lines.append(f"bot_stage_duration_quantile_seconds{{{_labels(key, quantile=str(q))}}} {value:.6f}")
+    lines += [
+        "# HELP bot_stage_errors_total Этапы, завершившиеся исключением",
+        "# TYPE bot_stage_errors_total counter"
+    ]
+    for key, histogram in snapshot:
+        lines.append(f"bot_stage_errors_total{{{_labels(key)}}} {histogram.errors}")
+    return "\n".join(lines) + "\n"
+
+
+def reset_metrics() -> None:
+    with _series_lock:
+        _series.clear()
+
+
+_runner: Optional[web.AppRunner] = None
+
+
+async def _handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=render_prometheus(), content_type="text/plain", charset="utf-8")
+
+
+async def start_metrics_server() -> None:
+    """
+    Поднимает /metrics на METRICS_HOST:METRICS_PORT (по умолчанию только localhost).
+    """
+    global _runner
+    if METRICS_PORT <= 0:
+        logging.info("[METRICS] HTTP-эндпоинт отключён (METRICS_PORT=0)")
+        return
+    if _runner is not None:
+        return
+    app = web.Application()
+    app.router.add_get("/metrics", _handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, METRICS_HOST, METRICS_PORT).start()
+    except OSError as e:
+        logging.warning(f"[METRICS] Не удалось открыть {METRICS_HOST}:{METRICS_PORT}: {e}")
+        await runner.cleanup()
+        return
+    _runner = runner
+    logging.info(f"[METRICS] http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+
+
+async def stop_metrics_server() -> None:
+    global _runner
+    if _runner is not None:
+        await _runner.cleanup()
+        _runner = None
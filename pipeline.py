@@ -0,0 +1,84 @@
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from charting import get_ohlcv_async, generate_chart_async, generate_multi_chart_async
+from services import get_forecast_async, get_support_resistance
+
+# Окно свечей, на котором считаются индикаторы и уровни
+ANALYSIS_CANDLES = 300
+
+
+class AnalysisPipeline:
+    """
+    Анализ одной пары (symbol, timeframe) на одном снимке свечей.
+    Свечи загружаются один раз в load(), и тот же DataFrame используется
+    для индикаторов, уровней поддержки/сопротивления и графика.
+    """
+
+    def __init__(self, symbol: str, timeframe: str, limit: int = ANALYSIS_CANDLES):
+        self.symbol = symbol
+        self.timeframe = timeframe
+        self.limit = limit
+        self.df: Optional[pd.DataFrame] = None
+        self._forecast: Optional[Dict[str, Any]] = None
+        self._levels: Optional[Tuple[float, float]] = None
+
+    async def load(self) -> pd.DataFrame:
+        if self.df is None:
+            self.df = await get_ohlcv_async(self.symbol, self.timeframe, limit=self.limit)
+            logging.info(f"[PIPELINE] {self.symbol} {self.timeframe}: загружено {len(self.df)} свечей")
+        return self.df
+
+    async def forecast(self) -> Dict[str, Any]:
+        if self._forecast is None:
+            self._forecast = await get_forecast_async(self.symbol, self.timeframe, df=self.df)
+        return self._forecast
+
+    def levels(self) -> Tuple[float, float]:
+        if self._levels is None:
+            self._levels = get_support_resistance(self.df)
+        return self._levels
+
+    async def chart(self) -> bytes:
+        support, resistance = self.levels()
+        return await generate_chart_async(
+            self.symbol,
+            interval_binance=self.timeframe,
+            levels=[float(support), float(resistance)],
+            df=self.df
+        )
+
+
+async def load_pipelines(symbol: str, timeframes: List[str]) -> List[AnalysisPipeline]:
+    """
+    Создаёт конвейеры для нескольких таймфреймов и параллельно загружает свечи.
+    """
+    pipelines = [AnalysisPipeline(symbol, tf) for tf in timeframes]
+    await asyncio.gather(*(p.load() for p in pipelines))
+    return pipelines
+
+
+async def chart_pipelines(pipelines: List[AnalysisPipeline]) -> List[bytes]:
+    """
+    Параллельно рисует графики конвейеров (в пуле процессов chart_renderer), PNG байтами.
+    """
+    return await asyncio.gather(*(p.chart() for p in pipelines))
+
+
+async def chart_multi_pipelines(pipelines: List[AnalysisPipeline]) -> bytes:
+    """
+    Один график на все таймфреймы конвейеров (одного символа) по уже загруженным свечам.
+    """
+    frames = {p.timeframe: p.df for p in pipelines}
+    levels = {p.timeframe: [float(level) for level in p.levels()] for p in pipelines}
+    return await generate_multi_chart_async(pipelines[0].symbol, frames, levels)
+
+
+async def forecast_pipelines(pipelines: List[AnalysisPipeline]) -> List[Dict[str, Any]]:
+    """
+    Параллельно считает прогнозы для загруженных конвейеров.
+    """
+    return await asyncio.gather(*(p.forecast() for p in pipelines))
@@ -0,0 +1,146 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from typing import List, Optional
+
+from charting import get_ohlcv_async, OHLCV_MIN_TTL
+from indicator_engine import indicator_engine
+from kline_archive import archive_frame
+from llm_client import PRIORITY_BACKGROUND
+from llm_explainer import generate_timeframe_analysis
+from metrics import set_tags
+from pipeline import ANALYSIS_CANDLES, AnalysisPipeline
+from services import get_batch_analysis_async
+from signal_model import analysis_mode
+from utils import symbols, interval_to_seconds
+
+# Фоновое обновление рыночных данных на закрытии свечей: к приходу пользователя
+# свечи, потоковые индикаторы (indicator_engine) и анализ TradingView уже
+# лежат там, откуда их читает get_forecast.
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "1") == "1"
+SCHEDULER_INTERVALS = ["15m", "1h", "4h"]
+# Пауза после закрытия свечи, чтобы Binance успел её отдать, сек
+SCHEDULER_DELAY = float(os.getenv("SCHEDULER_DELAY", "2"))
+# Разброс старта запросов по монетам, сек
+SCHEDULER_JITTER = float(os.getenv("SCHEDULER_JITTER", "10"))
+# Сколько монет обновляется одновременно
+SCHEDULER_CONCURRENCY = int(os.getenv("SCHEDULER_CONCURRENCY", "3"))
+# Сколько раз перезапрашивать, если новая свеча ещё не появилась
+SCHEDULER_RETRIES = 3
+# Прогрев кэша LLM: для этих монет (через запятую) анализ таймфрейма запрашивается
+# сразу после обновления, на тех же свечах и индикаторах, что получит пользователь.
+# Запросы идут в фоновой очереди лимитера — запросы пользователей их обгоняют.
+# Пусто — прогрев выключен.
+SCHEDULER_LLM_SYMBOLS = [s.strip().upper() for s in os.getenv("SCHEDULER_LLM_SYMBOLS", "").split(",") if s.strip()]
+
+_scheduler_task: Optional[asyncio.Task] = None
+
+
+async def refresh_series(symbol: str, interval: str, boundary: Optional[float] = None) -> None:
+    """
+    Обновляет свечи и потоковые индикаторы одной пары (symbol, interval).
+    :param boundary: Момент закрытия свечи; ждём, пока Binance отдаст свечу, открытую в этот момент
+    """
+    for attempt in range(SCHEDULER_RETRIES):
+        df = await get_ohlcv_async(symbol, interval, limit=ANALYSIS_CANDLES)
+        if df.empty:
+            return
+        if boundary is None or df.index[-1].timestamp() >= boundary:
+            indicator_engine.update_frame(symbol, interval, df)
+            # Закрытые свечи окна — в архив на диске, без лишних запросов к API
+            archive_frame(symbol, interval, df)
+            return
+        # Кэш со старой свечой истечёт через OHLCV_MIN_TTL — тогда и перезапросим
+        await asyncio.sleep(OHLCV_MIN_TTL)
+    logging.warning(f"[SCHEDULER] {symbol} {interval}: новая свеча так и не появилась")
+
+
+async def warm_llm(symbol: str, interval: str) -> None:
+    """
+    Кладёт в кэш LLM анализ таймфрейма по текущей свече (PRIORITY_BACKGROUND).
+    """
+    pipeline = AnalysisPipeline(symbol, interval)
+    df = await pipeline.load()
+    if df.empty:
+        return
+    tf_data = await pipeline.forecast()
+    await generate_timeframe_analysis(tf_data["indicators"], interval, symbol, priority=PRIORITY_BACKGROUND)
+
+
+async def refresh_interval(interval: str, boundary: Optional[float] = None) -> None:
+    """
+    Обновляет все монеты из utils.symbols на таймфрейме: свечи с разбросом и
+    ограничением параллельности (вместе с потоковыми индикаторами) и пакетный анализ TradingView.
+    """
+    started = time.monotonic()
+    semaphore = asyncio.Semaphore(SCHEDULER_CONCURRENCY)
+
+    async def refresh_one(symbol: str) -> None:
+        await asyncio.sleep(random.uniform(0, SCHEDULER_JITTER))
+        async with semaphore:
+            try:
+                await refresh_series(symbol, interval, boundary)
+            except Exception as e:
+                logging.warning(f"[SCHEDULER] Не удалось обновить {symbol} {interval}: {e}")
+
+    async def refresh_analysis() -> None:
+        try:
+            await get_batch_analysis_async(interval)
+        except Exception as e:
+            logging.warning(f"[SCHEDULER] Не удалось обновить анализ TradingView @ {interval}: {e}")
+
+    async def warm_one(symbol: str) -> None:
+        try:
+            await warm_llm(symbol, interval)
+        except Exception as e:
+            logging.warning(f"[SCHEDULER] Не удалось прогреть LLM для {symbol} {interval}: {e}")
+
+    await asyncio.gather(refresh_analysis(), *(refresh_one(s) for s in symbols))
+    logging.info(f"[SCHEDULER] {interval}: {len(symbols)} монет обновлено за {time.monotonic() - started:.1f} с")
+    # В локальном режиме анализ считает модель сигнала — прогревать нечего
+    warm = [s for s in symbols if s in SCHEDULER_LLM_SYMBOLS]
+    if warm and analysis_mode() == "llm":
+        await asyncio.gather(*(warm_one(s) for s in warm))
+
+
+def _next_boundary(interval: str, now: float) -> float:
+    seconds = interval_to_seconds(interval)
+    return (now // seconds + 1) * seconds
+
+
+async def run_scheduler(intervals: List[str] = SCHEDULER_INTERVALS) -> None:
+    """
+    Прогрев при старте, затем обновление на каждом закрытии свечи 15m/1h/4h.
+    """
+    logging.info(f"[SCHEDULER] Запущен для {', '.join(intervals)}")
+    set_tags(handler="scheduler")
+    await asyncio.gather(*(refresh_interval(tf) for tf in intervals))
+    while True:
+        now = time.time()
+        boundaries = {tf: _next_boundary(tf, now) for tf in intervals}
+        boundary = min(boundaries.values())
+        await asyncio.sleep(max(0.0, boundary - time.time()) + SCHEDULER_DELAY)
+        due = [tf for tf, b in boundaries.items() if b == boundary]
+        await asyncio.gather(*(refresh_interval(tf, boundary) for tf in due))
+
+
+async def start_scheduler() -> None:
+    global _scheduler_task
+    if not SCHEDULER_ENABLED:
+        logging.info("[SCHEDULER] Отключён (SCHEDULER_ENABLED=0)")
+        return
+    if _scheduler_task is None or _scheduler_task.done():
+        _scheduler_task = asyncio.create_task(run_scheduler())
+
+
+async def stop_scheduler() -> None:
+    global _scheduler_task
+    if _scheduler_task is not None:
+        _scheduler_task.cancel()
+        try:
+            await _scheduler_task
+        except asyncio.CancelledError:
+            pass
+        _scheduler_task = None
@@ -1,17 +1,26 @@
 import logging
-from tradingview_ta import TA_Handler, Interval
+from tradingview_ta import TA_Handler, Interval, get_multiple_analysis
 from llm_explainer import generate_explanation
 import pandas as pd
-try:
-    import pandas_ta as ta
-    PANDAS_TA_AVAILABLE = True
-except ImportError:
-    logging.warning("pandas_ta не установлен — ATR, SuperTrend, PSAR не будут рассчитываться!")
-    PANDAS_TA_AVAILABLE = False
-from typing import Dict, Any, Tuple, Optional
-from utils import format_float
+from indicator_engine import indicator_engine
+from typing import Dict, Any, List, Tuple, Optional
+from utils import format_float, symbols, interval_to_seconds
 import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
+from single_flight import SingleFlight
+from metrics import span, timed
+import contextvars
+
+# Отдельный ограниченный пул для блокирующей работы анализа (TradingView, Binance, indicator_engine),
+# чтобы не занимать event loop и пул по умолчанию
+FORECAST_WORKERS = int(os.getenv("FORECAST_WORKERS", "6"))
+_forecast_executor = ThreadPoolExecutor(max_workers=FORECAST_WORKERS, thread_name_prefix="forecast")
+# Одновременные прогнозы одной пары на одной свече считаются один раз
+_forecast_flights = SingleFlight("forecast")
 
 def safe_float(val):
     try:
@@ -266,20 +275,118 @@ def smart_trade_signal(indicators: dict, price=None, support=None, resistance=No
         take_profit = stop_loss*2
     return {'signal': signal, 'leverage': leverage, 'stop_loss': stop_loss, 'take_profit': take_profit, 'reason': '', 'probability': probability, 'prob_direction': prob_direction}
 
-def get_forecast(symbol: str, interval: str) -> Dict[str, Any]:
+# --- Пакетный анализ TradingView ---
+# Один запрос к сканеру TradingView на все монеты из utils.symbols для таймфрейма.
+# interval -> ({symbol: Analysis}, момент истечения = закрытие текущей свечи)
+_ta_batch_cache: Dict[str, Tuple[Dict[str, Any], float]] = {}
+# interval -> (ошибка, до какого момента её отдавать без нового запроса)
+_ta_batch_failures: Dict[str, Tuple[Exception, float]] = {}
+_ta_batch_locks: Dict[str, threading.Lock] = {}
+_ta_batch_guard = threading.Lock()
+TA_TIMEOUT = float(os.getenv("TA_TIMEOUT", "10"))
+# Сколько секунд после ошибки TradingView запросы получают её сразу, не повторяя запрос
+TA_FAILURE_TTL = float(os.getenv("TA_FAILURE_TTL", "30"))
+
+
+class TradingViewUnavailable(RuntimeError):
+    """
+    Пакетный запрос TradingView недавно не удался; повтор — после TA_FAILURE_TTL.
+    """
+
+
+def _next_candle_close(interval: str) -> float:
+    seconds = interval_to_seconds(interval)
+    return (time.time() // seconds + 1) * seconds
+
+def get_batch_analysis(interval: str, force: bool = False) -> Dict[str, Any]:
     """
-    Получает прогноз по монете и таймфрейму с помощью TradingView TA_Handler.
+    Анализ TradingView для всех монет из utils.symbols одним запросом.
+    Результат кэшируется до закрытия текущей свечи таймфрейма, ошибка — на
+    TA_FAILURE_TTL секунд: пока TradingView недоступен, ожидающие потоки
+    получают TradingViewUnavailable, а не повторяют запрос по очереди.
+    :param force: Игнорировать кэш и запросить заново
+    :return: Словарь symbol -> Analysis (None, если по монете нет данных)
+    """
+    with _ta_batch_guard:
+        lock = _ta_batch_locks.setdefault(interval, threading.Lock())
+    # Пока один поток ходит в TradingView, остальные ждут его результат
+    with lock:
+        now = time.time()
+        cached = _ta_batch_cache.get(interval)
+        if cached and not force and cached[1] > now:
+            return cached[0]
+        failure = _ta_batch_failures.get(interval)
+        if failure and not force and failure[1] > now:
+            raise TradingViewUnavailable(f"TradingView недоступен ({interval}): {failure[0]}")
+        logging.info(f"[ANALYSIS] Пакетный запрос TradingView: {len(symbols)} монет @ {interval}")
+        try:
+            with span("ta_batch_analysis", symbol="*", timeframe=interval):
+                result = get_multiple_analysis(
+                    screener="crypto",
+                    interval=interval,
+                    symbols=[f"BINANCE:{s}" for s in symbols],
+                    timeout=TA_TIMEOUT
+                )
+        except Exception as e:
+            _ta_batch_failures[interval] = (e, time.time() + TA_FAILURE_TTL)
+            logging.warning(f"[ANALYSIS] Пакетный запрос TradingView @ {interval} не удался, повтор не раньше чем через {TA_FAILURE_TTL:.0f} с: {e}")
+            raise
+        _ta_batch_failures.pop(interval, None)
+        batch = {key.split(":", 1)[1]: analysis for key, analysis in result.items()}
+        _ta_batch_cache[interval] = (batch, _next_candle_close(interval))
+        return batch
+
+async def get_batch_analysis_async(interval: str, force: bool = False) -> Dict[str, Any]:
+    """
+    Неблокирующий get_batch_analysis (в пуле анализа).
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_forecast_executor, contextvars.copy_context().run, get_batch_analysis, interval, force)
+
+def get_symbol_analysis(symbol: str, interval: str):
+    """
+    Анализ TradingView по одной монете: из пакетного кэша, если монета есть в
+    utils.symbols, иначе отдельным запросом через TA_Handler. Если пакетный
+    запрос недавно не удался, сразу поднимает TradingViewUnavailable.
+    """
+    if symbol in symbols:
+        try:
+            analysis = get_batch_analysis(interval).get(symbol)
+            if analysis is not None:
+                return analysis
+        except TradingViewUnavailable:
+            # TradingView только что не ответил — отдельный запрос по монете тоже будет ждать таймаут
+            raise
+        except Exception as e:
+            logging.warning(f"[ANALYSIS] Пакетный запрос TradingView не удался, запрашиваю {symbol} отдельно: {e}")
+    handler = TA_Handler(
+        symbol=symbol,
+        screener="crypto",
+        exchange="BINANCE",
+        interval=interval
+    )
+    with span("ta_get_analysis", symbol, interval):
+        return handler.get_analysis()
+
+def _closed_candles(df: pd.DataFrame, interval: str) -> pd.DataFrame:
+    """
+    Свечи без последней, если она ещё не закрылась (если в кадре есть другие).
+    """
+    last_close = df.index[-1].timestamp() + interval_to_seconds(interval)
+    if last_close > time.time() and len(df) > 1:
+        return df.iloc[:-1]
+    return df
+
+@timed("get_forecast", timeframe="interval")
+def get_forecast(symbol: str, interval: str, df: Optional[pd.DataFrame] = None) -> Dict[str, Any]:
+    """
+    Получает прогноз по монете и таймфрейму по данным TradingView (пакетный кэш get_batch_analysis).
     Возвращает словарь с текстом и индикаторами.
+    :param df: Уже загруженные свечи (300 шт.); если не переданы — загружаются через get_ohlcv
     """
     logging.info(f"[ANALYSIS] Запрос анализа {symbol} @ {interval}")
     try:
-        handler = TA_Handler(
-            symbol=symbol,
-            screener="crypto",
-            exchange="BINANCE",
-            interval=interval
-        )
-        analysis = handler.get_analysis()
+        analysis = get_symbol_analysis(symbol, interval)
         if not analysis:
             return {"text": "Нет данных по монете.", "indicators": {}}
         logging.info(f"INDICATORS: {analysis.indicators}")
@@ -296,12 +403,16 @@ def get_forecast(symbol: str, interval: str) -> Dict[str, Any]:
         ma_sell = analysis.moving_averages.get("SELL", 0)
         trend = "\U0001F4C8 Бычий" if ma_buy > ma_sell else "\U0001F4C9 Медвежий"
         seven_days_signal = get_seven_days_signal(symbol, interval)
-        from charting import get_ohlcv
         try:
-            df = get_ohlcv(symbol, interval, limit=300)
+            if df is None:
+                from charting import get_ohlcv
+                df = get_ohlcv(symbol, interval, limit=300)
             if df is not None and len(df) > 0:
-                volume = format_float(df["volume"].iloc[-1])
-                avg_volume = format_float(df["volume"].mean())
+                # Объём — по закрытым свечам, как при калибровке signal_model и в бэктесте:
+                # у незакрытой свечи объём ещё набирается и голос смещён к продаже
+                closed = _closed_candles(df, interval)
+                volume = format_float(closed["volume"].iloc[-1])
+                avg_volume = format_float(closed["volume"].mean())
                 price = safe_scalar_float(df["close"].iloc[-1])
                 support_val = df["low"].min()
                 if hasattr(support_val, 'item'):
@@ -311,43 +422,28 @@ def get_forecast(symbol: str, interval: str) -> Dict[str, Any]:
                 if hasattr(resistance_val, 'item'):
                     resistance_val = resistance_val.item()
                 resistance = safe_scalar_float(resistance_val)
-                # EMA 50/100/200
-                ema_50 = get_ema(df, 50)
-                ema_100 = get_ema(df, 100)
-                ema_200 = get_ema(df, 200)
+                # EMA 50/100/200, ATR, SuperTrend, PSAR — из потокового состояния ряда
+                with span("indicators", symbol, interval):
+                    engine_values = indicator_engine.update_frame(symbol, interval, df)
+                ema_50 = engine_values["EMA50"]
+                ema_100 = engine_values["EMA100"]
+                ema_200 = engine_values["EMA200"]
+                atr = engine_values["ATR"]
+                supertrend = engine_values["SuperTrend"]
+                psar_signal = engine_values["PSAR"]
             else:
                 volume = "—"
                 avg_volume = "—"
                 price = support = resistance = None
                 ema_50 = ema_100 = ema_200 = 'Недостаточно данных'
-        except Exception:
+                atr = supertrend = psar_signal = None
+        except Exception as e:
+            logging.warning(f"[TA] Ошибка расчёта индикаторов: {e}")
             volume = "—"
             avg_volume = "—"
             price = support = resistance = None
             ema_50 = ema_100 = ema_200 = 'Недостаточно данных'
-        # --- Новые индикаторы ---
-        try:
-            if PANDAS_TA_AVAILABLE and not df.empty:
-                # ATR
-                atr_val = df.ta.atr(length=14).iloc[-1]
-                atr = float(atr_val) if pd.notnull(atr_val) else None
-                # SuperTrend
-                st = df.ta.supertrend(length=10, multiplier=3.0)
-                supertrend_dir = st[f'SUPERTd_10_3.0'].iloc[-1] if f'SUPERTd_10_3.0' in st else None
-                supertrend = 'BUY' if supertrend_dir == 1 else ('SELL' if supertrend_dir == -1 else None)
-                # Parabolic SAR
-                psar = df.ta.psar(step=0.02, max_step=0.2)
-                psar_dir = psar['PSARd_0.02_0.2'].iloc[-1] if 'PSARd_0.02_0.2' in psar else None
-                psar_signal = 'BUY' if psar_dir == 1 else ('SELL' if psar_dir == -1 else None)
-            else:
-                atr = None
-                supertrend = None
-                psar_signal = None
-        except Exception as e:
-            logging.warning(f"[TA] Ошибка расчёта ATR/SuperTrend/PSAR: {e}")
-            atr = None
-            supertrend = None
-            psar_signal = None
+            atr = supertrend = psar_signal = None
         indicators = {
             "recommendation": r,
             "SevenDays": seven_days_signal,
@@ -405,6 +501,38 @@ def get_forecast(symbol: str, interval: str) -> Dict[str, Any]:
         logging.exception(f"Ошибка анализа {symbol}: {e}")
         return {"text": f"Ошибка анализа: {e}", "indicators": {}}
 
+async def get_forecast_async(symbol: str, interval: str, df: Optional[pd.DataFrame] = None) -> Dict[str, Any]:
+    """
+    Неблокирующий get_forecast: выполняется в отдельном пуле потоков.
+    Одновременные запросы той же пары на том же снимке свечей ждут один общий расчёт.
+    """
+    loop = asyncio.get_running_loop()
+    if df is None:
+        snapshot = _next_candle_close(interval)
+    elif df.empty:
+        snapshot = ("empty",)
+    else:
+        # Прогноз должен быть посчитан по тому же кадру, что загрузил и нарисовал вызывающий
+        snapshot = (len(df), int(df.index[-1].timestamp() * 1000), float(df["close"].iloc[-1]), float(df["volume"].iloc[-1]))
+    key = (symbol.upper(), interval, snapshot)
+    # Контекст копируется, чтобы замеры в потоке получили метки запроса (обработчик)
+    result = await _forecast_flights.do(
+        key,
+        lambda: loop.run_in_executor(_forecast_executor, contextvars.copy_context().run, get_forecast, symbol, interval, df)
+    )
+    # Копия: результат общий для ожидающих, а вызывающий код может его дополнять
+    return {**result, "indicators": dict(result.get("indicators", {}))}
+
+async def get_forecasts_async(symbol: str, intervals: List[str], frames: Optional[Dict[str, pd.DataFrame]] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    Параллельно получает прогнозы по всем таймфреймам: общее время равно
+    самому медленному таймфрейму, а не сумме.
+    :param frames: Уже загруженные свечи по таймфреймам (необязательно)
+    """
+    frames = frames or {}
+    results = await asyncio.gather(*(get_forecast_async(symbol, tf, frames.get(tf)) for tf in intervals))
+    return dict(zip(intervals, results))
+
 def generate_signal(indicators: Dict[str, Any]) -> str:
     """
     Генерирует торговый сигнал на основе индикаторов.
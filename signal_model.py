@@ -0,0 +1,336 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+# Локальная модель направления и вероятности: голоса индикаторов из
+# smart_trade_signal (+1 за лонг, -1 за шорт, 0 — нет голоса) с весами
+# логистической регрессии. Веса калибруются офлайн на истории из архива
+# свечей (python signal_model.py ...) и читаются из SIGNAL_MODEL_PATH; без
+# файла — равные веса, то есть простое голосование. Ответ считается за
+# микросекунды, без запроса к LLM.
+
+# Режим анализа таймфрейма: "llm" — вывод, направление и вероятность от LLM
+# (модель подставляется, если LLM не дала направление); "local" — всё локально,
+# без LLM. "local" включается только с откалиброванной моделью, иначе — "llm".
+ANALYSIS_MODE = os.getenv("ANALYSIS_MODE", "llm")
+SIGNAL_MODEL_PATH = os.getenv("SIGNAL_MODEL_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "signal_model.json"))
+
+# Порядок голосов — как в smart_trade_signal
+FEATURES = ("RSI", "MACD", "EMA", "volume", "SuperTrend", "PSAR")
+FEATURE_NAMES = {
+    "RSI": "RSI",
+    "MACD": "MACD",
+    "EMA": "EMA 50/100/200",
+    "volume": "объём",
+    "SuperTrend": "SuperTrend",
+    "PSAR": "PSAR"
+}
+# Пороги RSI из smart_trade_signal
+RSI_LONG, RSI_SHORT = 35, 65
+# Окно среднего объёма — как avg_volume в get_forecast (300 свечей)
+VOLUME_WINDOW = 300
+# Веса по умолчанию (до калибровки): все голоса равны
+DEFAULT_WEIGHT = 0.35
+# Границы вероятности в ответе — как в промпте LLM
+MIN_PROBABILITY, MAX_PROBABILITY = 50, 95
+
+
+def _to_float(value) -> Optional[float]:
+    try:
+        if value in (None, "-", "—", "Недостаточно данных"):
+            return None
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _side(value) -> float:
+    if value == 'BUY':
+        return 1.0
+    if value == 'SELL':
+        return -1.0
+    return 0.0
+
+
+def vote_vector(indicators: dict) -> np.ndarray:
+    """
+    Голоса индикаторов одного таймфрейма (формат get_forecast) по правилам smart_trade_signal.
+    """
+    rsi = _to_float(indicators.get('RSI'))
+    macd = _to_float(indicators.get('MACD'))
+    ema50 = _to_float(indicators.get('EMA50'))
+    ema100 = _to_float(indicators.get('EMA100'))
+    ema200 = _to_float(indicators.get('EMA200'))
+    volume = _to_float(indicators.get('volume'))
+    avg_volume = _to_float(indicators.get('avg_volume'))
+    votes = np.zeros(len(FEATURES))
+    if rsi is not None:
+        votes[0] = 1.0 if rsi < RSI_LONG else -1.0 if rsi > RSI_SHORT else 0.0
+    if macd is not None:
+        votes[1] = np.sign(macd)
+    if ema50 and ema100 and ema200:
+        votes[2] = 1.0 if ema50 > ema100 > ema200 else -1.0 if ema50 < ema100 < ema200 else 0.0
+    if volume is not None and avg_volume is not None:
+        votes[3] = np.sign(volume - avg_volume)
+    votes[4] = _side(indicators.get('SuperTrend'))
+    votes[5] = _side(indicators.get('PSAR'))
+    return votes
+
+
+def vote_matrix(arrays: Dict[str, np.ndarray], indicators: Dict[str, np.ndarray]) -> np.ndarray:
+    """
+    Голоса на каждой свече истории: матрицы монета × время -> массив монета × время × len(FEATURES).
+    :param arrays: Свечи (batch_indicators.stack_frames)
+    :param indicators: Индикаторы (batch_indicators.compute_indicators)
+    """
+    close = arrays["close"]
+    volume = arrays["volume"]
+    # Свечей истории к моменту t — EMA до накопления периода не голосуют (как NOT_ENOUGH_DATA)
+    seen = np.cumsum(~np.isnan(close), axis=1)
+    rsi = indicators["RSI"]
+    macd = np.nan_to_num(indicators["MACD"])
+    ema50, ema100, ema200 = indicators["EMA50"], indicators["EMA100"], indicators["EMA200"]
+    ema_ready = seen >= 200
+    filled = np.nan_to_num(volume)
+    counts = np.minimum(seen, VOLUME_WINDOW)
+    sums = np.cumsum(filled, axis=1)
+    sums[:, VOLUME_WINDOW:] -= sums[:, :-VOLUME_WINDOW].copy()
+    with np.errstate(invalid="ignore", divide="ignore"):
+        avg_volume = np.where(counts > 0, sums / counts, np.nan)
+        votes = np.stack([
+            np.where(rsi < RSI_LONG, 1.0, np.where(rsi > RSI_SHORT, -1.0, 0.0)),
+            np.sign(macd),
+            np.where(ema_ready & (ema50 > ema100) & (ema100 > ema200), 1.0,
+                     np.where(ema_ready & (ema50 < ema100) & (ema100 < ema200), -1.0, 0.0)),
+            np.nan_to_num(np.sign(volume - avg_volume)),
+            np.nan_to_num(indicators["SuperTrend"]),
+            np.nan_to_num(indicators["PSAR"])
+        ], axis=-1)
+    return votes
+
+
+def _sigmoid(z: np.ndarray) -> np.ndarray:
+    return 1.0 / (1.0 + np.exp(-np.clip(z, -30, 30)))
+
+
+class SignalModel:
+    """
+    Вероятность роста цены через horizon свечей: sigmoid(bias + weights · голоса).
+    """
+
+    def __init__(self, weights: Optional[np.ndarray] = None, bias: float = 0.0, meta: Optional[dict] = None):
+        self.weights = np.full(len(FEATURES), DEFAULT_WEIGHT) if weights is None else np.asarray(weights, dtype=float)
+        self.bias = float(bias)
+        self.meta = meta or {}
+
+    @property
+    def calibrated(self) -> bool:
+        """
+        Веса получены калибровкой на истории (а не веса по умолчанию).
+        """
+        return bool(self.meta.get("samples"))
+
+    def predict_proba(self, votes: np.ndarray) -> np.ndarray:
+        """
+        Вероятность лонга для голосов любой формы (..., len(FEATURES)).
+        """
+        return _sigmoid(votes @ self.weights + self.bias)
+
+    def predict(self, indicators: dict) -> dict:
+        """
+        Направление и вероятность в формате generate_timeframe_analysis.
+        :return: {"comment": str, "direction": "ЛОНГ"/"ШОРТ", "probability": int}
+        """
+        votes = vote_vector(indicators)
+        p_long = float(self.predict_proba(votes))
+        direction = "ЛОНГ" if p_long >= 0.5 else "ШОРТ"
+        probability = int(round(100 * max(p_long, 1 - p_long)))
+        probability = min(max(probability, MIN_PROBABILITY), MAX_PROBABILITY)
+        return {
+            "comment": self.explain(votes, direction),
+            "direction": direction,
+            "probability": probability
+        }
+
+    def explain(self, votes: np.ndarray, direction: str) -> str:
+        """
+        Короткий вывод без LLM: какие индикаторы за выбранное направление и какие против.
+        """
+        sign = 1.0 if direction == "ЛОНГ" else -1.0
+        contributions = votes * self.weights * sign
+        pro = [FEATURE_NAMES[f] for f, c in zip(FEATURES, contributions) if c > 0]
+        contra = [FEATURE_NAMES[f] for f, c in zip(FEATURES, contributions) if c < 0]
+        side = "лонг" if direction == "ЛОНГ" else "шорт"
+        if not pro:
+            return "Явного перевеса нет, индикаторы не дают сигнала."
+        text = f"За {side}: {', '.join(pro)}."
+        if contra:
+            text += f" Против: {', '.join(contra)}."
+        return text
+
+    def to_dict(self) -> dict:
+        return {
+            "features": list(FEATURES),
+            "weights": [round(float(w), 6) for w in self.weights],
+            "bias": round(self.bias, 6),
+            "meta": self.meta
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "SignalModel":
+        if list(data.get("features", [])) != list(FEATURES):
+            raise ValueError(f"Набор голосов модели {data.get('features')} не совпадает с {list(FEATURES)}")
+        return cls(np.asarray(data["weights"], dtype=float), data.get("bias", 0.0), data.get("meta"))
+
+
+def fit(votes: np.ndarray, labels: np.ndarray, l2: float = 1.0, iterations: int = 25) -> SignalModel:
+    """
+    Логистическая регрессия методом Ньютона (IRLS) с L2 на весах.
+    :param votes: Матрица примеров n × len(FEATURES)
+    :param labels: 1 — цена выросла, 0 — упала
+    """
+    X = np.hstack([votes, np.ones((len(votes), 1))])
+    beta = np.zeros(X.shape[1])
+    penalty = np.full(X.shape[1], l2)
+    penalty[-1] = 0.0
+    for _ in range(iterations):
+        p = _sigmoid(X @ beta)
+        gradient = X.T @ (p - labels) + penalty * beta
+        hessian = (X * (p * (1 - p))[:, None]).T @ X + np.diag(penalty) + 1e-9 * np.eye(X.shape[1])
+        step = np.linalg.solve(hessian, gradient)
+        beta -= step
+        if np.max(np.abs(step)) < 1e-8:
+            break
+    return SignalModel(beta[:-1], beta[-1])
+
+
+def calibrate(frames: Dict[str, pd.DataFrame], horizon: int = 4, warmup: int = 200, l2: float = 1.0) -> SignalModel:
+    """
+    Калибрует веса на истории: пример — голоса на закрытии свечи t, метка — close[t + horizon] > close[t].
+    :param frames: {монета: свечи}
+    :param horizon: Через сколько свечей оценивается направление
+    :param warmup: Сколько первых свечей пропустить, пока индикаторы не разогрелись
+    """
+    from batch_indicators import stack_frames, compute_indicators
+    names, _, arrays = stack_frames(frames)
+    if not names:
+        raise ValueError("Нет свечей для калибровки")
+    votes = vote_matrix(arrays, compute_indicators(arrays))
+    close = arrays["close"]
+    future = np.full(close.shape, np.nan)
+    future[:, :-horizon] = close[:, horizon:]
+    seen = np.cumsum(~np.isnan(close), axis=1)
+    mask = (seen > warmup) & ~np.isnan(close) & ~np.isnan(future) & (future != close)
+    X = votes[mask]
+    y = (future[mask] > close[mask]).astype(float)
+    if len(y) == 0:
+        raise ValueError("Слишком короткая история для калибровки")
+    model = fit(X, y, l2=l2)
+    p = model.predict_proba(X)
+    hit_rate = float(np.mean((p >= 0.5) == (y == 1)))
+    log_loss = float(-np.mean(y * np.log(p + 1e-12) + (1 - y) * np.log(1 - p + 1e-12)))
+    model.meta = {
+        "symbols": names,
+        "horizon": horizon,
+        "samples": int(len(y)),
+        "base_rate": round(float(y.mean()), 4),
+        "hit_rate": round(hit_rate, 4),
+        "log_loss": round(log_loss, 4)
+    }
+    return model
+
+
+def save_model(model: SignalModel, path: str = SIGNAL_MODEL_PATH) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(model.to_dict(), f, ensure_ascii=False, indent=2)
+
+
+def load_model(path: str = SIGNAL_MODEL_PATH) -> SignalModel:
+    """
+    Откалиброванная модель из файла; если файла нет или он не читается — веса по умолчанию.
+    """
+    if not os.path.exists(path):
+        logging.info(f"[MODEL] {path} не найден — веса по умолчанию")
+        return SignalModel()
+    try:
+        with open(path, encoding="utf-8") as f:
+            model = SignalModel.from_dict(json.load(f))
+        logging.info(f"[MODEL] Загружена модель {path}: {model.meta}")
+        return model
+    except Exception as e:
+        logging.warning(f"[MODEL] Не удалось загрузить {path}: {e} — веса по умолчанию")
+        return SignalModel()
+
+
+_model: Optional[SignalModel] = None
+_mode_warned = False
+
+
+def get_model() -> SignalModel:
+    global _model
+    if _model is None:
+        _model = load_model()
+    return _model
+
+
+def analysis_mode() -> str:
+    """
+    Действующий режим анализа: ANALYSIS_MODE, но "local" — только при откалиброванной модели.
+    """
+    global _mode_warned
+    if ANALYSIS_MODE == "local" and not get_model().calibrated:
+        if not _mode_warned:
+            _mode_warned = True
+            logging.warning(f"[MODEL] ANALYSIS_MODE=local, но откалиброванной модели {SIGNAL_MODEL_PATH} нет — анализ через LLM")
+        return "llm"
+    return ANALYSIS_MODE
+
+
+def local_analysis(indicators: dict) -> dict:
+    """
+    Анализ таймфрейма без LLM: {"comment", "direction", "probability"}.
+    """
+    return get_model().predict(indicators)
+
+
+async def load_history(symbols: List[str], interval: str, limit: int) -> Dict[str, pd.DataFrame]:
+    """
+    Последние limit свечей по монетам из архива свечей (недостающее догружается с Binance).
+    """
+    from binance_client import close_binance_client
+    from kline_archive import read_recent
+    try:
+        frames = await asyncio.gather(*(read_recent(s, interval, limit) for s in symbols))
+    finally:
+        await close_binance_client()
+    return dict(zip(symbols, frames))
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    from utils import symbols as default_symbols, interval_to_seconds
+    parser = argparse.ArgumentParser(description="Калибровка локальной модели направления на истории из архива свечей")
+    parser.add_argument("--interval", default="1h")
+    parser.add_argument("--days", type=int, default=365, help="глубина истории в днях")
+    parser.add_argument("--horizon", type=int, default=4, help="через сколько свечей оценивать направление")
+    parser.add_argument("--l2", type=float, default=1.0)
+    parser.add_argument("--symbols", nargs="*", default=default_symbols)
+    parser.add_argument("--output", default=SIGNAL_MODEL_PATH)
+    args = parser.parse_args(argv)
+    limit = args.days * 86_400 // interval_to_seconds(args.interval)
+    frames = asyncio.run(load_history(args.symbols, args.interval, limit))
+    model = calibrate(frames, horizon=args.horizon, l2=args.l2)
+    model.meta["interval"] = args.interval
+    model.meta["candles"] = {s: len(df) for s, df in frames.items()}
+    save_model(model, args.output)
+    print(json.dumps(model.to_dict(), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s | %(levelname)s | %(message)s')
+    main()
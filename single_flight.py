@@ -0,0 +1,69 @@
+import asyncio
+import logging
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, List
+
+# Склейка одинаковых одновременных запросов (single-flight): пока вычисление
+# по ключу (symbol, timeframe, свеча, ...) выполняется, остальные запросы с
+# тем же ключом ждут его результат, а не запускают своё. Нагрузка в пиках
+# растёт с числом разных монет, а не с числом пользователей.
+
+_groups: List["SingleFlight"] = []
+_groups_lock = threading.Lock()
+
+
+class SingleFlight:
+    """
+    Группа склеиваемых вызовов одного вида (свечи, прогноз, график, LLM).
+    Вычисление выполняется отдельной задачей: отмена одного ожидающего
+    (например, пользователь ушёл) не отменяет её для остальных.
+    Ключ удаляется сразу по завершении — результат дальше хранят обычные кэши.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._flights: Dict[Hashable, asyncio.Task] = {}
+        self._stats = {"calls": 0, "shared": 0}
+        with _groups_lock:
+            _groups.append(self)
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Результат func() для ключа; если такой же вызов уже идёт — ждёт его.
+        Ошибка вычисления получают все ожидающие.
+        """
+        self._stats["calls"] += 1
+        task = self._flights.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._flights[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        else:
+            self._stats["shared"] += 1
+            logging.debug(f"[SINGLE_FLIGHT] {self.name}: ждём уже идущий запрос {key}")
+        return await asyncio.shield(task)
+
+    def _done(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._flights.get(key) is task:
+            del self._flights[key]
+        # Исключение забирают ожидающие; если их не осталось — не теряем его молча
+        if not task.cancelled() and task.exception() is not None:
+            logging.debug(f"[SINGLE_FLIGHT] {self.name}: ошибка запроса {key}: {task.exception()}")
+
+    def stats(self) -> dict:
+        calls = self._stats["calls"]
+        shared = self._stats["shared"]
+        return {
+            "calls": calls,
+            "shared": shared,
+            "in_flight": len(self._flights),
+            "share_rate": round(shared / calls, 3) if calls else 0.0
+        }
+
+
+def get_single_flight_stats() -> dict:
+    """
+    Статистика склейки по всем группам: сколько вызовов дождались чужого результата.
+    """
+    with _groups_lock:
+        return {group.name: group.stats() for group in _groups}
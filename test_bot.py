@@ -29,7 +29,7 @@ def test_imports():
         return False
     
     try:
-        from charting import generate_chart
+        from charting import generate_chart_async
         print("✅ charting импортирован успешно")
     except ImportError as e:
         print(f"❌ Ошибка импорта charting: {e}")
@@ -64,20 +64,18 @@ def test_tradingview():
         print(f"❌ Ошибка TradingView: {e}")
         return False
 
-def test_charting():
+async def test_charting():
     """Тестирует генерацию графиков"""
     print("\n📈 Тестирование генерации графиков...")
     
     try:
-        from charting import generate_chart
+        from charting import generate_chart_async
         
-        # Тестируем с BTCUSDT
-        chart_path = generate_chart("BTCUSDT", interval_binance="15m", output_path="test_chart.png")
+        # Тестируем с BTCUSDT: PNG в памяти, без файлов
+        png = await generate_chart_async("BTCUSDT", interval_binance="15m")
         
-        if os.path.exists(chart_path):
-            print(f"✅ График создан: {chart_path}")
-            # Удаляем тестовый файл
-            os.remove(chart_path)
+        if png:
+            print(f"✅ График создан: {len(png)} байт")
             return True
         else:
             print("❌ График не создан")
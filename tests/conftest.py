@@ -0,0 +1,33 @@
+import gzip
+import json
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# Модули бота читают настройки при импорте: без сети, фоновых задач и пула процессов
+os.environ.setdefault("TOGETHER_API_KEY", "test")
+os.environ.setdefault("BOT_TOKEN", "123456789:AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA")
+os.environ.setdefault("KLINE_STREAM_ENABLED", "0")
+os.environ.setdefault("KLINE_ARCHIVE_ENABLED", "0")
+os.environ.setdefault("CHART_WORKERS", "0")
+os.environ.setdefault("METRICS_PORT", "0")
+
+FIXTURES_DIR = os.path.join(ROOT, "benchmarks", "fixtures")
+
+
+@pytest.fixture(scope="session")
+def klines():
+    """
+    Записанные свечи BTCUSDT 15m (сырой ответ Binance) из фикстур бенчмарков.
+    """
+    with gzip.open(os.path.join(FIXTURES_DIR, "klines_BTCUSDT_15m.json.gz"), "rt") as f:
+        return json.load(f)
+
+
+@pytest.fixture(scope="session")
+def candles(klines):
+    from charting import _klines_to_store
+    return _klines_to_store(klines, "15m", len(klines)).frame(len(klines))
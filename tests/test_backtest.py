@@ -0,0 +1,84 @@
+"""
+Бэктест: выходы по SL/TP и по времени, одна позиция за раз и совпадение
+сигнала signal_matrix с smart_trade_signal на тех же голосах и тренде.
+"""
+import itertools
+
+import numpy as np
+import pytest
+
+import backtest
+from services import smart_trade_signal
+from signal_model import vote_vector, FEATURES
+
+MAX_HOLD = 5
+
+
+def flat_market(n: int = 12, price: float = 100.0):
+    return np.full(n, price), np.full(n, price), np.full(n, price)
+
+
+def exit_of(high, low, close, side: int, stop: float = 1.0) -> dict:
+    exits = backtest.simulate_exits(high, low, close, np.array([0]), np.array([float(side)]), np.array([stop]), MAX_HOLD)
+    return {k: v[0] for k, v in exits.items()}
+
+
+def test_stop_loss_before_take_profit():
+    high, low, close = flat_market()
+    low[2] = 98.5
+    high[3] = 103.0
+    assert exit_of(high, low, close, 1) == {"exit": 2, "price": 99.0, "reason": -1}
+
+
+def test_take_profit_before_stop_loss_on_a_short():
+    high, low, close = flat_market()
+    low[3] = 97.5
+    high[4] = 101.5
+    assert exit_of(high, low, close, -1) == {"exit": 3, "price": 98.0, "reason": 1}
+
+
+@pytest.mark.parametrize("side", [1, -1])
+def test_stop_and_target_in_one_candle_count_as_stop(side):
+    high, low, close = flat_market()
+    high[2], low[2] = 103.0, 97.0
+    assert exit_of(high, low, close, side) == {"exit": 2, "price": 100.0 - side, "reason": -1}
+
+
+def test_timeout_exits_at_the_close_after_max_hold():
+    high, low, close = flat_market()
+    close[MAX_HOLD] = high[MAX_HOLD] = 101.5
+    # Уровни после max_hold свечей уже не проверяются
+    low[MAX_HOLD + 1] = 90.0
+    assert exit_of(high, low, close, 1) == {"exit": MAX_HOLD, "price": 101.5, "reason": 0}
+
+
+def test_sequential_skips_entries_while_a_position_is_open():
+    entries = np.array([0, 1, 2, 5, 6, 9, 10])
+    exits = np.array([3, 4, 5, 8, 7, 10, 12])
+    # Вход на свече выхода предыдущей сделки разрешён
+    assert backtest._sequential(entries, exits).tolist() == [0, 3, 5, 6]
+
+
+# Значения индикаторов, дающие голос 1 / -1 / 0 по каждому признаку
+VOTE_INPUTS = {
+    "RSI": {1: {"RSI": 30}, -1: {"RSI": 70}, 0: {"RSI": 50}},
+    "MACD": {1: {"MACD": 1.0}, -1: {"MACD": -1.0}, 0: {"MACD": 0.0}},
+    "EMA": {1: {"EMA50": 3, "EMA100": 2, "EMA200": 1}, -1: {"EMA50": 1, "EMA100": 2, "EMA200": 3},
+            0: {"EMA50": 2, "EMA100": 1, "EMA200": 3}},
+    "volume": {1: {"volume": 2, "avg_volume": 1}, -1: {"volume": 1, "avg_volume": 2}, 0: {"volume": 1, "avg_volume": 1}},
+    "SuperTrend": {1: {"SuperTrend": "BUY"}, -1: {"SuperTrend": "SELL"}, 0: {}},
+    "PSAR": {1: {"PSAR": "BUY"}, -1: {"PSAR": "SELL"}, 0: {}},
+}
+SIGNALS = {"BUY": 1, "SELL": -1, "HOLD": 0}
+
+
+def test_signal_matrix_matches_smart_trade_signal():
+    combos = np.array(list(itertools.product((1, -1, 0), repeat=len(FEATURES))), dtype=float)
+    for bullish in (True, False):
+        signals = backtest.signal_matrix(combos[None], np.full((1, len(combos)), bullish))[0]
+        for votes, signal in zip(combos, signals):
+            indicators = {"trend": "📈 Бычий" if bullish else "📉 Медвежий"}
+            for feature, vote in zip(FEATURES, votes):
+                indicators.update(VOTE_INPUTS[feature][int(vote)])
+            assert vote_vector(indicators).tolist() == votes.tolist()
+            assert SIGNALS[smart_trade_signal(indicators)["signal"]] == signal, (votes, bullish)
@@ -0,0 +1,63 @@
+"""
+Пакетный запрос TradingView: пока он падает, ожидающие потоки получают ошибку
+из кэша, а не повторяют запрос каждый со своим таймаутом.
+"""
+import threading
+import time
+
+import pytest
+
+import services
+
+
+@pytest.fixture
+def batch_calls(monkeypatch):
+    calls = []
+
+    def get_multiple_analysis(screener, interval, symbols, timeout):
+        calls.append(interval)
+        time.sleep(0.05)
+        raise ConnectionError("timeout")
+
+    monkeypatch.setattr(services, "get_multiple_analysis", get_multiple_analysis)
+    monkeypatch.setattr(services, "_ta_batch_cache", {})
+    monkeypatch.setattr(services, "_ta_batch_failures", {})
+    return calls
+
+
+def test_failure_is_shared_with_waiting_threads(batch_calls):
+    errors = []
+
+    def request():
+        try:
+            services.get_batch_analysis("15m")
+        except Exception as e:
+            errors.append(type(e))
+
+    threads = [threading.Thread(target=request) for _ in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert batch_calls == ["15m"]
+    assert sorted(errors, key=lambda e: e.__name__) == [ConnectionError] + [services.TradingViewUnavailable] * 4
+
+
+def test_failure_expires_after_ttl(batch_calls, monkeypatch):
+    monkeypatch.setattr(services, "TA_FAILURE_TTL", 0.0)
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            services.get_batch_analysis("1h")
+    assert batch_calls == ["1h", "1h"]
+
+
+def test_symbol_analysis_does_not_retry_while_unavailable(batch_calls, monkeypatch):
+    def handler(**kwargs):
+        raise AssertionError("отдельный запрос TA_Handler при недоступном TradingView")
+
+    with pytest.raises(ConnectionError):
+        services.get_batch_analysis("4h")
+    monkeypatch.setattr(services, "TA_Handler", handler)
+    with pytest.raises(services.TradingViewUnavailable):
+        services.get_symbol_analysis(services.symbols[0], "4h")
+    assert batch_calls == ["4h"]
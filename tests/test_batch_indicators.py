@@ -0,0 +1,53 @@
+"""
+Векторизованный compute_indicators (бэктест, калибровка signal_model) против
+эталонов pandas_ta из test_indicator_engine и против indicator_engine — в том
+числе для монеты с более короткой историей (дополнена NaN слева).
+"""
+import numpy as np
+import pytest
+
+from batch_indicators import stack_frames, compute_indicators
+from indicator_engine import IndicatorEngine, EMA_PERIODS
+from test_indicator_engine import reference_atr, reference_supertrend, reference_psar
+
+SHORT_OFFSET = 400
+
+
+@pytest.fixture(scope="module")
+def market(candles):
+    # Вторая монета: другой масштаб цены и история на SHORT_OFFSET свечей короче
+    short = candles.iloc[SHORT_OFFSET:].copy()
+    short[["open", "high", "low", "close"]] *= 0.05
+    frames = {"BTCUSDT": candles, "ETHUSDT": short}
+    names, _, arrays = stack_frames(frames)
+    return frames, names, compute_indicators(arrays)
+
+
+@pytest.mark.parametrize("row, symbol", [(0, "BTCUSDT"), (1, "ETHUSDT")])
+def test_matches_pandas_ta_references(market, row, symbol):
+    frames, names, indicators = market
+    assert names[row] == symbol
+    df = frames[symbol]
+    # Свечи этой монеты — в конце общей оси
+    part = slice(indicators["ATR"].shape[1] - len(df), None)
+    for p in EMA_PERIODS:
+        expected = df["close"].ewm(span=p, adjust=False).mean().to_numpy()
+        np.testing.assert_allclose(indicators[f"EMA{p}"][row, part], expected, rtol=1e-12)
+    np.testing.assert_allclose(indicators["ATR"][row, part], reference_atr(df).to_numpy(), rtol=1e-9)
+    assert indicators["SuperTrend"][row, part].tolist() == reference_supertrend(df)
+    # У первой свечи направления нет (NaN, в эталоне — 0)
+    assert indicators["PSAR"][row, part][1:].tolist() == reference_psar(df)[1:]
+    if row:
+        assert np.isnan(indicators["ATR"][row, :SHORT_OFFSET]).all()
+
+
+def test_last_candle_matches_indicator_engine(candles):
+    window = candles.iloc[-300:]
+    _, _, arrays = stack_frames({"BTCUSDT": window})
+    indicators = compute_indicators(arrays)
+    values = IndicatorEngine().update_frame("BTCUSDT", "15m", window)
+    for p in EMA_PERIODS:
+        assert values[f"EMA{p}"] == pytest.approx(indicators[f"EMA{p}"][0, -1], abs=0.0051)
+    assert values["ATR"] == pytest.approx(indicators["ATR"][0, -1], rel=1e-9)
+    assert values["SuperTrend"] == ("BUY" if indicators["SuperTrend"][0, -1] == 1 else "SELL")
+    assert values["PSAR"] == ("BUY" if indicators["PSAR"][0, -1] == 1 else "SELL")
@@ -0,0 +1,42 @@
+"""
+Сравнение результатов бенчмарков: регрессия медианы выше порога даёт код выхода 1.
+"""
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+
+import bench
+
+
+def report(**medians) -> dict:
+    return {"results": {key: {"median_s": value} for key, value in medians.items()}}
+
+
+def test_compare_passes_within_threshold(capsys):
+    assert bench.compare(report(a=1.0, b=2.0), report(a=1.15, b=1.0), threshold=0.2)
+    assert "быстрее" in capsys.readouterr().out
+
+
+def test_compare_flags_regression(capsys):
+    assert not bench.compare(report(a=1.0, b=2.0), report(a=1.0, b=2.5), threshold=0.2)
+    assert "РЕГРЕССИЯ" in capsys.readouterr().out
+
+
+def test_new_cases_are_not_regressions():
+    assert bench.compare(report(a=1.0), report(a=1.0, c=5.0), threshold=0.2)
+
+
+@pytest.mark.parametrize("new_median, code", [(1.1, 0), (1.5, 1)])
+def test_compare_cli_exit_code(tmp_path, monkeypatch, new_median, code):
+    old = tmp_path / "old.json"
+    new = tmp_path / "new.json"
+    old.write_text(json.dumps(report(**{"get_forecast/300": 1.0})), encoding="utf-8")
+    new.write_text(json.dumps(report(**{"get_forecast/300": new_median})), encoding="utf-8")
+    monkeypatch.setattr(sys, "argv", ["bench.py", "--compare", str(old), str(new), "--threshold", "0.2"])
+    with pytest.raises(SystemExit) as exit_info:
+        bench.main()
+    assert exit_info.value.code == code
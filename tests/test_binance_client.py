@@ -0,0 +1,78 @@
+"""
+Клиент свечей Binance: одна сессия и keep-alive соединение на все запросы,
+не больше max_concurrency запросов одновременно, close() закрывает сессию.
+"""
+import asyncio
+
+from aiohttp import web
+
+from binance_client import BinanceKlineClient
+
+
+async def serve(klines: list, delay: float = 0.0):
+    """
+    Локальный /api/v3/klines: отвечает последними limit свечами и запоминает
+    параметры запроса, порт клиента и пик одновременных запросов.
+    """
+    seen = {"params": [], "peers": set(), "active": 0, "peak": 0}
+
+    async def handler(request):
+        seen["params"].append(dict(request.query))
+        seen["peers"].add(request.transport.get_extra_info("peername")[1])
+        seen["active"] += 1
+        seen["peak"] = max(seen["peak"], seen["active"])
+        await asyncio.sleep(delay)
+        seen["active"] -= 1
+        return web.json_response(klines[-int(request.query["limit"]):])
+
+    app = web.Application()
+    app.router.add_get("/api/v3/klines", handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}", seen
+
+
+def test_requests_reuse_one_session_and_connection(klines):
+    async def scenario():
+        runner, url, seen = await serve(klines)
+        client = BinanceKlineClient(base_url=url)
+        try:
+            rows = await client.get_klines("btcusdt", "15m", limit=5)
+            session = client._session
+            await client.get_klines("BTCUSDT", "1h", limit=3, start_time=1700000000000.0, end_time=1700003600000)
+            assert client._session is session
+        finally:
+            await client.close()
+            await runner.cleanup()
+        assert session.closed and client._session is None
+        return rows, seen
+
+    rows, seen = asyncio.run(scenario())
+    assert rows == klines[-5:]
+    assert seen["params"] == [
+        {"symbol": "BTCUSDT", "interval": "15m", "limit": "5"},
+        {"symbol": "BTCUSDT", "interval": "1h", "limit": "3",
+         "startTime": "1700000000000", "endTime": "1700003600000"}
+    ]
+    # Второй запрос ушёл по тому же keep-alive соединению
+    assert len(seen["peers"]) == 1
+
+
+def test_concurrency_is_limited(klines):
+    async def scenario():
+        runner, url, seen = await serve(klines, delay=0.05)
+        client = BinanceKlineClient(base_url=url, max_concurrency=2)
+        try:
+            await asyncio.gather(*(client.get_klines("BTCUSDT", "15m", limit=1) for _ in range(6)))
+        finally:
+            await client.close()
+            await runner.cleanup()
+        return seen
+
+    seen = asyncio.run(scenario())
+    assert len(seen["params"]) == 6 and seen["peak"] == 2
+    # Соединения переиспользуются: открыто не больше, чем разрешено параллельно
+    assert len(seen["peers"]) <= 2
@@ -0,0 +1,39 @@
+"""
+Кадры из CandleStore и кэша свечей: изменения у одного вызывающего не видны другим.
+"""
+import asyncio
+
+import pandas as pd
+
+import charting
+from charting import _klines_to_store
+
+
+def test_frame_changes_do_not_leak_into_the_store(klines):
+    store = _klines_to_store(klines, "15m", 300)
+    df = store.frame(300)
+    close = df["close"].to_numpy().copy()
+    df["ema"] = df["close"].ewm(span=20).mean()
+    df.loc[df.index[-1], "close"] = 0.0
+    df.fillna(0, inplace=True)
+    again = store.frame(300)
+    assert "ema" not in again.columns
+    assert (again["close"].to_numpy() == close).all()
+
+
+def test_waiters_of_one_ohlcv_request_get_separate_frames(klines, monkeypatch):
+    async def fetch(symbol, timeframe, limit):
+        await asyncio.sleep(0.01)
+        return _klines_to_store(klines, timeframe, limit).frame(limit)
+
+    monkeypatch.setattr(charting, "_fetch_ohlcv_async", fetch)
+    monkeypatch.setattr(charting, "get_stream_frame", lambda symbol, interval, limit: None)
+    charting.clear_ohlcv_cache()
+
+    async def main():
+        return await asyncio.gather(*(charting.get_ohlcv_async("BTCUSDT", "15m", limit=300) for _ in range(3)))
+
+    first, second, third = asyncio.run(main())
+    first["close"] = 0.0
+    assert second["close"].iloc[-1] != 0.0
+    pd.testing.assert_frame_equal(second, third)
@@ -0,0 +1,83 @@
+"""
+Кэш готовых графиков: попадание на том же снимке свечей, промах при изменении
+последней свечи, уровней или STYLE_VERSION, вытеснение по общему объёму.
+"""
+import asyncio
+
+import pytest
+
+import charting
+
+
+@pytest.fixture
+def renders(monkeypatch):
+    calls = []
+
+    async def render_chart_async(df, levels=None, symbol="BTCUSDT"):
+        calls.append((len(df), levels))
+        return b"x" * 1000
+
+    monkeypatch.setattr(charting, "render_chart_async", render_chart_async)
+    charting.clear_chart_cache()
+    yield calls
+    charting.clear_chart_cache()
+
+
+def chart(df, levels=None) -> bytes:
+    return asyncio.run(charting.generate_chart_async("BTCUSDT", "15m", levels=levels, df=df))
+
+
+def test_same_snapshot_hits_the_cache(candles, renders):
+    df = candles.iloc[-200:]
+    chart(df, [90000.0, 95000.0])
+    # Тот же кадр другой копией и с более длинной историей: на графике те же свечи
+    chart(candles.iloc[-300:].copy(), [90000.0, 95000.0])
+    assert len(renders) == 1
+    assert charting.get_chart_cache_stats()["hits"] >= 1
+
+
+@pytest.mark.parametrize("column", ["close", "high", "low", "volume"])
+def test_live_candle_change_misses(candles, renders, column):
+    df = candles.iloc[-200:]
+    chart(df)
+    ticked = df.copy()
+    ticked.iloc[-1, ticked.columns.get_loc(column)] *= 1.001
+    chart(ticked)
+    assert len(renders) == 2
+
+
+def test_new_candle_and_levels_miss(candles, renders):
+    chart(candles.iloc[-201:-1])
+    chart(candles.iloc[-200:])
+    chart(candles.iloc[-200:], [90000.0, 95000.0])
+    chart(candles.iloc[-200:], [90000.0, 95500.0])
+    assert len(renders) == 4
+
+
+def test_style_version_bump_invalidates(candles, renders, monkeypatch):
+    df = candles.iloc[-200:]
+    chart(df)
+    monkeypatch.setattr(charting, "STYLE_VERSION", charting.STYLE_VERSION + 1)
+    chart(df)
+    chart(df)
+    assert len(renders) == 2
+
+
+def test_eviction_by_byte_budget(candles, renders, monkeypatch):
+    monkeypatch.setattr(charting, "CHART_CACHE_BYTES", 2500)
+    frames = [candles.iloc[-200 - i:len(candles) - i] for i in range(3)]
+    for df in frames:
+        chart(df)
+    stats = charting.get_chart_cache_stats()
+    assert (stats["entries"], stats["bytes"]) == (2, 2000)
+    # Самый старый вытеснен, два свежих на месте
+    chart(frames[2])
+    chart(frames[1])
+    assert len(renders) == 3
+    chart(frames[0])
+    assert len(renders) == 4
+    # Картинка больше всего бюджета не кэшируется
+    monkeypatch.setattr(charting, "CHART_CACHE_BYTES", 500)
+    chart(candles.iloc[-250:-50])
+    chart(candles.iloc[-250:-50])
+    assert len(renders) == 6
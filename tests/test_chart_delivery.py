@@ -0,0 +1,73 @@
+"""
+Счётчики file_id: загрузка считается один раз, в том числе при повторной
+загрузке после устаревшего file_id.
+"""
+import asyncio
+import itertools
+
+import pytest
+from aiogram import types
+from aiogram.utils.exceptions import BadRequest
+
+import chart_delivery
+
+_ids = itertools.count()
+
+
+def photo_message() -> types.Message:
+    return types.Message(photo=[{"file_id": f"file-{next(_ids)}", "file_unique_id": "u", "width": 1, "height": 1}])
+
+
+class FakeBot:
+    def __init__(self, reject_file_ids: bool = False):
+        self.reject_file_ids = reject_file_ids
+        self.sent = []
+
+    async def send_photo(self, chat_id, photo, caption=None, parse_mode=None):
+        if isinstance(photo, str) and self.reject_file_ids:
+            raise BadRequest("Wrong file identifier")
+        self.sent.append(photo)
+        return photo_message()
+
+    async def send_media_group(self, chat_id, media):
+        # Загружаемые файлы MediaGroup подставляет как attach://<имя>
+        photos = [item.media for item in media.media]
+        if self.reject_file_ids and any(not p.startswith("attach://") for p in photos):
+            raise BadRequest("Wrong file identifier")
+        self.sent.extend(photos)
+        return [photo_message() for _ in photos]
+
+
+@pytest.fixture(autouse=True)
+def clean_stats(monkeypatch):
+    monkeypatch.setattr(chart_delivery, "_file_ids", type(chart_delivery._file_ids)())
+    monkeypatch.setattr(chart_delivery, "_file_id_stats", {"hits": 0, "uploads": 0})
+
+
+def send(bot, monkeypatch, *charts):
+    monkeypatch.setattr(chart_delivery, "bot", bot)
+    return asyncio.run(chart_delivery.send_chart_group(1, list(charts)))
+
+
+def test_second_send_uses_file_id(monkeypatch):
+    chart = (b"png", "BTCUSDT", "15m", "")
+    send(FakeBot(), monkeypatch, chart)
+    send(FakeBot(), monkeypatch, chart)
+    stats = chart_delivery.get_file_id_stats()
+    assert (stats["uploads"], stats["hits"]) == (1, 1)
+
+
+def test_stale_file_id_counts_one_upload(monkeypatch):
+    chart = (b"png", "BTCUSDT", "15m", "")
+    send(FakeBot(), monkeypatch, chart)
+    send(FakeBot(reject_file_ids=True), monkeypatch, chart)
+    stats = chart_delivery.get_file_id_stats()
+    assert (stats["uploads"], stats["hits"]) == (2, 0)
+
+
+def test_stale_album_counts_each_upload_once(monkeypatch):
+    charts = [(b"a", "BTCUSDT", "15m", ""), (b"b", "BTCUSDT", "1h", "")]
+    send(FakeBot(), monkeypatch, *charts)
+    send(FakeBot(reject_file_ids=True), monkeypatch, *charts)
+    stats = chart_delivery.get_file_id_stats()
+    assert (stats["uploads"], stats["hits"]) == (4, 0)
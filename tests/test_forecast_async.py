@@ -0,0 +1,88 @@
+"""
+get_forecast_async: одновременные запросы склеиваются только на одном снимке
+свечей, и каждый получает свою копию результата; таймфреймы считаются
+параллельно в пуле потоков, не блокируя event loop.
+"""
+import asyncio
+import threading
+import time
+
+import pytest
+
+import services
+
+
+@pytest.fixture
+def forecasts(monkeypatch):
+    calls = []
+
+    def get_forecast(symbol, interval, df=None):
+        calls.append(None if df is None else float(df["close"].iloc[-1]))
+        time.sleep(0.05)
+        close = None if df is None else float(df["close"].iloc[-1])
+        return {"text": "", "indicators": {"close": close}}
+
+    monkeypatch.setattr(services, "get_forecast", get_forecast)
+    return calls
+
+
+def gather(*frames):
+    async def main():
+        return await asyncio.gather(*(services.get_forecast_async("BTCUSDT", "15m", df) for df in frames))
+    return asyncio.run(main())
+
+
+def test_same_frame_is_computed_once(forecasts, candles):
+    df = candles.iloc[-300:]
+    first, second = gather(df, df.copy())
+    assert forecasts == [float(df["close"].iloc[-1])]
+    assert first == second
+    first["indicators"]["final_signal"] = "BUY"
+    assert "final_signal" not in second["indicators"]
+
+
+def test_waiter_with_another_frame_gets_its_own_forecast(forecasts, candles):
+    older = candles.iloc[-301:-1]
+    live = candles.iloc[-300:].copy()
+    live.iloc[-1, live.columns.get_loc("close")] += 10
+    results = gather(older, live, candles.iloc[-300:])
+    assert [r["indicators"]["close"] for r in results] == [
+        float(older["close"].iloc[-1]), float(live["close"].iloc[-1]), float(candles["close"].iloc[-1])
+    ]
+    assert len(forecasts) == 3
+
+
+def test_timeframes_run_concurrently_off_the_loop(candles, monkeypatch):
+    threads = []
+
+    def get_forecast(symbol, interval, df=None):
+        threads.append(threading.current_thread().name)
+        time.sleep(0.1)
+        return {"text": interval, "indicators": {}}
+
+    monkeypatch.setattr(services, "get_forecast", get_forecast)
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        heartbeat = asyncio.ensure_future(ticker())
+        started = loop.time()
+        results = await asyncio.gather(*(services.get_forecast_async("BTCUSDT", tf, candles) for tf in ("15m", "1h", "4h")))
+        elapsed = loop.time() - started
+        heartbeat.cancel()
+        return results, elapsed, ticks
+
+    results, elapsed, ticks = asyncio.run(main())
+    assert [r["text"] for r in results] == ["15m", "1h", "4h"]
+    # Время — как у самого медленного таймфрейма, а не сумма трёх
+    assert elapsed < 0.2
+    # Event loop не блокировался, пока считались прогнозы
+    assert ticks >= 5
+    assert len(threads) == 3 and all(name.startswith("forecast") for name in threads)
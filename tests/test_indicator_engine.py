@@ -0,0 +1,152 @@
+"""
+Сверка indicator_engine с расчётом по DataFrame, который заменил движок:
+EMA — pandas ewm(adjust=False) (services.get_ema), ATR/SuperTrend/PSAR —
+pandas_ta 0.3.14b0. Эталонные функции ниже — построчный перенос кода pandas_ta
+(atr, supertrend, psar): сам pandas_ta не ставится с numpy 2, но если он есть,
+test_reference_matches_pandas_ta сверяет эталон и с ним.
+"""
+import math
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from indicator_engine import IndicatorEngine, EMA_PERIODS, ATR_LENGTH, SUPERTREND_LENGTH, SUPERTREND_MULTIPLIER, NOT_ENOUGH_DATA
+from services import get_ema
+
+
+def reference_atr(df: pd.DataFrame, length: int = ATR_LENGTH) -> pd.Series:
+    prev_close = df["close"].shift(1)
+    tr = pd.concat([df["high"] - df["low"], df["high"] - prev_close, prev_close - df["low"]], axis=1).abs().max(axis=1)
+    tr.iloc[:1] = np.nan
+    return tr.ewm(alpha=1.0 / length, min_periods=length).mean()
+
+
+def reference_supertrend(df: pd.DataFrame, length: int = SUPERTREND_LENGTH, multiplier: float = SUPERTREND_MULTIPLIER) -> list:
+    close = df["close"]
+    m = close.size
+    direction = [1] * m
+    hl2 = (df["high"] + df["low"]) / 2
+    matr = multiplier * reference_atr(df, length)
+    upper = (hl2 + matr).tolist()
+    lower = (hl2 - matr).tolist()
+    for i in range(1, m):
+        if close.iloc[i] > upper[i - 1]:
+            direction[i] = 1
+        elif close.iloc[i] < lower[i - 1]:
+            direction[i] = -1
+        else:
+            direction[i] = direction[i - 1]
+            if direction[i] > 0 and lower[i] < lower[i - 1]:
+                lower[i] = lower[i - 1]
+            if direction[i] < 0 and upper[i] > upper[i - 1]:
+                upper[i] = upper[i - 1]
+    return direction
+
+
+def reference_psar(df: pd.DataFrame, af0: float = 0.02, max_af: float = 0.2) -> list:
+    """
+    Направление SAR на каждой свече: 1 — под ценой (PSARl), -1 — над ценой (PSARs), 0 — первая свеча.
+    """
+    high, low = df["high"], df["low"]
+    up = high.iloc[1] - high.iloc[0]
+    dn = low.iloc[0] - low.iloc[1]
+    falling = bool(dn > up and dn > 0)
+    ep = low.iloc[0] if falling else high.iloc[0]
+    sar = df["close"].iloc[0]
+    af = af0
+    result = [0] * len(df)
+    for row in range(1, len(df)):
+        high_, low_ = high.iloc[row], low.iloc[row]
+        _sar = sar + af * (ep - sar)
+        if falling:
+            reverse = high_ > _sar
+            if low_ < ep:
+                ep = low_
+                af = min(af + af0, max_af)
+            # row - 2 при row = 1 в pandas_ta — последняя свеча ряда (iloc[-1])
+            _sar = max(high.iloc[row - 1], high.iloc[row - 2], _sar)
+        else:
+            reverse = low_ < _sar
+            if high_ > ep:
+                ep = high_
+                af = min(af + af0, max_af)
+            _sar = min(low.iloc[row - 1], low.iloc[row - 2], _sar)
+        if reverse:
+            _sar = ep
+            af = af0
+            falling = not falling
+            ep = low_ if falling else high_
+        sar = _sar
+        result[row] = -1 if falling else 1
+    return result
+
+
+def reference_values(df: pd.DataFrame) -> dict:
+    atr = reference_atr(df).iloc[-1]
+    return {
+        **{f"EMA{p}": get_ema(df, p) for p in EMA_PERIODS},
+        "ATR": None if math.isnan(atr) else float(atr),
+        "SuperTrend": 'BUY' if reference_supertrend(df)[-1] == 1 else 'SELL',
+        "PSAR": 'BUY' if reference_psar(df)[-1] == 1 else 'SELL'
+    }
+
+
+def assert_matches(values: dict, expected: dict) -> None:
+    for p in EMA_PERIODS:
+        key = f"EMA{p}"
+        if expected[key] == NOT_ENOUGH_DATA:
+            assert values[key] == NOT_ENOUGH_DATA
+        else:
+            # Оба значения округлены до центов: расходиться могут только на границе округления
+            assert values[key] == pytest.approx(expected[key], abs=0.0101), key
+    if expected["ATR"] is None:
+        assert values["ATR"] is None
+    else:
+        assert values["ATR"] == pytest.approx(expected["ATR"], rel=1e-9)
+    assert values["SuperTrend"] == expected["SuperTrend"]
+    assert values["PSAR"] == expected["PSAR"]
+
+
+@pytest.mark.parametrize("size", [30, 120, 300, 301, 1000])
+def test_update_frame_matches_reference_on_the_frame_passed_in(candles, size):
+    df = candles.iloc[-size:]
+    values = IndicatorEngine().update_frame("BTCUSDT", "15m", df)
+    assert_matches(values, reference_values(df))
+
+
+def test_streaming_updates_match_window_recomputation(candles):
+    engine = IndicatorEngine()
+    window = 300
+    engine.update_frame("BTCUSDT", "15m", candles.iloc[:window])
+    for end in range(window + 1, len(candles) + 1, 7):
+        df = candles.iloc[end - window:end]
+        assert_matches(engine.update_frame("BTCUSDT", "15m", df), reference_values(df))
+
+
+def test_shorter_frame_uses_its_own_window(candles):
+    engine = IndicatorEngine()
+    engine.update_frame("BTCUSDT", "15m", candles.iloc[-300:])
+    df = candles.iloc[-120:]
+    values = engine.update_frame("BTCUSDT", "15m", df)
+    assert values["EMA100"] == pytest.approx(get_ema(df, 100), abs=0.0101)
+    assert values["EMA200"] == NOT_ENOUGH_DATA
+    assert values["ATR"] == pytest.approx(reference_values(df)["ATR"], rel=1e-9)
+
+
+def test_longer_history_rebuilds_state(candles):
+    engine = IndicatorEngine()
+    engine.update_frame("BTCUSDT", "15m", candles.iloc[-100:])
+    df = candles.iloc[-300:]
+    assert_matches(engine.update_frame("BTCUSDT", "15m", df), reference_values(df))
+
+
+def test_reference_matches_pandas_ta(candles):
+    ta = pytest.importorskip("pandas_ta")
+    df = candles.iloc[-300:]
+    assert ta.atr(df["high"], df["low"], df["close"], length=ATR_LENGTH).iloc[-1] == pytest.approx(reference_atr(df).iloc[-1], rel=1e-9)
+    st = ta.supertrend(df["high"], df["low"], df["close"], length=SUPERTREND_LENGTH, multiplier=SUPERTREND_MULTIPLIER)
+    assert st[f"SUPERTd_{SUPERTREND_LENGTH}_{SUPERTREND_MULTIPLIER}"].tolist()[1:] == reference_supertrend(df)[1:]
+    psar = ta.psar(df["high"], df["low"], df["close"])
+    direction = np.where(psar["PSARl_0.02_0.2"].notna(), 1, np.where(psar["PSARs_0.02_0.2"].notna(), -1, 0))
+    assert direction.tolist() == reference_psar(df)
@@ -0,0 +1,147 @@
+"""
+Архив свечей на диске: дописывание без повторов, дозагрузка старой истории,
+восстановление после прерванной записи, срезы view() и дозагрузка при разрыве.
+"""
+import asyncio
+import os
+
+import numpy as np
+import pytest
+
+import kline_archive
+from candle_store import klines_to_arrays
+from kline_archive import KlineArchive
+
+
+@pytest.fixture
+def arrays(klines):
+    return klines_to_arrays(klines[:200])
+
+
+@pytest.fixture
+def archive(tmp_path):
+    return KlineArchive("BTCUSDT", "15m", root=str(tmp_path))
+
+
+def reopen(archive: KlineArchive) -> KlineArchive:
+    return KlineArchive(archive.symbol, archive.interval, root=os.path.dirname(archive.path))
+
+
+def test_append_skips_candles_already_in_the_archive(archive, arrays):
+    open_times, values = arrays
+    assert archive.append(open_times[:100], values[:, :100]) == 100
+    assert archive.append(open_times[50:150], values[:, 50:150]) == 50
+    assert archive.append(open_times[:150], values[:, :150]) == 0
+    times, columns = reopen(archive).view()
+    assert np.array_equal(times, open_times[:150])
+    assert np.array_equal(columns["close"], values[3, :150])
+
+
+def test_prepend_joins_older_history(archive, arrays):
+    open_times, values = arrays
+    archive.append(open_times[100:], values[:, 100:])
+    # Пересечение с архивом отбрасывается, старшая часть встаёт перед ним
+    assert archive.prepend(open_times[:120], values[:, :120]) == 100
+    assert archive.prepend(open_times[:50], values[:, :50]) == 0
+    for a in (archive, reopen(archive)):
+        times, columns = a.view()
+        assert np.array_equal(times, open_times)
+        assert np.array_equal(columns["volume"], values[4])
+    assert not os.path.exists(archive.path + ".old")
+    assert not os.path.exists(archive.path + ".new")
+
+
+def test_torn_column_is_truncated_to_the_common_length(archive, arrays):
+    open_times, values = arrays
+    archive.append(open_times[:100], values[:, :100])
+    # Запись прервалась: open и high дописаны, open_time — нет; volume обрезан посреди числа
+    with open(archive._file("open"), "ab") as f:
+        f.write(values[0, 100:103].tobytes())
+    with open(archive._file("high"), "ab") as f:
+        f.write(values[1, 100:101].tobytes())
+    with open(archive._file("volume"), "r+b") as f:
+        f.truncate(90 * 8 + 3)
+    recovered = reopen(archive)
+    assert len(recovered) == 90
+    assert {os.path.getsize(recovered._file(name)) for name, _ in kline_archive.FILES} == {90 * 8}
+    assert recovered.append(open_times[:120], values[:, :120]) == 30
+    assert np.array_equal(recovered.view()[1]["open"], values[0, :120])
+
+
+def test_interrupted_rebuild_is_recovered(archive, arrays):
+    open_times, values = arrays
+    archive.append(open_times[:100], values[:, :100])
+    # Сбой между двумя переименованиями в prepend: ряд лежит в .old, рядом недописанный .new
+    os.rename(archive.path, archive.path + ".old")
+    os.makedirs(archive.path + ".new")
+    recovered = reopen(archive)
+    assert len(recovered) == 100
+    assert np.array_equal(recovered.view()[0], open_times[:100])
+    assert not os.path.exists(archive.path + ".old")
+    assert not os.path.exists(archive.path + ".new")
+
+
+def test_view_bounds_and_limit(archive, arrays):
+    open_times, values = arrays
+    archive.append(open_times, values)
+    times, columns = archive.view(start=int(open_times[10]), end=int(open_times[20]))
+    assert np.array_equal(times, open_times[10:20])
+    assert np.array_equal(archive.view(end=int(open_times[20]), limit=5)[0], open_times[15:20])
+    assert np.array_equal(archive.view(limit=3)[0], open_times[-3:])
+    # Начало между свечами и строки/Timestamp вместо миллисекунд
+    assert archive.view(start=int(open_times[10]) + 1)[0][0] == open_times[11]
+    start = archive.frame().index[10]
+    assert np.array_equal(archive.view(start=str(start), limit=2)[0], open_times[-2:])
+    assert len(archive.view(start=int(open_times[-1]) + 1)[0]) == 0
+    df = archive.frame(start=start, limit=len(open_times))
+    assert df.index[0] == start and len(df) == len(open_times) - 10
+
+
+@pytest.fixture
+def enabled(archive, monkeypatch):
+    scheduled = []
+    monkeypatch.setattr(kline_archive, "KLINE_ARCHIVE_ENABLED", True)
+    monkeypatch.setattr(kline_archive, "_archives", {(archive.symbol, archive.interval): archive})
+    monkeypatch.setattr(kline_archive, "_schedule_update", lambda symbol, interval: scheduled.append((symbol, interval)))
+    return scheduled
+
+
+def test_archive_frame_appends_a_contiguous_window(archive, candles, enabled):
+    kline_archive.archive_frame("BTCUSDT", "15m", candles.iloc[:100])
+    kline_archive.archive_frame("BTCUSDT", "15m", candles.iloc[80:150])
+    assert len(archive) == 150
+    assert archive.frame().equals(candles.iloc[:150])
+    assert enabled == []
+
+
+def test_archive_frame_schedules_an_update_on_a_gap(archive, candles, enabled):
+    kline_archive.archive_frame("BTCUSDT", "15m", candles.iloc[:100])
+    kline_archive.archive_frame("BTCUSDT", "15m", candles.iloc[120:150])
+    assert len(archive) == 100
+    assert enabled == [("BTCUSDT", "15m")]
+
+
+def test_backfill_prepends_history_off_the_event_loop(archive, klines, enabled, monkeypatch):
+    on_loop = []
+
+    async def get_klines(symbol, interval, limit=100, start_time=None, end_time=None):
+        rows = [k for k in klines
+                if (start_time is None or k[0] >= start_time) and (end_time is None or k[0] <= end_time)]
+        return rows[:limit] if start_time is not None else rows[-limit:]
+
+    def prepend(open_times, values):
+        # В потоке пула нет работающего цикла событий
+        try:
+            asyncio.get_running_loop()
+            on_loop.append(True)
+        except RuntimeError:
+            on_loop.append(False)
+        return KlineArchive.prepend(archive, open_times, values)
+
+    monkeypatch.setattr(kline_archive.binance_client, "get_klines", get_klines)
+    monkeypatch.setattr(archive, "prepend", prepend)
+    archive.append(*klines_to_arrays(klines[-300:]))
+    added = asyncio.run(kline_archive.backfill_archive("BTCUSDT", "15m", klines[0][0]))
+    assert added == len(klines) - 300
+    assert np.array_equal(archive.view()[0], klines_to_arrays(klines)[0])
+    assert on_loop == [False]
@@ -0,0 +1,86 @@
+"""
+Поток свечей: события kline обновляют буфер CandleStore и indicator_engine,
+пропуск свечей запускает дозагрузку через REST, которая сшивает буфер.
+"""
+import asyncio
+
+import numpy as np
+import pytest
+
+import kline_stream
+from kline_stream import KlineStream
+
+BUFFER_SIZE = 500
+
+
+class FakeBinance:
+    """
+    REST /api/v3/klines по записанным свечам: «сейчас» — свеча available - 1.
+    """
+
+    def __init__(self, klines: list, available: int):
+        self.klines = klines
+        self.available = available
+        self.requests = []
+
+    async def get_klines(self, symbol, interval, limit=100, start_time=None, end_time=None):
+        self.requests.append(start_time)
+        rows = self.klines[:self.available]
+        if start_time is None:
+            return rows[-limit:]
+        return [k for k in rows if k[0] >= start_time][:limit]
+
+
+def event(kline: list, close: float = None) -> dict:
+    k = {"t": kline[0], "s": "BTCUSDT", "i": "15m", "o": kline[1], "h": kline[2], "l": kline[3],
+         "c": kline[4] if close is None else str(close), "v": kline[5]}
+    return {"stream": "btcusdt@kline_15m", "data": {"e": "kline", "s": "BTCUSDT", "k": k}}
+
+
+@pytest.fixture
+def engine_updates(monkeypatch):
+    updates = []
+
+    class Engine:
+        def update_candle(self, symbol, interval, open_time, high, low, close):
+            updates.append((symbol, interval, open_time, close))
+
+    monkeypatch.setattr(kline_stream, "indicator_engine", Engine())
+    return updates
+
+
+def test_events_update_the_buffer_and_a_gap_is_backfilled(klines, monkeypatch, engine_updates):
+    rest = FakeBinance(klines, available=900)
+    monkeypatch.setattr(kline_stream, "binance_client", rest)
+    stream = KlineStream(symbols=["BTCUSDT"], intervals=["15m"], buffer_size=BUFFER_SIZE)
+    buffer = stream.buffers[("BTCUSDT", "15m")]
+
+    async def scenario():
+        await stream.backfill("BTCUSDT", "15m")
+        assert len(buffer) == BUFFER_SIZE and buffer.last_open_time == klines[899][0]
+        # Тик текущей свечи и открытие следующей
+        stream.handle_message(event(klines[899], close=12345.0))
+        assert buffer.frame(1)["close"].iloc[-1] == 12345.0
+        stream.handle_message(event(klines[900]))
+        assert buffer.last_open_time == klines[900][0] and len(buffer) == BUFFER_SIZE
+        # Сообщения потерялись: следующая свеча через 48 пропущенных
+        rest.available = 950
+        stream.handle_message(event(klines[949]))
+        assert buffer.last_open_time == klines[900][0]
+        await stream._backfills[("BTCUSDT", "15m")]
+
+    asyncio.run(scenario())
+    assert rest.requests == [None, klines[900][0]]
+    times = buffer.frame(BUFFER_SIZE).index.values.astype("datetime64[ms]").astype(np.int64)
+    assert times[-1] == klines[949][0]
+    assert (np.diff(times) == 15 * 60 * 1000).all()
+    assert [u[2] for u in engine_updates] == [klines[899][0], klines[900][0]]
+    assert engine_updates[0][3] == 12345.0
+
+
+def test_unknown_series_and_other_events_are_ignored(klines, engine_updates):
+    stream = KlineStream(symbols=["BTCUSDT"], intervals=["1h"], buffer_size=BUFFER_SIZE)
+    stream.handle_message(event(klines[0]))
+    stream.handle_message({"data": {"e": "trade"}})
+    assert len(stream.buffers[("BTCUSDT", "1h")]) == 0
+    assert engine_updates == []
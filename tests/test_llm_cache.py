@@ -0,0 +1,60 @@
+"""
+Кэш ответов LLM: близкие индикаторы в пределах свечи дают тот же ключ и не
+вызывают LLM повторно, заметное изменение — новый запрос.
+"""
+import asyncio
+
+import pytest
+
+import llm_explainer
+
+INDICATORS = {
+    "final_signal": "ЛОНГ", "SevenDays": "BUY", "recommendation": "BUY",
+    "RSI": "45.23", "MACD": "-120.40", "StochRSI": "61.10", "EMA50": 95321.55,
+    "MA_summary": "BUY", "MA_buy": 9, "MA_sell": 3, "trend": "📈 Бычий", "volume": "86.71"
+}
+
+
+@pytest.fixture
+def llm_calls(monkeypatch):
+    calls = []
+
+    async def complete(messages, max_tokens, priority):
+        calls.append(messages)
+        return '{"comment": "Рост", "direction": "ЛОНГ", "probability": 70}'
+
+    monkeypatch.setattr(llm_explainer, "complete", complete)
+    llm_explainer.clear_llm_cache()
+    yield calls
+    llm_explainer.clear_llm_cache()
+
+
+def analyse(indicators: dict) -> dict:
+    return asyncio.run(llm_explainer.generate_timeframe_analysis(indicators, "15m", "BTCUSDT"))
+
+
+def test_nearby_indicators_hit_the_cache(llm_calls):
+    first = analyse(INDICATORS)
+    nearby = dict(INDICATORS, RSI="45.24", MACD="-121.10", StochRSI="61.3", EMA50=95327.0, volume="120.05")
+    assert analyse(nearby) == first
+    assert len(llm_calls) == 1
+
+
+@pytest.mark.parametrize("field, value", [
+    ("RSI", "52.80"),
+    ("EMA50", 96100.0),
+    ("final_signal", "ШОРТ"),
+])
+def test_real_change_misses_the_cache(llm_calls, field, value):
+    analyse(INDICATORS)
+    analyse(dict(INDICATORS, **{field: value}))
+    assert len(llm_calls) == 2
+
+
+def test_price_fields_use_a_step_relative_to_the_price():
+    btc = llm_explainer._fingerprint(dict(INDICATORS, EMA50=95321.55))
+    btc_moved = llm_explainer._fingerprint(dict(INDICATORS, EMA50=95325.0))
+    pepe = llm_explainer._fingerprint(dict(INDICATORS, EMA50=0.012345))
+    pepe_moved = llm_explainer._fingerprint(dict(INDICATORS, EMA50=0.012345 * 1.05))
+    assert btc == btc_moved
+    assert pepe != pepe_moved
@@ -0,0 +1,94 @@
+"""
+Лимитер LLM: очередь по приоритету (внутри приоритета — по порядку), запас
+запросов подряд, ведро токенов в минуту с уточнением по usage; прогрев кэша
+LLM планировщиком идёт в фоновой очереди.
+"""
+import asyncio
+
+import pandas as pd
+
+import scheduler
+from llm_client import TokenBucketLimiter, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
+
+
+def test_interactive_requests_overtake_background_ones():
+    async def scenario():
+        limiter = TokenBucketLimiter(rps=0, burst=1, tpm=0, max_concurrency=1)
+        await limiter.acquire(1)
+        order = []
+
+        async def request(name, priority):
+            await limiter.acquire(1, priority)
+            order.append(name)
+
+        tasks = [asyncio.ensure_future(request(name, priority)) for name, priority in (
+            ("фон 1", PRIORITY_BACKGROUND), ("пользователь 1", PRIORITY_INTERACTIVE),
+            ("фон 2", PRIORITY_BACKGROUND), ("пользователь 2", PRIORITY_INTERACTIVE)
+        )]
+        await asyncio.sleep(0.01)
+        assert order == [] and limiter.stats()["waiting"] == 4
+        for _ in tasks:
+            limiter.release(1, 1)
+            await asyncio.sleep(0.01)
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(scenario()) == ["пользователь 1", "пользователь 2", "фон 1", "фон 2"]
+
+
+def test_burst_then_requests_per_second():
+    async def scenario():
+        limiter = TokenBucketLimiter(rps=20, burst=3, tpm=0, max_concurrency=10)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+
+        async def request():
+            await limiter.acquire(1)
+            return loop.time() - started
+
+        return sorted(await asyncio.gather(*(request() for _ in range(5))))
+
+    times = asyncio.run(scenario())
+    assert times[2] < 0.03
+    assert 0.04 <= times[3] < 0.09 and 0.09 <= times[4] < 0.15
+
+
+def test_tokens_per_minute_are_corrected_by_usage():
+    async def scenario():
+        # 60 000 токенов в минуту — 1000 в секунду
+        limiter = TokenBucketLimiter(rps=0, burst=1, tpm=60000, max_concurrency=10)
+        loop = asyncio.get_running_loop()
+        await limiter.acquire(40000)
+        # Ответ оказался короче оценки: 30 000 токенов возвращаются в ведро
+        limiter.release(40000, 10000)
+        started = loop.time()
+        await limiter.acquire(45000)
+        immediate = loop.time() - started
+        await limiter.acquire(5500)
+        return immediate, loop.time() - started
+
+    immediate, waited = asyncio.run(scenario())
+    assert immediate < 0.03
+    assert 0.45 <= waited < 0.6
+
+
+def test_scheduler_warms_the_llm_cache_in_the_background_lane(candles, monkeypatch):
+    calls = []
+
+    class Pipeline:
+        def __init__(self, symbol, timeframe):
+            self.symbol, self.timeframe = symbol, timeframe
+
+        async def load(self) -> pd.DataFrame:
+            return candles
+
+        async def forecast(self) -> dict:
+            return {"indicators": {"RSI": "45.0"}}
+
+    async def analyse(indicators, timeframe, symbol, priority):
+        calls.append((symbol, timeframe, indicators, priority))
+
+    monkeypatch.setattr(scheduler, "AnalysisPipeline", Pipeline)
+    monkeypatch.setattr(scheduler, "generate_timeframe_analysis", analyse)
+    asyncio.run(scheduler.warm_llm("BTCUSDT", "1h"))
+    assert calls == [("BTCUSDT", "1h", {"RSI": "45.0"}, PRIORITY_BACKGROUND)]
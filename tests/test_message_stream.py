@@ -0,0 +1,117 @@
+"""
+Потоковое сообщение: правки не чаще интервала с отправкой только свежего
+черновика, пауза по RetryAfter и повтор итоговой правки; черновики одного
+запроса LLM получают все ожидающие его пользователи.
+"""
+import asyncio
+
+import pytest
+from aiogram.utils.exceptions import RetryAfter
+
+import llm_explainer
+import message_stream
+from message_stream import StreamingMessage
+
+INTERVAL = 0.05
+
+
+class FakeBot:
+    def __init__(self, retry_after: int = 0, wait: float = 0.2):
+        self.retry_after = retry_after
+        self.wait = wait
+        self.edits = []
+
+    async def edit_message_text(self, text, chat_id, message_id, parse_mode=None):
+        now = asyncio.get_running_loop().time()
+        if self.retry_after:
+            self.retry_after -= 1
+            self.edits.append((now, None))
+            raise RetryAfter(self.wait)
+        self.edits.append((now, text))
+
+
+@pytest.fixture
+def bot(monkeypatch):
+    def install(**kwargs) -> FakeBot:
+        fake = FakeBot(**kwargs)
+        monkeypatch.setattr(message_stream, "bot", fake)
+        return fake
+    return install
+
+
+def test_edits_are_throttled_and_collapsed(bot):
+    fake = bot()
+
+    async def scenario():
+        message = StreamingMessage(1, 2, interval=INTERVAL)
+        for i in range(20):
+            message.update(f"черновик {i}")
+            await asyncio.sleep(INTERVAL / 10)
+        await asyncio.sleep(INTERVAL * 2)
+        assert await message.finish("<b>итог</b>", parse_mode="HTML")
+        message.update("после итога")
+        return message
+
+    message = asyncio.run(scenario())
+    texts = [text for _, text in fake.edits]
+    times = [t for t, _ in fake.edits]
+    assert texts[0] == "черновик 0" and texts[-2:] == ["черновик 19", "<b>итог</b>"]
+    assert len(texts) < 10 and message.edits == len(texts)
+    assert all(b - a >= INTERVAL * 0.9 for a, b in zip(times, times[1:]))
+
+
+def test_retry_after_pauses_drafts_and_retries_the_final_edit(bot):
+    fake = bot(retry_after=2, wait=0.2)
+
+    async def scenario():
+        message = StreamingMessage(1, 2, interval=INTERVAL)
+        message.update("черновик")
+        await asyncio.sleep(INTERVAL / 2)
+        return await message.finish("итог")
+
+    assert asyncio.run(scenario())
+    (first, _), (second, _), (third, text) = fake.edits
+    # Каждая следующая попытка — не раньше, чем разрешил Telegram
+    assert second - first >= 0.2 * 0.9 and third - second >= 0.2 * 0.9
+    assert text == "итог"
+
+
+def test_too_long_final_text_is_not_edited(bot):
+    fake = bot()
+    text = "x" * (message_stream.MESSAGE_MAX_LENGTH + 1)
+    assert not asyncio.run(StreamingMessage(1, 2, interval=INTERVAL).finish(text))
+    assert fake.edits == []
+
+
+INDICATORS = {"final_signal": "ЛОНГ", "RSI": "45.23", "EMA50": 95321.55, "trend": "📈 Бычий"}
+CHUNKS = ['{"comment": "Цена ', 'растёт', ' к сопротивлению", ', '"direction": "ЛОНГ", "probability": 70}']
+
+
+def test_drafts_reach_every_waiting_caller(monkeypatch):
+    requests = []
+
+    async def stream(messages, max_tokens, priority):
+        requests.append(messages)
+        for chunk in CHUNKS:
+            await asyncio.sleep(0.01)
+            yield chunk
+
+    monkeypatch.setattr(llm_explainer, "stream", stream)
+    monkeypatch.setattr(llm_explainer, "LLM_STREAMING", True)
+    llm_explainer.clear_llm_cache()
+    first, second = [], []
+
+    async def scenario():
+        leader = asyncio.ensure_future(llm_explainer.generate_timeframe_analysis(INDICATORS, "15m", on_text=first.append))
+        await asyncio.sleep(0.015)
+        waiter = llm_explainer.generate_timeframe_analysis(INDICATORS, "15m", on_text=second.append)
+        return await asyncio.gather(leader, waiter)
+
+    results = asyncio.run(scenario())
+    llm_explainer.clear_llm_cache()
+    assert len(requests) == 1
+    assert results[0] == results[1] and results[0]["direction"] == "ЛОНГ"
+    assert first == ["Цена ", "Цена растёт", "Цена растёт к сопротивлению"]
+    # Присоединившийся после первого черновика сразу получает его, затем — следующие
+    assert second == first
+    assert llm_explainer._draft_listeners == {} and llm_explainer._drafts == {}
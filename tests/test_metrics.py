@@ -0,0 +1,123 @@
+"""
+Замеры этапов: метки запроса через ContextVar (в том числе в пуле потоков),
+текстовый формат Prometheus, замер отрисовки графика без попаданий в кэш и
+разбиение /stats на сообщения.
+"""
+import asyncio
+import contextvars
+import re
+import types
+
+import pytest
+
+import charting
+import handlers
+import metrics
+from message_stream import MESSAGE_MAX_LENGTH
+
+
+@pytest.fixture(autouse=True)
+def clean_metrics():
+    metrics.reset_metrics()
+    yield
+    metrics.reset_metrics()
+
+
+@metrics.timed("lookup")
+def lookup() -> int:
+    return 1
+
+
+def series() -> dict:
+    return metrics._snapshot()
+
+
+def test_tags_reach_timed_functions_in_the_thread_pool():
+    async def handler():
+        metrics.set_tags(handler="forecast", symbol="ethusdt", timeframe="1h")
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, contextvars.copy_context().run, lookup)
+        # Без копии контекста поток пула меток запроса не видит
+        await loop.run_in_executor(None, lookup)
+
+    asyncio.run(handler())
+    assert set(series()) == {("lookup", "ETHUSDT", "1h", "forecast"), ("lookup", "-", "-", "-")}
+
+
+def test_explicit_arguments_override_tags_and_errors_are_counted():
+    @metrics.timed("fetch", timeframe="interval")
+    async def fetch(symbol: str, interval: str):
+        raise ConnectionError(symbol)
+
+    async def handler():
+        metrics.set_tags(handler="chart", timeframe="15m")
+        with pytest.raises(ConnectionError):
+            await fetch("btcusdt", interval="4h")
+
+    asyncio.run(handler())
+    histogram = series()[("fetch", "BTCUSDT", "4h", "chart")]
+    assert (histogram.count, histogram.errors) == (1, 1)
+
+
+def test_prometheus_text_format():
+    metrics.observe("llm", 0.003, symbol="BTCUSDT", timeframe="15m")
+    metrics.observe("llm", 0.3, symbol="BTCUSDT", timeframe="15m", error=True)
+    metrics.observe("llm", 60.0, symbol="BTCUSDT", timeframe="15m")
+    metrics.observe('odd"stage\\', 0.01)
+    text = metrics.render_prometheus()
+    labels = 'stage="llm",symbol="BTCUSDT",timeframe="15m",handler="-"'
+    assert f'bot_stage_duration_seconds_bucket{{{labels},le="0.001"}} 0\n' in text
+    assert f'bot_stage_duration_seconds_bucket{{{labels},le="0.005"}} 1\n' in text
+    assert f'bot_stage_duration_seconds_bucket{{{labels},le="0.5"}} 2\n' in text
+    assert f'bot_stage_duration_seconds_bucket{{{labels},le="30.0"}} 2\n' in text
+    assert f'bot_stage_duration_seconds_bucket{{{labels},le="+Inf"}} 3\n' in text
+    assert f"bot_stage_duration_seconds_sum{{{labels}}} 60.303000\n" in text
+    assert f"bot_stage_duration_seconds_count{{{labels}}} 3\n" in text
+    assert f'bot_stage_duration_quantile_seconds{{{labels},quantile="0.5"}} 0.300000\n' in text
+    assert f"bot_stage_errors_total{{{labels}}} 1\n" in text
+    assert 'stage="odd\\"stage\\\\"' in text
+    # Каждая строка — комментарий или «имя{метки} значение»
+    for line in text.splitlines():
+        assert line.startswith("# ") or re.fullmatch(r'bot_\w+\{.*\} \S+', line), line
+
+
+def test_chart_render_is_timed_without_cache_hits_and_errors_count(candles, monkeypatch):
+    renders = []
+
+    async def render_chart_async(df, levels=None, symbol="BTCUSDT"):
+        renders.append(len(df))
+        if len(renders) > 1:
+            raise RuntimeError("render failed")
+        return b"png"
+
+    monkeypatch.setattr(charting, "render_chart_async", render_chart_async)
+    charting.clear_chart_cache()
+    df = candles.iloc[-200:]
+    generate = lambda frame: asyncio.run(charting.generate_chart_async("BTCUSDT", "15m", df=frame))
+    assert generate(df) == b"png"
+    assert generate(df) == b"png"
+    assert generate(df.iloc[:-1]) == b""
+    charting.clear_chart_cache()
+    histogram = series()[("render_chart", "BTCUSDT", "15m", "-")]
+    assert (histogram.count, histogram.errors) == (2, 1)
+    assert len(renders) == 2
+
+
+def test_stats_is_split_on_line_boundaries(monkeypatch):
+    for i in range(150):
+        metrics.observe(f"stage_{i:03d}_" + "x" * 10, 0.01)
+    answers = []
+
+    async def answer(text, parse_mode=None):
+        answers.append(text)
+
+    monkeypatch.setattr(handlers, "ADMIN_IDS", {1})
+    msg = types.SimpleNamespace(from_user=types.SimpleNamespace(id=1), answer=answer)
+    asyncio.run(handlers.stats_command(msg))
+    assert len(answers) > 1
+    for text in answers:
+        assert len(text) <= MESSAGE_MAX_LENGTH
+        assert text.count("<pre>") == text.count("</pre>") >= 1
+    lines = re.sub(r"</?pre>", "\n", "\n".join(answers)).splitlines()
+    assert sorted(line.split()[0] for line in lines if line.startswith("stage_")) == sorted(metrics.get_stage_stats())
+    assert "<b>Кэши</b>" in answers[-1]
@@ -0,0 +1,54 @@
+"""
+Общий график таймфреймов: одна фигура и одна PNG на все кадры, конвейеры
+передают уже загруженные свечи и свои уровни без повторной загрузки.
+"""
+import asyncio
+import struct
+
+import pandas as pd
+
+import pipeline
+from chart_renderer import render_chart, render_multi_chart
+from pipeline import AnalysisPipeline
+
+PNG_MAGIC = b"\x89PNG\r\n\x1a\n"
+
+
+def png_size(png: bytes) -> tuple:
+    return struct.unpack(">II", png[16:24])
+
+
+def resample(df: pd.DataFrame, rule: str) -> pd.DataFrame:
+    return df.resample(rule).agg({"open": "first", "high": "max", "low": "min", "close": "last", "volume": "sum"}).dropna()
+
+
+def test_three_timeframes_render_into_one_png(candles):
+    frames = {"15m": candles.iloc[-100:], "1h": resample(candles, "1h").iloc[-100:], "4h": resample(candles, "4h").iloc[-60:]}
+    levels = {tf: [float(df["low"].min()), float(df["high"].max())] for tf, df in frames.items()}
+    png = render_multi_chart(frames, levels, symbol="BTCUSDT")
+    assert png.startswith(PNG_MAGIC) and png.count(b"IEND") == 1
+    # Колонка на таймфрейм: картинка шире одиночного графика
+    single = render_chart(frames["15m"], levels["15m"], symbol="BTCUSDT")
+    assert png_size(png)[0] > png_size(single)[0]
+
+
+def test_pipelines_pass_loaded_frames_and_levels(candles, monkeypatch):
+    calls = []
+
+    async def generate_multi_chart_async(symbol, frames, levels):
+        calls.append((symbol, frames, levels))
+        return b"png"
+
+    monkeypatch.setattr(pipeline, "generate_multi_chart_async", generate_multi_chart_async)
+    monkeypatch.setattr(pipeline, "get_support_resistance", lambda df: (float(df["low"].min()), float(df["high"].max())))
+    pipelines = []
+    for tf, df in (("15m", candles.iloc[-300:]), ("1h", resample(candles, "1h")), ("4h", resample(candles, "4h"))):
+        p = AnalysisPipeline("ETHUSDT", tf)
+        p.df = df
+        pipelines.append(p)
+
+    assert asyncio.run(pipeline.chart_multi_pipelines(pipelines)) == b"png"
+    (symbol, frames, levels), = calls
+    assert symbol == "ETHUSDT" and list(frames) == ["15m", "1h", "4h"]
+    assert all(frames[p.timeframe] is p.df for p in pipelines)
+    assert levels == {p.timeframe: list(p.levels()) for p in pipelines}
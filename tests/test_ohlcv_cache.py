@@ -0,0 +1,80 @@
+"""
+Общий кэш свечей: запись живёт до закрытия текущей свечи, меньший limit
+обслуживается срезом более длинного окна, каждый вызов получает свою копию.
+"""
+import asyncio
+import time
+
+import pytest
+
+import charting
+
+INTERVAL_MS = 15 * 60 * 1000
+
+
+class Clock:
+    def __init__(self, now: float):
+        self.now = now
+
+    def time(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def live(klines, monkeypatch):
+    """
+    Записанные свечи, сдвинутые так, что последняя — текущая (открыта минуту назад).
+    """
+    clock = Clock(time.time())
+    current_open = int(clock.now * 1000) // INTERVAL_MS * INTERVAL_MS
+    clock.now = current_open / 1000 + 60
+    shift = current_open - klines[-1][0]
+    rows = [[k[0] + shift] + k[1:6] + [k[6] + shift] + k[7:] for k in klines]
+    requests = []
+
+    class Binance:
+        async def get_klines(self, symbol, interval, limit=100, start_time=None, end_time=None):
+            requests.append(limit)
+            return rows[-limit:]
+
+    monkeypatch.setattr(charting, "time", clock)
+    monkeypatch.setattr(charting, "binance_client", Binance())
+    charting.clear_ohlcv_cache()
+    monkeypatch.setattr(charting, "_ohlcv_cache_stats", {"hits": 0, "misses": 0})
+    yield clock, requests
+    charting.clear_ohlcv_cache()
+
+
+def ohlcv(limit: int):
+    return asyncio.run(charting.get_ohlcv_async("btcusdt", "15m", limit=limit))
+
+
+def test_smaller_limit_is_a_slice_of_the_cached_window(live):
+    _, requests = live
+    long = ohlcv(300)
+    short = ohlcv(100)
+    assert requests == [300]
+    assert short.equals(long.iloc[-100:])
+    # Окно длиннее закэшированного — новый запрос, и оно заменяет короткое
+    ohlcv(500)
+    ohlcv(300)
+    assert requests == [300, 500]
+    assert charting.get_ohlcv_cache_stats() == {"hits": 2, "misses": 2, "entries": 1, "hit_rate": 0.5}
+
+
+def test_entry_expires_when_the_current_candle_closes(live):
+    clock, requests = live
+    ohlcv(300)
+    close = (clock.now - 60) + INTERVAL_MS / 1000
+    clock.now = close - 1
+    ohlcv(300)
+    assert requests == [300]
+    clock.now = close + charting.OHLCV_MIN_TTL
+    ohlcv(300)
+    assert requests == [300, 300]
+
+
+def test_callers_get_independent_copies(live):
+    first = ohlcv(300)
+    first.loc[first.index[-1], "close"] = -1.0
+    assert ohlcv(300)["close"].iloc[-1] != -1.0
@@ -0,0 +1,70 @@
+"""
+Конвейер анализа: свечи загружаются один раз, прогноз, уровни и график
+получают один и тот же DataFrame.
+"""
+import asyncio
+
+import pytest
+
+import pipeline
+from pipeline import AnalysisPipeline
+
+
+@pytest.fixture
+def stages(candles, monkeypatch):
+    calls = []
+
+    async def get_ohlcv_async(symbol, timeframe, limit):
+        calls.append(("load", symbol, timeframe, limit))
+        return candles.iloc[-limit:]
+
+    async def get_forecast_async(symbol, timeframe, df=None):
+        calls.append(("forecast", df))
+        return {"indicators": {"RSI": "45.0"}}
+
+    def get_support_resistance(df):
+        calls.append(("levels", df))
+        return 90000.0, 95000.0
+
+    async def generate_chart_async(symbol, interval_binance, levels, df):
+        calls.append(("chart", df, levels))
+        return b"png"
+
+    monkeypatch.setattr(pipeline, "get_ohlcv_async", get_ohlcv_async)
+    monkeypatch.setattr(pipeline, "get_forecast_async", get_forecast_async)
+    monkeypatch.setattr(pipeline, "get_support_resistance", get_support_resistance)
+    monkeypatch.setattr(pipeline, "generate_chart_async", generate_chart_async)
+    return calls
+
+
+def test_stages_share_one_frame(stages):
+    p = AnalysisPipeline("BTCUSDT", "1h")
+
+    async def scenario():
+        df = await p.load()
+        assert await p.load() is df
+        await p.forecast()
+        await p.forecast()
+        assert await p.chart() == b"png"
+        return df
+
+    df = asyncio.run(scenario())
+    assert stages[0] == ("load", "BTCUSDT", "1h", pipeline.ANALYSIS_CANDLES)
+    assert [call[0] for call in stages] == ["load", "forecast", "levels", "chart"]
+    assert all(call[1] is df for call in stages[1:])
+    assert stages[-1][2] == [90000.0, 95000.0]
+
+
+def test_pipelines_load_each_timeframe_once(stages):
+    async def scenario():
+        pipelines = await pipeline.load_pipelines("BTCUSDT", ["15m", "1h", "4h"])
+        await pipeline.forecast_pipelines(pipelines)
+        await pipeline.chart_pipelines(pipelines)
+        return pipelines
+
+    pipelines = asyncio.run(scenario())
+    assert [call[2] for call in stages if call[0] == "load"] == ["15m", "1h", "4h"]
+    frames = [p.df for p in pipelines]
+    for stage in ("forecast", "levels", "chart"):
+        used = [call[1] for call in stages if call[0] == stage]
+        assert len(used) == 3 and all(any(df is f for f in frames) for df in used)
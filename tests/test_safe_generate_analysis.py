@@ -0,0 +1,45 @@
+"""
+Повторы анализа таймфрейма: ответ LLM без направления запрашивается заново,
+после исчерпания попыток направление берётся из локальной модели.
+"""
+import asyncio
+
+import handlers
+
+INCOMPLETE = {"comment": "—", "direction": None, "probability": None}
+COMPLETE = {"comment": "Рост", "direction": "ЛОНГ", "probability": 70}
+
+
+def run_with(monkeypatch, responses):
+    calls = []
+
+    async def generate(indicators, timeframe, symbol, on_text=None):
+        calls.append(timeframe)
+        response = responses[min(len(calls), len(responses)) - 1]
+        if isinstance(response, Exception):
+            raise response
+        return dict(response)
+
+    monkeypatch.setattr(handlers, "generate_timeframe_analysis", generate)
+    monkeypatch.setattr(handlers, "analysis_mode", lambda: "llm")
+    result = asyncio.run(handlers.safe_generate_analysis({}, "15m", "BTCUSDT", max_retries=3, delay=0))
+    return result, calls
+
+
+def test_retries_until_the_llm_returns_a_direction(monkeypatch):
+    result, calls = run_with(monkeypatch, [INCOMPLETE, RuntimeError("boom"), COMPLETE])
+    assert result == COMPLETE
+    assert len(calls) == 3
+
+
+def test_complete_answer_is_not_retried(monkeypatch):
+    result, calls = run_with(monkeypatch, [COMPLETE])
+    assert result == COMPLETE
+    assert len(calls) == 1
+
+
+def test_falls_back_to_local_model_after_retries(monkeypatch):
+    result, calls = run_with(monkeypatch, [INCOMPLETE])
+    assert len(calls) == 3
+    assert result["direction"] in ("ЛОНГ", "ШОРТ")
+    assert 50 <= result["probability"] <= 95
@@ -0,0 +1,57 @@
+"""
+Голоса signal_model по прогнозу get_forecast совпадают с голосами vote_matrix,
+на которых модель калибруется, — в том числе когда в кадре есть незакрытая свеча.
+"""
+import time
+
+import pandas as pd
+import pytest
+
+import services
+from batch_indicators import stack_frames, compute_indicators
+from signal_model import vote_vector, vote_matrix, FEATURES
+from utils import interval_to_seconds
+
+# Голоса, которые считаются по свечам (RSI и MACD приходят из TradingView)
+FRAME_VOTES = [FEATURES.index(f) for f in ("EMA", "volume", "SuperTrend", "PSAR")]
+VOLUME = FEATURES.index("volume")
+
+
+class FakeAnalysis:
+    summary = {"RECOMMENDATION": "BUY"}
+    moving_averages = {"RECOMMENDATION": "BUY", "BUY": 9, "SELL": 3}
+    indicators = {"RSI": 50.0, "MACD.macd": 1.0, "Stoch.RSI.K": 50.0}
+
+
+@pytest.fixture(autouse=True)
+def tradingview(monkeypatch):
+    monkeypatch.setattr(services, "get_symbol_analysis", lambda symbol, interval: FakeAnalysis())
+    services.indicator_engine.reset()
+
+
+def training_votes(df: pd.DataFrame):
+    names, _, arrays = stack_frames({"BTCUSDT": df})
+    return vote_matrix(arrays, compute_indicators(arrays))[0, -1]
+
+
+def test_votes_match_training_on_a_closed_frame(candles):
+    df = candles.iloc[-300:]
+    indicators = services.get_forecast("BTCUSDT", "15m", df=df)["indicators"]
+    assert list(vote_vector(indicators)[FRAME_VOTES]) == list(training_votes(df)[FRAME_VOTES])
+
+
+def test_volume_vote_ignores_the_forming_candle(candles):
+    closed = candles.iloc[-300:]
+    expected = training_votes(closed)[VOLUME]
+    step = interval_to_seconds("15m")
+    now = pd.Timestamp(int(time.time() // step * step), unit="s")
+    # Объём незакрытой свечи, при котором голос по ней был бы противоположным
+    live_volume = 0.0 if expected > 0 else float(closed["volume"].max()) * 10
+    live = pd.DataFrame(
+        {"open": [closed["close"].iloc[-1]], "high": [closed["close"].iloc[-1]], "low": [closed["close"].iloc[-1]],
+         "close": [closed["close"].iloc[-1]], "volume": [live_volume]},
+        index=pd.DatetimeIndex([now], name="timestamp")
+    )
+    df = pd.concat([closed, live])
+    indicators = services.get_forecast("BTCUSDT", "15m", df=df)["indicators"]
+    assert vote_vector(indicators)[VOLUME] == expected
@@ -0,0 +1,92 @@
+"""
+SingleFlight: одинаковые одновременные вызовы выполняются один раз.
+"""
+import asyncio
+
+import pytest
+
+from single_flight import SingleFlight
+
+
+class Counter:
+    def __init__(self, result=None, error=None, delay=0.02):
+        self.calls = 0
+        self.result = result
+        self.error = error
+        self.delay = delay
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return self.result if self.result is not None else {"call": self.calls}
+
+
+def test_concurrent_calls_share_one_execution():
+    flights = SingleFlight("test-shared")
+    func = Counter()
+
+    async def main():
+        return await asyncio.gather(*(flights.do("key", func) for _ in range(10)))
+
+    results = asyncio.run(main())
+    assert func.calls == 1
+    assert all(r is results[0] for r in results)
+    stats = flights.stats()
+    assert (stats["calls"], stats["shared"], stats["in_flight"]) == (10, 9, 0)
+
+
+def test_error_reaches_every_waiter():
+    flights = SingleFlight("test-error")
+    func = Counter(error=ValueError("boom"))
+
+    async def main():
+        return await asyncio.gather(*(flights.do("key", func) for _ in range(5)), return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert func.calls == 1
+    assert all(isinstance(r, ValueError) for r in results)
+
+
+def test_cancelled_waiter_does_not_cancel_the_shared_task():
+    flights = SingleFlight("test-cancel")
+    func = Counter(result="done", delay=0.05)
+
+    async def main():
+        first = asyncio.ensure_future(flights.do("key", func))
+        second = asyncio.ensure_future(flights.do("key", func))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(main()) == "done"
+    assert func.calls == 1
+
+
+def test_key_is_released_after_completion():
+    flights = SingleFlight("test-release")
+    func = Counter()
+
+    async def main():
+        first = await flights.do("key", func)
+        second = await flights.do("key", func)
+        return first, second
+
+    first, second = asyncio.run(main())
+    assert func.calls == 2
+    assert first != second
+    assert flights.stats()["in_flight"] == 0
+
+
+def test_different_keys_run_separately():
+    flights = SingleFlight("test-keys")
+    func = Counter()
+
+    async def main():
+        return await asyncio.gather(flights.do("a", func), flights.do("b", func))
+
+    asyncio.run(main())
+    assert func.calls == 2
@@ -0,0 +1,75 @@
+"""
+Один структурный запрос к LLM на таймфрейм: JSON с выводом, направлением и
+вероятностью разбирается в словарь, который без новых запросов используют
+блок анализа и полный прогноз.
+"""
+import asyncio
+
+import pytest
+
+import handlers
+import llm_explainer
+from llm_explainer import _parse_analysis
+
+INDICATORS = {
+    "15m": {"final_signal": "ЛОНГ", "RSI": "45.23", "MACD": "-120.40", "EMA50": 95321.55, "trend": "📈 Бычий"},
+    "1h": {"final_signal": "ШОРТ", "RSI": "61.80", "MACD": "35.10", "EMA50": 94870.00, "trend": "📉 Медвежий"},
+    "4h": {"final_signal": "ЛОНГ", "RSI": "52.10", "MACD": "410.75", "EMA50": 92110.30, "trend": "📈 Бычий"},
+}
+ANSWERS = {
+    "15 минут": '{"comment": "Отскок от поддержки", "direction": "ЛОНГ", "probability": 70}',
+    "1 час": 'Ответ: {"comment": "Давление продавцов", "direction": "SHORT", "probability": "64"}',
+    "4 часа": '{"comment": "Тренд вверх", "direction": "long", "probability": 99}',
+}
+
+
+@pytest.mark.parametrize("content, expected", [
+    (ANSWERS["1 час"], {"comment": "Давление продавцов", "direction": "ШОРТ", "probability": 64}),
+    (ANSWERS["4 часа"], {"comment": "Тренд вверх", "direction": "ЛОНГ", "probability": 95}),
+    ('{"comment": "", "direction": "вбок", "probability": "n/a"}', {"comment": "—", "direction": None, "probability": None}),
+    ("Не JSON", {"comment": "—", "direction": None, "probability": None}),
+    (None, {"comment": "—", "direction": None, "probability": None}),
+])
+def test_parse_analysis(content, expected):
+    assert _parse_analysis(content) == expected
+
+
+@pytest.fixture
+def llm_calls(monkeypatch):
+    calls = []
+
+    async def complete(messages, max_tokens, priority):
+        prompt = messages[-1]["content"]
+        tf = next(name for name in ANSWERS if f"таймфрейме {name}" in prompt)
+        calls.append(tf)
+        return ANSWERS[tf]
+
+    async def stream(messages, max_tokens, priority):
+        raise AssertionError("поток не ожидается")
+        yield
+
+    monkeypatch.setattr(llm_explainer, "complete", complete)
+    monkeypatch.setattr(llm_explainer, "stream", stream)
+    monkeypatch.setattr(handlers, "analysis_mode", lambda: "llm")
+    llm_explainer.clear_llm_cache()
+    yield calls
+    llm_explainer.clear_llm_cache()
+
+
+def test_one_call_per_timeframe_feeds_every_block(llm_calls):
+    async def scenario():
+        analyses = await handlers.analyze_timeframes("BTCUSDT", INDICATORS)
+        block = await handlers.format_analysis_block("BTCUSDT", "15m", INDICATORS["15m"], analyses["15m"], 90000.0, 97000.0)
+        return analyses, block
+
+    analyses, block = asyncio.run(scenario())
+    assert sorted(llm_calls) == sorted(ANSWERS)
+    assert analyses["1h"] == {"comment": "Давление продавцов", "direction": "ШОРТ", "probability": 64}
+    assert "Отскок от поддержки" in block and "🟢 ЛОНГ (70%)" in block
+
+    text = handlers.format_full_forecast_text(analyses, INDICATORS)
+    for comment in ("Отскок от поддержки", "Давление продавцов", "Тренд вверх"):
+        assert comment in text
+    assert "ШОРТ 64%" in text and "4ч: 🟢 ЛОНГ (95%)" in text
+    # Блок анализа и полный прогноз не делают своих запросов к LLM
+    assert len(llm_calls) == 3
@@ -22,4 +22,31 @@ def format_float(value):
     except Exception:
         return "-"
 
+# Длительность свечи Binance/TradingView в секундах
+INTERVAL_SECONDS = {
+    "1m": 60,
+    "3m": 3 * 60,
+    "5m": 5 * 60,
+    "15m": 15 * 60,
+    "30m": 30 * 60,
+    "1h": 60 * 60,
+    "2h": 2 * 60 * 60,
+    "4h": 4 * 60 * 60,
+    "6h": 6 * 60 * 60,
+    "8h": 8 * 60 * 60,
+    "12h": 12 * 60 * 60,
+    "1d": 24 * 60 * 60,
+    "3d": 3 * 24 * 60 * 60,
+    "1w": 7 * 24 * 60 * 60,
+}
+
+def interval_to_seconds(interval: str) -> int:
+    """
+    Возвращает длительность свечи таймфрейма в секундах (например, "15m" -> 900).
+    """
+    try:
+        return INTERVAL_SECONDS[interval]
+    except KeyError:
+        raise ValueError(f"Неизвестный таймфрейм: {interval}")
+
 user_state: Dict[int, str] = {} 
\ No newline at end of file